@@ -22,6 +22,10 @@
 # flake8: noqa
 
 from .projectcounts import *
+from .daily_cache import *
+from .instrumentation import *
+from .persistent_cache import *
+from .rollup import *
 from .util import *
 
 __version__ = '0.1'
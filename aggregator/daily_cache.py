@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    aggregator.daily_cache
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    This module contains a bounded in-memory cache for daily counts, and a
+    compact representation of daily counts for it.
+
+    Abbreviations are interned in a Vocabulary that maps them to integer ids.
+    DailyCounts then store a day's counts in an array indexed by those ids,
+    so the abbreviation strings are held only once, instead of once per
+    cached day.
+"""
+
+import array
+import collections
+import sys
+import threading
+
+
+def estimate_count_dictionary_size(data):
+    """Estimates the number of bytes a count dictionary occupies in memory.
+
+    The estimate covers the dictionary itself, and its keys and values.
+    Strings and integers that are shared with other objects are counted
+    nonetheless, so the estimate errs on the high side.
+
+    :param data: The count dictionary to estimate the size for.
+    """
+    size = sys.getsizeof(data)
+    for (abbreviation, count) in data.iteritems():
+        size += sys.getsizeof(abbreviation) + sys.getsizeof(count)
+    return size
+
+
+def estimate_counts_size(counts):
+    """Estimates the number of bytes of a day's counts in memory.
+
+    :param counts: The DailyCounts, or count dictionary to estimate the size
+        for.
+    """
+    if isinstance(counts, DailyCounts):
+        return counts.estimate_size()
+    return estimate_count_dictionary_size(counts)
+
+
+class Vocabulary(object):
+    """Thread-safe mapping of abbreviations to consecutive integer ids.
+
+    Ids are handed out in order of first use, starting at 0, and never
+    change.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def intern(self, abbreviation):
+        """Gets the id of an abbreviation, and adds it if needed.
+
+        :param abbreviation: The abbreviation to get the id for.
+        """
+        try:
+            return self._ids[abbreviation]
+        except KeyError:
+            with self._lock:
+                return self._ids.setdefault(abbreviation, len(self._ids))
+
+    def find(self, abbreviation):
+        """Gets the id of an abbreviation.
+
+        If the abbreviation has not been interned, None is returned.
+
+        :param abbreviation: The abbreviation to get the id for.
+        """
+        return self._ids.get(abbreviation)
+
+
+class DailyCounts(object):
+    """Compact, read-only counts of a day, indexed by a Vocabulary's ids.
+
+    Abbreviations that are in the vocabulary, but have no count for the day,
+    read as 0.
+    """
+    __slots__ = ('_vocabulary', '_counts')
+
+    def __init__(self, vocabulary, data):
+        """Creates the compact counts for a count dictionary.
+
+        :param vocabulary: The Vocabulary to intern the abbreviations in.
+        :param data: The count dictionary to take the counts from.
+        """
+        self._vocabulary = vocabulary
+        ids_and_counts = [(vocabulary.intern(abbreviation), count)
+                          for (abbreviation, count) in data.iteritems()]
+        self._counts = array.array('l', [0]) * (
+            max(ids_and_counts)[0] + 1 if ids_and_counts else 0)
+        for (abbreviation_id, count) in ids_and_counts:
+            self._counts[abbreviation_id] = count
+
+    def get(self, abbreviation, default=0):
+        """Gets the count for an abbreviation.
+
+        :param abbreviation: The abbreviation to get the count for.
+        :param default: The value to return, if the abbreviation is not in
+            the vocabulary, or has no slot in this day's counts.
+            (Default: 0)
+        """
+        abbreviation_id = self._vocabulary.find(abbreviation)
+        if abbreviation_id is None or abbreviation_id >= len(self._counts):
+            return default
+        return self._counts[abbreviation_id]
+
+    def estimate_size(self):
+        """Estimates the number of bytes the counts occupy in memory.
+
+        The shared vocabulary is not included.
+        """
+        return sys.getsizeof(self) + sys.getsizeof(self._counts)
+
+
+class DailyCache(object):
+    """Thread-safe least recently used cache for daily counts.
+
+    Entries are evicted in least recently used order, once the cache holds
+    more than max_entries entries, or the entries' estimated sizes add up
+    to more than max_bytes. The most recently set entry is never evicted, so
+    even a single day that exceeds the budget stays available until the
+    next day gets cached.
+
+    The cached values are expected to be tuples whose second item is a
+    DailyCounts or count dictionary, and their sizes are estimated by it.
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        """Creates an empty cache.
+
+        :param max_entries: Maximum number of entries to keep. If None, the
+            number of entries is not limited. (Default: None)
+        :param max_bytes: Maximum sum of the entries' estimated sizes in
+            bytes. If None, the size is not limited. (Default: None)
+        """
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    @property
+    def bytes(self):
+        """The sum of the cached entries' estimated sizes in bytes."""
+        with self._lock:
+            return self._bytes
+
+    def get(self, key):
+        """Gets a cached value, and marks it as most recently used.
+
+        If key is not cached, None is returned.
+
+        :param key: The key to get the value for.
+        """
+        with self._lock:
+            try:
+                (value, size) = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = (value, size)
+            return value
+
+    def set(self, key, value):
+        """Caches a value as most recently used, and evicts as needed.
+
+        :param key: The key to cache the value for.
+        :param value: The tuple to cache. Its second item has to be the
+            DailyCounts, or count dictionary.
+        """
+        size = estimate_counts_size(value[1])
+        with self._lock:
+            try:
+                (old_value, old_size) = self._entries.pop(key)
+                self._bytes -= old_size
+            except KeyError:
+                pass
+            self._entries[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def set_budget(self, max_entries=None, max_bytes=None):
+        """Changes the cache's budget, and evicts as needed.
+
+        :param max_entries: Maximum number of entries to keep. If None, the
+            number of entries is not limited. (Default: None)
+        :param max_bytes: Maximum sum of the entries' estimated sizes in
+            bytes. If None, the size is not limited. (Default: None)
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Drops all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        """Evicts least recently used entries until the budget is met.
+
+        The caller has to hold the lock.
+        """
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and
+                 len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and
+                 self._bytes > self.max_bytes)):
+            (key, (value, size)) = self._entries.popitem(last=False)
+            self._bytes -= size
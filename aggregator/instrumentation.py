@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    aggregator.instrumentation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module contains counters and timers to instrument aggregation runs.
+"""
+
+import collections
+import threading
+
+
+class Statistics(object):
+    """Thread-safe named counters, and per-date timers.
+
+    Counters are created upon first use, so unused counters read as 0.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._date_seconds = {}
+
+    def add(self, name, value=1):
+        """Adds a value to a counter.
+
+        :param name: The name of the counter.
+        :param value: The value to add to the counter. (Default: 1)
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def add_date_seconds(self, date, seconds):
+        """Adds time spent on loading a day.
+
+        :param date: The date that got loaded.
+        :param seconds: The number of seconds it took to load the day.
+        """
+        with self._lock:
+            self._date_seconds[date] = \
+                self._date_seconds.get(date, 0) + seconds
+
+    def get_counters(self):
+        """Gets a dictionary mapping the counters' names to their values."""
+        with self._lock:
+            return dict(self._counters)
+
+    def get_date_seconds(self):
+        """Gets a dictionary mapping dates to the seconds spent loading them.
+        """
+        with self._lock:
+            return dict(self._date_seconds)
+
+    def __getstate__(self):
+        with self._lock:
+            return (dict(self._counters), dict(self._date_seconds))
+
+    def __setstate__(self, state):
+        (counters, date_seconds) = state
+        self._lock = threading.Lock()
+        self._counters = collections.Counter(counters)
+        self._date_seconds = date_seconds
+
+    def snapshot(self):
+        """Gets a copy of the counters and timers.
+
+        Unlike the Statistics itself, the copy can get pickled consistently
+        while other threads keep counting, so it can get passed from a
+        worker process to its parent.
+        """
+        snapshot = Statistics.__new__(Statistics)
+        snapshot.__setstate__(self.__getstate__())
+        return snapshot
+
+    def merge(self, other):
+        """Adds the counters and timers of another Statistics.
+
+        :param other: The Statistics to add the counters and timers of.
+        """
+        (counters, date_seconds) = other.__getstate__()
+        with self._lock:
+            self._counters.update(counters)
+            for (date, seconds) in date_seconds.iteritems():
+                self._date_seconds[date] = \
+                    self._date_seconds.get(date, 0) + seconds
+
+    def reset(self):
+        """Resets all counters and timers."""
+        with self._lock:
+            self._counters.clear()
+            self._date_seconds.clear()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    aggregator.persistent_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module contains functions to persist aggregated daily counts on
+    disk, so they survive the process that computed them.
+
+    Next to a day's cache file, a per-hour cache file may hold the counts of
+    each of the day's hourly files. It allows to re-aggregate a day by
+    reading only the hourly files that have been missing or have changed.
+
+    Several processes on the same host may share a persistent cache. Cache
+    files are written atomically, and a day's lock file allows processes to
+    make sure that only one of them aggregates the day at a time.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import util
+
+# How a persistent cache can be used:
+#   use     -- Read from, and write to the cache.
+#   bypass  -- Neither read from, nor write to the cache.
+#   rebuild -- Do not read from the cache, but write freshly aggregated data
+#              to it.
+PERSISTENT_CACHE_MODES = ['use', 'bypass', 'rebuild']
+
+# The encoding that byte strings (abbreviations, and file names) get decoded
+# with for JSON. Hourly files need not be UTF-8, and latin-1 maps each byte
+# to a code point, so the byte strings are read back unchanged. Cache files
+# without 'encoding' have been written with UTF-8.
+PERSISTENT_CACHE_ENCODING = 'latin-1'
+
+
+def get_persistent_cache_file_abs(cache_dir_abs, source_dir_abs, date,
+                                  output_projectviews):
+    """Gets the absolute name of a day's persistent cache file.
+
+    :param cache_dir_abs: Absolute directory of the persistent cache.
+    :param source_dir_abs: Absolute directory the hourly files get read from.
+    :param date: The date to get the cache file for.
+    :param output_projectviews: If True, get the cache file for projectviews
+        instead of projectcounts.
+    """
+    return os.path.join(
+        cache_dir_abs,
+        hashlib.sha1(source_dir_abs).hexdigest(),
+        'projectviews' if output_projectviews else 'projectcounts',
+        date.strftime('%Y'),
+        date.isoformat() + '.json')
+
+
+def get_persistent_cache_hourly_file_abs(cache_file_abs):
+    """Gets the absolute name of the per-hour cache file for a cache file.
+
+    :param cache_file_abs: Absolute name of the day's cache file.
+    """
+    return cache_file_abs[:-len('.json')] + '.hours.json'
+
+
+def _read_entry(cache_file_abs):
+    """Reads the JSON entry of a cache file.
+
+    If there is no cache file, or it cannot be read, None is returned.
+
+    :param cache_file_abs: Absolute name of the cache file to read.
+    """
+    try:
+        with open(cache_file_abs, 'r') as cache_file:
+            return json.load(cache_file)
+    except IOError:
+        return None
+    except ValueError:
+        logging.warn("Ignoring malformed persistent cache file %s" % (
+            cache_file_abs))
+        return None
+
+
+def _get_encoding(entry):
+    """Gets the encoding that a cache file's byte strings got decoded with.
+
+    :param entry: The JSON entry of the cache file.
+    """
+    return entry.get('encoding', 'utf-8')
+
+
+def _decode_abbreviations(abbreviations, encoding):
+    """Turns a cache file's list of abbreviations into a set of str.
+
+    :param abbreviations: The list of abbreviations to decode, or None.
+    :param encoding: The encoding of the cache file (see _get_encoding).
+    """
+    if abbreviations is None:
+        return None
+    return frozenset(
+        abbreviation.encode(encoding) for abbreviation in abbreviations)
+
+
+def _decode_counts(data, encoding):
+    """Turns a cache file's count dictionary into one keyed by str.
+
+    :param data: The count dictionary to decode.
+    :param encoding: The encoding of the cache file (see _get_encoding).
+    """
+    return dict((abbreviation.encode(encoding), count)
+                for (abbreviation, count) in data.iteritems())
+
+
+def _decode_fingerprint(fingerprint, encoding):
+    """Turns a cache file's fingerprint into one with str file names.
+
+    :param fingerprint: The fingerprint to decode, or None.
+    :param encoding: The encoding of the cache file (see _get_encoding).
+    """
+    if fingerprint is None:
+        return None
+    return [[file_name.encode(encoding), size, mtime]
+            for (file_name, size, mtime) in fingerprint]
+
+
+def _encode_entry(entry):
+    """Turns an entry into the JSON for a cache file.
+
+    :param entry: The dictionary to encode. Its byte strings get decoded
+        with PERSISTENT_CACHE_ENCODING.
+    """
+    entry['encoding'] = PERSISTENT_CACHE_ENCODING
+    return json.dumps(entry, separators=(',', ':'),
+                      encoding=PERSISTENT_CACHE_ENCODING)
+
+
+def read_persistently_cached_daily_data(cache_file_abs, fingerprint):
+    """Reads a day's persistently cached counts.
+
+    The returned tuple holds the set of abbreviations the counts got
+    filtered to (None, if the counts have not been filtered), and the
+    count dictionary.
+
+    If there is no cache file, the cache file cannot be read, or it has been
+    written for hourly files with a different fingerprint, None is returned.
+
+    :param cache_file_abs: Absolute name of the cache file to read.
+    :param fingerprint: List of [file name, size, mtime] lists of the hourly
+        files the counts would get aggregated from.
+    """
+    entry = _read_entry(cache_file_abs)
+    if entry is None:
+        return None
+
+    encoding = _get_encoding(entry)
+    if _decode_fingerprint(entry.get('fingerprint'), encoding) != \
+            fingerprint:
+        logging.debug("Persistent cache file %s is stale" % (cache_file_abs))
+        return None
+
+    return (_decode_abbreviations(entry['abbreviations'], encoding),
+            _decode_counts(entry['data'], encoding))
+
+
+def read_persistently_cached_hours(cache_file_abs):
+    """Reads the hours that made up a day's persistently cached counts.
+
+    If there is no cache file, or it cannot be read, None is returned.
+    Otherwise, the sorted list of hours (0-23) whose hourly files went into
+    the cached counts is returned.
+
+    :param cache_file_abs: Absolute name of the cache file to read.
+    """
+    entry = _read_entry(cache_file_abs)
+    if entry is None:
+        return None
+    return entry.get('hours')
+
+
+def write_persistently_cached_daily_data(cache_file_abs, fingerprint,
+                                         abbreviations, daily_data,
+                                         hours=None):
+    """Writes a day's counts to the persistent cache.
+
+    The cache file is written atomically, so concurrent readers either see
+    the old, or the new cache file, but never a partial one.
+
+    :param cache_file_abs: Absolute name of the cache file to write.
+    :param fingerprint: List of [file name, size, mtime] lists of the hourly
+        files the counts have been aggregated from.
+    :param abbreviations: Set of abbreviations the counts got filtered to, or
+        None if the counts have not been filtered.
+    :param daily_data: The count dictionary to write.
+    :param hours: List of the hours (0-23) whose hourly files went into
+        daily_data. (Default: None)
+    """
+    entry = {
+        'fingerprint': fingerprint,
+        'abbreviations': None if abbreviations is None
+        else sorted(abbreviations),
+        'data': daily_data,
+        'hours': hours,
+    }
+
+    util.write_file_atomically(cache_file_abs, _encode_entry(entry))
+
+
+def read_persistently_cached_hourly_data(cache_file_abs):
+    """Reads a day's persistently cached per-hour counts.
+
+    The returned tuple holds the set of abbreviations the counts got
+    filtered to (None, if the counts have not been filtered), and a
+    dictionary mapping (file name, size, mtime) tuples of hourly files to
+    their count dictionaries.
+
+    If there is no per-hour cache file, or it cannot be read, None is
+    returned.
+
+    :param cache_file_abs: Absolute name of the day's cache file. The name of
+        the per-hour cache file is derived from it.
+    """
+    entry = _read_entry(get_persistent_cache_hourly_file_abs(cache_file_abs))
+    if entry is None:
+        return None
+
+    encoding = _get_encoding(entry)
+    hourly_datas = {}
+    for (fingerprint_item, hourly_data) in entry['hours']:
+        (file_name, size, mtime) = fingerprint_item
+        hourly_datas[(file_name.encode(encoding), size, mtime)] = \
+            _decode_counts(hourly_data, encoding)
+    return (_decode_abbreviations(entry['abbreviations'], encoding),
+            hourly_datas)
+
+
+def write_persistently_cached_hourly_data(cache_file_abs, fingerprint,
+                                          abbreviations, hourly_datas):
+    """Writes a day's per-hour counts to the persistent cache.
+
+    The per-hour cache file is written atomically.
+
+    :param cache_file_abs: Absolute name of the day's cache file. The name of
+        the per-hour cache file is derived from it.
+    :param fingerprint: List of [file name, size, mtime] lists of the hourly
+        files the counts have been aggregated from.
+    :param abbreviations: Set of abbreviations the counts got filtered to, or
+        None if the counts have not been filtered.
+    :param hourly_datas: List holding the count dictionary for each of the
+        hourly files, in the same order as fingerprint.
+    """
+    entry = {
+        'abbreviations': None if abbreviations is None
+        else sorted(abbreviations),
+        'hours': zip(fingerprint, hourly_datas),
+    }
+
+    util.write_file_atomically(
+        get_persistent_cache_hourly_file_abs(cache_file_abs),
+        _encode_entry(entry))
+
+
+def remove_persistently_cached_hourly_data(cache_file_abs):
+    """Removes a day's per-hour cache file, if it exists.
+
+    :param cache_file_abs: Absolute name of the day's cache file. The name of
+        the per-hour cache file is derived from it.
+    """
+    try:
+        os.unlink(get_persistent_cache_hourly_file_abs(cache_file_abs))
+    except OSError:
+        pass
+
+
+def lock_persistently_cached_day(cache_file_abs, blocking=True):
+    """Locks a day's cache file against other processes.
+
+    The lock is an exclusive flock on a lock file next to the cache file. It
+    gets released when unlock_persistently_cached_day is called, or the
+    process terminates.
+
+    The returned file object has to be passed to
+    unlock_persistently_cached_day. If blocking is False, and another
+    process holds the lock, None is returned.
+
+    :param cache_file_abs: Absolute name of the day's cache file.
+    :param blocking: If True, wait until the lock is available.
+        (Default: True)
+    """
+    lock_file_abs = cache_file_abs[:-len('.json')] + '.lock'
+    lock_dir_abs = os.path.dirname(lock_file_abs)
+    try:
+        os.makedirs(lock_dir_abs)
+    except OSError:
+        if not os.path.isdir(lock_dir_abs):
+            raise
+
+    lock_file = open(lock_file_abs, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (
+            0 if blocking else fcntl.LOCK_NB))
+    except IOError as e:
+        lock_file.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return lock_file
+
+
+def unlock_persistently_cached_day(lock_file):
+    """Releases a lock of lock_persistently_cached_day.
+
+    :param lock_file: The file object returned when locking the day.
+    """
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
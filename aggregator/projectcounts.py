@@ -22,33 +22,397 @@
 
 
 import logging
+import bz2
 import calendar
+import collections
 import datetime
+import functools
+import gzip
+import itertools
 import os
 import glob
+import multiprocessing
+import multiprocessing.pool
+import stat
+import sys
+import time
 import util
+import daily_cache
+import instrumentation
+import persistent_cache
+import rollup
 
 PROJECTVIEWS_STRFTIME_PATTERN = ('%%Y%s%%Y-%%m%sprojectviews-%%Y%%m%%d-'
                                  '%%H0000' % (os.sep, os.sep))
 PROJECTCOUNTS_STRFTIME_PATTERN = ('%%Y%s%%Y-%%m%sprojectcounts-%%Y%%m%%d-'
                                   '%%H0000' % (os.sep, os.sep))
 
+PROJECTVIEWS_ROLLUP_STRFTIME_PATTERN = ('%%Y%s%%Y-%%m%sprojectviews-%%Y%%m%%d.'
+                                        'rollup' % (os.sep, os.sep))
+PROJECTCOUNTS_ROLLUP_STRFTIME_PATTERN = ('%%Y%s%%Y-%%m%sprojectcounts-'
+                                         '%%Y%%m%%d.rollup' % (os.sep, os.sep))
+
+# Suffixes of compressed variants of hourly files, and how to open them as
+# streams. The uncompressed file is represented by the empty suffix.
+HOURLY_FILE_OPENERS = [
+    ('', open),
+    ('.gz', gzip.open),
+    ('.bz2', bz2.BZ2File),
+]
+
 CSV_HEADER = 'Date,Total,Desktop site,Mobile site,Zero site'
 
 DATE_MOBILE_ADDED = datetime.date(2014, 9, 23)
 
-cache = {}
+# Number of days aggregate_for_dates reads ahead when reading concurrently.
+DATES_IN_FLIGHT = 2
+
+# Maximum number of days update_per_project_csvs_for_dates locks in the
+# persistent cache at once.
+LOCKED_DATES_BATCH = 64
+
+# In-memory cache of daily counts, keyed by (source_dir_abs,
+# output_projectviews, date). See set_cache_budget to bound it.
+cache = daily_cache.DailyCache()
+
+# Interned abbreviations of the daily counts in the cache.
+vocabulary = daily_cache.Vocabulary()
+
+# Counters and timers for reading and caching daily counts. See
+# get_statistics.
+statistics = instrumentation.Statistics()
+
+# Inventory of the source directories that got listed during this run. Maps
+# absolute directory names to dictionaries that map the names of the
+# directory's files to their stat results (None, until the file is needed).
+source_inventory = {}
+
+# Absolute directory of the persistent daily aggregate cache (None disables
+# it), and how to use it (one of persistent_cache.PERSISTENT_CACHE_MODES).
+persistent_cache_dir_abs = None
+persistent_cache_mode = 'use'
+
+# List of the argument tuples for _update_per_project_csv that worker
+# processes of update_per_project_csvs_for_dates pick from. It is set before
+# the workers get forked, so they inherit it (along with the cached days)
+# instead of having it pickled.
+per_project_csv_updates = None
 
 
 def clear_cache():
-    global cache
+    global source_inventory
+    global vocabulary
     logging.debug("Clearing projectcounts cache")
-    cache = {}
+    cache.clear()
+    vocabulary = daily_cache.Vocabulary()
+    source_inventory = {}
+
+
+def set_cache_budget(max_days=None, max_bytes=None):
+    """Bounds the in-memory cache of daily counts.
+
+    Once the cache exceeds the budget, the least recently used days are
+    evicted. Evicted days have to be read again if they are needed later
+    on. As update_per_project_csvs_for_dates needs every day once per
+    project, the budget should cover the number of days to aggregate, or a
+    persistent cache (see set_persistent_cache) should be configured.
+
+    :param max_days: Maximum number of days to keep in the cache. If None,
+        the number of days is not limited. (Default: None)
+    :param max_bytes: Maximum estimated memory in bytes for the cached
+        days. If None, the memory is not limited. (Default: None)
+    """
+    cache.set_budget(max_days, max_bytes)
+
+
+def set_persistent_cache(cache_dir_abs, mode='use'):
+    """Configures the persistent daily aggregate cache.
+
+    If configured, daily aggregates are looked up in the persistent cache
+    before reading hourly files, and freshly aggregated days are written to
+    it. Cached days are invalidated if the size or mtime of their hourly
+    files changes.
+
+    Concurrently running processes on the same host can share a persistent
+    cache. A day is aggregated by only one of them at a time. The others
+    wait for it, and reuse its result.
+
+    If mode is not one of persistent_cache.PERSISTENT_CACHE_MODES, a
+    ValueError is raised.
+
+    :param cache_dir_abs: Absolute directory to keep the persistent cache in.
+        If None, the persistent cache is disabled.
+    :param mode: 'use' to read from and write to the cache, 'bypass' to
+        ignore the cache, or 'rebuild' to only write to it. (Default: 'use')
+    """
+    global persistent_cache_dir_abs, persistent_cache_mode
+    if mode not in persistent_cache.PERSISTENT_CACHE_MODES:
+        raise ValueError("Unknown persistent cache mode '%s'" % (mode))
+    persistent_cache_dir_abs = cache_dir_abs
+    persistent_cache_mode = mode
+
+
+def get_statistics():
+    """Gets the counters and timers for reading and caching daily counts.
+
+    The returned dictionary holds the following counters:
+
+      * cache_hits, cache_misses: Lookups of days in the in-memory cache.
+      * persistent_cache_hits, persistent_cache_misses: Lookups of days in
+        the persistent cache.
+      * hourly_files_read, rollup_files_read: Number of files read.
+      * bytes_read: Bytes read from hourly files (after decompression), and
+        rollup files.
+      * lines_parsed, malformed_lines: Lines of hourly files.
+      * preload_seconds: Time update_per_project_csvs_for_dates spent on
+        reading days before updating the CSVs.
+      * csv_seconds: Time update_per_project_csvs_for_dates spent on updating
+        the CSVs.
+      * csvs_skipped: Per project CSVs that update_per_project_csvs_for_dates
+        skipped, as they were complete.
+
+    Additionally, 'date_seconds' maps each date that got read from rollup or
+    hourly files to the seconds it took to load it. If days are read
+    concurrently, their times overlap.
+
+    Counters are accumulated since the last call of reset_statistics.
+    """
+    counters = dict.fromkeys([
+        'cache_hits', 'cache_misses', 'persistent_cache_hits',
+        'persistent_cache_misses', 'hourly_files_read', 'rollup_files_read',
+        'bytes_read', 'lines_parsed', 'malformed_lines', 'preload_seconds',
+        'csv_seconds', 'csvs_skipped'], 0)
+    counters.update(statistics.get_counters())
+    counters['date_seconds'] = statistics.get_date_seconds()
+    return counters
+
+
+def get_statistics_summary():
+    """Gets a human readable summary of get_statistics as list of lines."""
+    counters = get_statistics()
+    date_seconds = counters['date_seconds']
+
+    cache_lookups = counters['cache_hits'] + counters['cache_misses']
+    lines = [
+        "Daily cache: %d hits, %d misses (%.1f%% hit rate)" % (
+            counters['cache_hits'], counters['cache_misses'],
+            100.0 * counters['cache_hits'] / cache_lookups
+            if cache_lookups else 0),
+        "Persistent cache: %d hits, %d misses" % (
+            counters['persistent_cache_hits'],
+            counters['persistent_cache_misses']),
+        "Read %d hourly files and %d rollup files (%d bytes)" % (
+            counters['hourly_files_read'], counters['rollup_files_read'],
+            counters['bytes_read']),
+        "Parsed %d lines (%d malformed)" % (
+            counters['lines_parsed'], counters['malformed_lines']),
+        ]
+    if date_seconds:
+        (slowest_date, slowest_seconds) = max(
+            date_seconds.iteritems(), key=lambda item: item[1])
+        lines.append(
+            "Loaded %d dates in %.3fs (mean %.3fs, slowest %s with %.3fs)" % (
+                len(date_seconds), sum(date_seconds.itervalues()),
+                sum(date_seconds.itervalues()) / len(date_seconds),
+                slowest_date, slowest_seconds))
+    lines.append("Spent %.3fs on reading days up front, and %.3fs on "
+                 "updating CSVs (%d complete CSVs skipped)" % (
+                     counters['preload_seconds'], counters['csv_seconds'],
+                     counters['csvs_skipped']))
+    return lines
+
+
+def reset_statistics():
+    """Resets the counters and timers of get_statistics."""
+    statistics.reset()
+
+
+def _get_source_dir_inventory(dir_abs):
+    """Gets the names of the files in a source directory.
+
+    The directory is listed only upon the first call. Later calls answer
+    from the inventory, so probing for files that do not exist does not
+    cost a round-trip to the file system. If the directory does not exist,
+    it is considered empty.
+
+    The returned dictionary maps the file names to their stat results, or
+    None if the file has not yet been stat'ed.
+
+    :param dir_abs: Absolute name of the directory to get the inventory for.
+    """
+    try:
+        return source_inventory[dir_abs]
+    except KeyError:
+        pass
+
+    try:
+        file_names = os.listdir(dir_abs)
+    except OSError:
+        file_names = []
+    dir_inventory = dict.fromkeys(file_names)
+    source_inventory[dir_abs] = dir_inventory
+    return dir_inventory
+
+
+def _stat_source_file(file_abs):
+    """Gets the stat result of a regular file in a source directory.
+
+    Files get stat'ed at most once per run. If the file does not exist, or
+    is not a regular file, None is returned.
+
+    :param file_abs: Absolute name of the file to stat.
+    """
+    (dir_abs, file_name) = os.path.split(file_abs)
+    dir_inventory = _get_source_dir_inventory(dir_abs)
+    try:
+        file_stat = dir_inventory[file_name]
+    except KeyError:
+        return None
+
+    if file_stat is None:
+        try:
+            file_stat = os.stat(file_abs)
+        except OSError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            dir_inventory.pop(file_name, None)
+            return None
+        dir_inventory[file_name] = file_stat
+    return file_stat
+
+
+def _find_hourly_file(hourly_file_abs):
+    """Finds the variant of an hourly file that is cheapest to read.
+
+    Besides the plain hourly file, gzip and bzip2 compressed variants (with
+    suffixes '.gz', and '.bz2') are considered. The smallest existing variant
+    is returned, as reading bytes is the bottleneck when reading from HDFS.
+    Upon equal sizes, the uncompressed file wins.
+
+    If no variant exists, None is returned.
+
+    :param hourly_file_abs: Absolute name of the uncompressed hourly file.
+    """
+    best_file_abs = None
+    best_size = None
+    for (suffix, opener) in HOURLY_FILE_OPENERS:
+        candidate_abs = hourly_file_abs + suffix
+        candidate_stat = _stat_source_file(candidate_abs)
+        if candidate_stat is None:
+            continue
+        if best_size is None or candidate_stat.st_size < best_size:
+            best_file_abs = candidate_abs
+            best_size = candidate_stat.st_size
+    return best_file_abs
+
+
+def _open_hourly_file(hourly_file_abs):
+    """Opens a (maybe compressed) hourly file for reading.
+
+    Compressed files are decompressed while streaming through them, so no
+    temporary files are needed.
+
+    :param hourly_file_abs: Absolute name of the hourly file to open.
+    """
+    for (suffix, opener) in reversed(HOURLY_FILE_OPENERS):
+        if hourly_file_abs.endswith(suffix):
+            return opener(hourly_file_abs, 'rb')
+
+
+def _aggregate_hourly_lines(hourly_file_abs, lines, data, abbreviations):
+    """Aggregates lowercased lines of an hourly file line by line.
+
+    This is the slow path of _aggregate_hourly_file, that is used if the file
+    has malformed lines. Malformed lines are logged and skipped.
+
+    :param hourly_file_abs: Absolute name of the hourly file the lines stem
+        from.
+    :param lines: The lowercased lines to aggregate.
+    :param data: The dictionary to add the lines' counts to.
+    :param abbreviations: If not None, only lines for those abbreviations are
+        aggregated.
+    """
+    for line in lines:
+        fields = line.split(' ')
+
+        if len(fields) != 4:
+            statistics.add('malformed_lines')
+            logging.warn("File %s as an incorrect line: %s" % (
+                hourly_file_abs, line))
+            # Kept in case we want to get back to raising an error
+            # raise RuntimeError("Malformed line in '%s'" % (
+            #    hourly_file))
+        else:
+            abbreviation = fields[0]
+            if abbreviations is not None and \
+                    abbreviation not in abbreviations:
+                continue
+            count = int(fields[2])
+
+            data[abbreviation] = data.get(abbreviation, 0) + count
+
+
+def _aggregate_hourly_file(hourly_file_abs, data=None, abbreviations=None):
+    """Aggregates a single hourly projectcounts file.
+
+    The counts of the file are added to data, which is returned. If data is
+    None, a new dictionary is used.
+
+    The file is read in one go, and lowercased as a whole. If all lines are
+    well-formed (i.e.: have four space separated fields), the fields are
+    obtained by a single split of the whole file, and the counts get converted
+    to integers in bulk. Otherwise, the file is aggregated line by line, and
+    malformed lines are logged and skipped.
+
+    If abbreviations is not None, lines for other abbreviations are skipped
+    before converting their counts to integers.
+
+    :param hourly_file_abs: Absolute name of the hourly file to read.
+    :param data: The dictionary to add the file's counts to. (Default: None)
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        aggregate. If None, all abbreviations are aggregated. (Default: None)
+    """
+    if data is None:
+        data = {}
+
+    logging.debug("Reading %s" % (hourly_file_abs))
+
+    with _open_hourly_file(hourly_file_abs) as hourly_file:
+        content = hourly_file.read().lower()
+
+    lines = content.split('\n')
+    if lines[-1] == '':
+        # The final line break terminates the last line and does not start a
+        # new one.
+        lines.pop()
+
+    statistics.add('hourly_files_read')
+    statistics.add('bytes_read', len(content))
+    statistics.add('lines_parsed', len(lines))
+
+    if set(itertools.imap(str.count, lines, itertools.repeat(' '))) \
+            <= set([3]):
+        fields = ' '.join(lines).split(' ')
+        if abbreviations is None:
+            counts = itertools.izip(fields[0::4], map(int, fields[2::4]))
+        else:
+            counts = [(abbreviation, int(count))
+                      for (abbreviation, count)
+                      in itertools.izip(fields[0::4], fields[2::4])
+                      if abbreviation in abbreviations]
+        get = data.get
+        for (abbreviation, count) in counts:
+            data[abbreviation] = get(abbreviation, 0) + count
+    else:
+        _aggregate_hourly_lines(hourly_file_abs, lines, data, abbreviations)
+
+    return data
 
 
 def aggregate_for_date(
         source_dir_abs, date,
-        allow_bad_data=False, output_projectviews=False):
+        allow_bad_data=False, output_projectviews=False, jobs=1,
+        abbreviations=None):
 
     """Aggregates hourly projectcounts for a given day.
 
@@ -59,9 +423,28 @@ def aggregate_for_date(
     If one of the required 24 hourly files do not exist, cannot be read, or
     some other issue occurs, a RuntimeError is raised.
 
+    Hourly files may also be gzip or bzip2 compressed (with suffix '.gz', or
+    '.bz2'). If several variants of an hourly file exist, the smallest one is
+    read.
+
+    If a daily rollup file (see rollup_for_date) exists for the day, it is
+    read instead of the hourly files.
+
+    Which hourly files exist is looked up in an inventory of the source
+    directories, which lists each directory only once. Files that get added
+    after a directory has been listed are only seen after clear_cache.
+
     The returned dictonary is keyed by the lowercase webstatscollector
     abbreviation, and values are the total counts for this day.
 
+    If jobs is bigger than 1, the hourly files are read and parsed
+    concurrently by a pool of that many threads, and the per hour counts get
+    merged afterwards. The result is the same as for jobs = 1.
+
+    If abbreviations is not None, only counts for those abbreviations are
+    aggregated. Lines for other abbreviations are skipped early, so they
+    neither cost parsing time nor memory.
+
     :param source_dir_abs: Absolute directory to read the hourly projectcounts
         files from.
     :param date: The date to get the count for.
@@ -69,13 +452,61 @@ def aggregate_for_date(
         bad or missing. (Default: False)
     :param output_projectviews: If True, name the output files projectviews
         instead of projectcounts. (Default: False)
+    :param jobs: Number of hourly files to read concurrently. (Default: 1)
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        aggregate. If None, all abbreviations are aggregated. (Default: None)
     """
+    start_time = time.time()
+    rollup_file_abs = get_rollup_file_abs(
+        source_dir_abs, date, output_projectviews)
+    if _stat_source_file(rollup_file_abs) is not None:
+        daily_data = _aggregate_rollup(rollup_file_abs, allow_bad_data,
+                                       abbreviations)
+        statistics.add_date_seconds(date, time.time() - start_time)
+        return daily_data
+
     daily_data = {}
+    hourly_files_abs = [hourly_file_abs for (hour, hourly_file_abs)
+                        in _get_hourly_files(source_dir_abs, date,
+                                             allow_bad_data,
+                                             output_projectviews)]
+
+    if jobs > 1:
+        for hourly_data in _aggregate_hourly_files(hourly_files_abs, jobs,
+                                                   abbreviations):
+            _merge_counts(daily_data, hourly_data)
+    else:
+        # Reading into a single dictionary spares the per hour dictionaries.
+        for hourly_file_abs in hourly_files_abs:
+            _aggregate_hourly_file(hourly_file_abs, daily_data, abbreviations)
+
+    statistics.add_date_seconds(date, time.time() - start_time)
+    return daily_data
+
+
+def _get_hourly_files(source_dir_abs, date, allow_bad_data,
+                      output_projectviews):
+    """Gets the readable hourly files for a given day.
+
+    The returned list holds (hour, hourly_file_abs) pairs ordered by hour.
+
+    If one of the required 24 hourly files does not exist, and bad data is
+    not allowed, a RuntimeError is raised.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param date: The date to get the hourly files for.
+    :param allow_bad_data: If True, skip missing hourly files instead of
+        raising a RuntimeError.
+    :param output_projectviews: If True, get projectviews hourly files
+        instead of projectcounts hourly files.
+    """
     if output_projectviews:
         output_format = PROJECTVIEWS_STRFTIME_PATTERN
     else:
         output_format = PROJECTCOUNTS_STRFTIME_PATTERN
 
+    hourly_files = []
     for hour in range(24):
         # Initialize with the relevant hour start ...
         hourly_file_datetime = datetime.datetime(date.year, date.month,
@@ -88,7 +519,8 @@ def aggregate_for_date(
             source_dir_abs,
             hourly_file_datetime.strftime(output_format))
 
-        if not os.path.isfile(hourly_file_abs):
+        readable_hourly_file_abs = _find_hourly_file(hourly_file_abs)
+        if readable_hourly_file_abs is None:
             if allow_bad_data:
                 # The file does not exist, but bad data is explicitly
                 # allowed, so we continue aggregating
@@ -97,34 +529,698 @@ def aggregate_for_date(
                 raise RuntimeError("'%s' is not an existing file" % (
                     hourly_file_abs))
 
-        logging.debug("Reading %s" % (hourly_file_abs))
+        hourly_files.append((hour, readable_hourly_file_abs))
 
-        with open(hourly_file_abs, 'r') as hourly_file:
-            for line in hourly_file:
-                fields = line.split(' ')
+    return hourly_files
 
-                if len(fields) != 4:
-                    logging.warn("File %s as an incorrect line: %s" % (
-                        hourly_file_abs, line))
-                    # Kept in case we want to get back to raising an error
-                    # raise RuntimeError("Malformed line in '%s'" % (
-                    #    hourly_file))
-                else:
-                    abbreviation = fields[0].lower()
-                    count = int(fields[2])
 
-                    daily_data[abbreviation] = daily_data.get(abbreviation, 0) \
-                        + count
+def get_rollup_file_abs(source_dir_abs, date, output_projectviews):
+    """Gets the absolute name of a day's rollup file.
 
+    :param source_dir_abs: Absolute directory of the rollup files.
+    :param date: The date to get the rollup file for.
+    :param output_projectviews: If True, get the projectviews rollup file
+        instead of the projectcounts rollup file.
+    """
+    if output_projectviews:
+        output_format = PROJECTVIEWS_ROLLUP_STRFTIME_PATTERN
+    else:
+        output_format = PROJECTCOUNTS_ROLLUP_STRFTIME_PATTERN
+    return os.path.join(source_dir_abs, date.strftime(output_format))
+
+
+def _aggregate_rollup(rollup_file_abs, allow_bad_data, abbreviations):
+    """Gets a day's count dictionary from a daily rollup file.
+
+    If the rollup file lacks hours, and bad data is not allowed, a
+    RuntimeError is raised.
+
+    :param rollup_file_abs: Absolute name of the rollup file to read.
+    :param allow_bad_data: If True, accept rollup files that lack hours.
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        aggregate. If None, all abbreviations are aggregated.
+    """
+    logging.debug("Reading %s" % (rollup_file_abs))
+    (hours, daily_data) = rollup.read_daily_rollup(rollup_file_abs)
+    statistics.add('rollup_files_read')
+    statistics.add('bytes_read', os.path.getsize(rollup_file_abs))
+    if len(hours) != 24 and not allow_bad_data:
+        raise RuntimeError("'%s' lacks hours %s" % (
+            rollup_file_abs, sorted(set(range(24)) - set(hours))))
+
+    if abbreviations is not None:
+        daily_data = dict((abbreviation, count)
+                          for (abbreviation, count) in daily_data.iteritems()
+                          if abbreviation in abbreviations)
     return daily_data
 
 
+def rollup_for_date(source_dir_abs, rollup_dir_abs, date,
+                    allow_bad_data=False, output_projectviews=False,
+                    hourly_columns=False, jobs=1):
+    """Converts a day's hourly files into a daily rollup file.
+
+    The rollup file is written to rollup_dir_abs, using the same directory
+    layout as the hourly files. As aggregate_for_date reads rollup files
+    instead of hourly files if they exist, rollup_dir_abs can afterwards be
+    used as source directory.
+
+    If one of the required 24 hourly files do not exist, and bad data is not
+    allowed, a RuntimeError is raised. If bad data is allowed, the rollup file
+    records which hours it got computed from.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param rollup_dir_abs: Absolute directory to write the rollup file to.
+    :param date: The date to compute the rollup file for.
+    :param allow_bad_data: If True, do not bail out, if some hourly files
+        are missing. (Default: False)
+    :param output_projectviews: If True, convert projectviews hourly files
+        instead of projectcounts hourly files. (Default: False)
+    :param hourly_columns: If True, also store the per-hour counts in the
+        rollup file. (Default: False)
+    :param jobs: Number of hourly files to read concurrently. (Default: 1)
+    """
+    hourly_files = _get_hourly_files(
+        source_dir_abs, date, allow_bad_data, output_projectviews)
+    hours = [hour for (hour, hourly_file_abs) in hourly_files]
+    hourly_datas = _aggregate_hourly_files(
+        [hourly_file_abs for (hour, hourly_file_abs) in hourly_files], jobs,
+        None)
+
+    daily_data = {}
+    for hourly_data in hourly_datas:
+        _merge_counts(daily_data, hourly_data)
+
+    rollup_file_abs = get_rollup_file_abs(
+        rollup_dir_abs, date, output_projectviews)
+    logging.debug("Writing %s" % (rollup_file_abs))
+    rollup.write_daily_rollup(
+        rollup_file_abs, hours, daily_data,
+        hourly_datas if hourly_columns else None)
+    # The rollup directory may be a source directory as well, so its
+    # inventory would lack the new file.
+    source_inventory.pop(os.path.dirname(rollup_file_abs), None)
+
+
+def _aggregate_hourly_files(hourly_files_abs, jobs, abbreviations):
+    """Gets the count dictionaries of hourly files.
+
+    The returned list holds the count dictionary of each of the hourly
+    files, in the same order as hourly_files_abs.
+
+    :param hourly_files_abs: List of absolute names of the hourly files to
+        read.
+    :param jobs: Number of hourly files to read concurrently.
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        aggregate. If None, all abbreviations are aggregated.
+    """
+    if jobs > 1 and len(hourly_files_abs) > 1:
+        pool = multiprocessing.pool.ThreadPool(
+            min(jobs, len(hourly_files_abs)))
+        try:
+            return pool.map(
+                functools.partial(_aggregate_hourly_file,
+                                  abbreviations=abbreviations),
+                hourly_files_abs)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return [_aggregate_hourly_file(hourly_file_abs, None, abbreviations)
+            for hourly_file_abs in hourly_files_abs]
+
+
+def _merge_counts(data, other_data):
+    """Adds the counts of one count dictionary to another one.
+
+    :param data: The dictionary to add the counts to.
+    :param other_data: The dictionary to add the counts from.
+    """
+    get = data.get
+    for (abbreviation, count) in other_data.iteritems():
+        data[abbreviation] = get(abbreviation, 0) + count
+
+
+def _aggregate_for_date_list(source_dir_abs, dates, bad_dates,
+                             output_projectviews, jobs, abbreviations):
+    """Aggregates hourly projectcounts for a list of days.
+
+    See aggregate_for_dates. The only difference is that this function
+    accepts an arbitrary iterable of dates.
+    """
+    if jobs <= 1:
+        for date in dates:
+            yield (date, aggregate_for_date(
+                source_dir_abs, date, date in bad_dates, output_projectviews,
+                1, abbreviations))
+        return
+
+    read_hourly_file = functools.partial(_aggregate_hourly_file,
+                                         abbreviations=abbreviations)
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        # Deque of (date, start time, hourly results, error) for the days
+        # that have been handed to the pool, but have not been yielded yet.
+        in_flight = collections.deque()
+        dates = iter(dates)
+        while True:
+            while len(in_flight) < DATES_IN_FLIGHT:
+                try:
+                    date = next(dates)
+                except StopIteration:
+                    break
+                rollup_file_abs = get_rollup_file_abs(
+                    source_dir_abs, date, output_projectviews)
+                start_time = time.time()
+                if _stat_source_file(rollup_file_abs) is not None:
+                    in_flight.append((date, start_time, [pool.apply_async(
+                        _aggregate_rollup, (rollup_file_abs,
+                                            date in bad_dates,
+                                            abbreviations))], None))
+                    continue
+                try:
+                    hourly_files = _get_hourly_files(
+                        source_dir_abs, date, date in bad_dates,
+                        output_projectviews)
+                except RuntimeError as e:
+                    # The error is raised once the day is due, so earlier
+                    # days still get yielded. Later days are not needed
+                    # anymore.
+                    in_flight.append((date, start_time, None, e))
+                    dates = iter([])
+                    break
+                in_flight.append((date, start_time, [
+                    pool.apply_async(read_hourly_file, (hourly_file_abs,))
+                    for (hour, hourly_file_abs) in hourly_files], None))
+
+            if not in_flight:
+                break
+
+            (date, start_time, hourly_results, error) = in_flight.popleft()
+            if error is not None:
+                raise error
+
+            daily_data = {}
+            for hourly_result in hourly_results:
+                _merge_counts(daily_data, hourly_result.get())
+            statistics.add_date_seconds(date, time.time() - start_time)
+            yield (date, daily_data)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def aggregate_for_dates(source_dir_abs, first_date, last_date, bad_dates=[],
+                        output_projectviews=False, jobs=1,
+                        abbreviations=None, prefetch_dates=0):
+    """Aggregates hourly projectcounts for a range of days.
+
+    This function is a generator that yields (date, daily_data) pairs for
+    each day from first_date up to (and including) last_date in order, where
+    daily_data is the dictionary that aggregate_for_date would return for
+    the day. Bad data is allowed for days in bad_dates.
+
+    If jobs is bigger than 1, all hourly files of the range are streamed
+    through a single pool of that many reader threads. While a day is getting
+    merged, the hourly files of the next day are already being read. At most
+    DATES_IN_FLIGHT days are read ahead.
+
+    If prefetch_dates is bigger than 0, a background thread keeps aggregating
+    up to that many of the following days, while the caller is processing
+    the yielded day.
+
+    If the hourly files of a day are missing, the RuntimeError is raised
+    only once that day is due, so all previous days have been yielded.
+
+    Like aggregate_for_date, this function does not cache.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param first_date: The first date to aggregate.
+    :param last_date: The last date to aggregate.
+    :param bad_dates: List of dates considered having bad data. (Default: [])
+    :param output_projectviews: If True, read projectviews hourly files
+        instead of projectcounts hourly files. (Default: False)
+    :param jobs: Number of hourly files to read concurrently. (Default: 1)
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        aggregate. If None, all abbreviations are aggregated. (Default: None)
+    :param prefetch_dates: Number of days to aggregate ahead in the
+        background. If 0, days are only aggregated once they are requested.
+        (Default: 0)
+    """
+    dates_data = _aggregate_for_date_list(
+        source_dir_abs, util.generate_dates(first_date, last_date),
+        bad_dates, output_projectviews, jobs, abbreviations)
+    if prefetch_dates > 0:
+        dates_data = util.prefetch(dates_data, prefetch_dates)
+    return dates_data
+
+
+def _abbreviations_cover(cached_abbreviations, abbreviations):
+    """Checks whether cached counts cover the requested abbreviations.
+
+    :param cached_abbreviations: Set of abbreviations the cached counts got
+        filtered to, or None if they have not been filtered.
+    :param abbreviations: Set of abbreviations the counts have to cover. If
+        None, the counts have to cover all abbreviations.
+    """
+    return cached_abbreviations is None or (
+        abbreviations is not None and abbreviations <= cached_abbreviations)
+
+
+def _is_complete_day(source_dir_abs, date, output_projectviews):
+    """Checks whether a day has all 24 hours in the source directory.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param date: The date to check.
+    :param output_projectviews: If True, check projectviews instead of
+        projectcounts.
+    """
+    rollup_file_abs = get_rollup_file_abs(
+        source_dir_abs, date, output_projectviews)
+    if _stat_source_file(rollup_file_abs) is not None:
+        hours = rollup.read_daily_rollup_hours(rollup_file_abs)
+    else:
+        hours = _get_hourly_files(
+            source_dir_abs, date, True, output_projectviews)
+    return len(hours) == 24
+
+
+def _get_cached_daily_data(source_dir_abs, date, output_projectviews,
+                           allow_bad_data, abbreviations):
+    """Gets a day's cached counts.
+
+    The counts are returned as daily_cache.DailyCounts. If the day is not
+    cached, the cached data lacks hours although bad data
+    is not allowed, or the cached data got filtered and does not cover all
+    of the requested abbreviations, None is returned.
+
+    :param source_dir_abs: Absolute directory the hourly files were read from.
+    :param date: The date to get the cached data for.
+    :param output_projectviews: If True, get the cached data for
+        projectviews instead of projectcounts.
+    :param allow_bad_data: If True, also accept data for days that lack
+        hours.
+    :param abbreviations: Set of abbreviations the data has to cover. If
+        None, the data has to cover all abbreviations.
+    """
+    cached = cache.get((source_dir_abs, output_projectviews, date))
+    if cached is not None:
+        (cached_abbreviations, date_data, complete) = cached
+        if (complete or allow_bad_data) and \
+                _abbreviations_cover(cached_abbreviations, abbreviations):
+            statistics.add('cache_hits')
+            return date_data
+    statistics.add('cache_misses')
+    return None
+
+
+def _set_cached_daily_data(source_dir_abs, date, output_projectviews,
+                           allow_bad_data, abbreviations, date_data):
+    """Caches a day's count dictionary.
+
+    The counts get stored compactly as daily_cache.DailyCounts. Along with
+    the data, the cache records whether the day had all 24 hours,
+    so data for days lacking hours does not get used if bad data is not
+    allowed.
+
+    :param source_dir_abs: Absolute directory the hourly files were read from.
+    :param date: The date to cache the data for.
+    :param output_projectviews: If True, the data is for projectviews
+        instead of projectcounts.
+    :param allow_bad_data: If True, the data got read with bad data
+        allowed, so the day may lack hours.
+    :param abbreviations: Set of abbreviations the data got filtered to, or
+        None if the data has not been filtered.
+    :param date_data: The count dictionary to cache.
+    """
+    complete = not allow_bad_data or _is_complete_day(
+        source_dir_abs, date, output_projectviews)
+    cache.set((source_dir_abs, output_projectviews, date),
+              (abbreviations, daily_cache.DailyCounts(vocabulary, date_data),
+               complete))
+
+
+def _get_persistent_cache_entry(source_dir_abs, date, output_projectviews):
+    """Gets the persistent cache file and fingerprint for a day.
+
+    The fingerprint is a list of [file name, size, mtime] for the day's
+    existing hourly files. It has to be computed before reading the hourly
+    files, so changes during the read invalidate the cached data.
+
+    If the persistent cache is disabled or bypassed, or the day has a rollup
+    file, None is returned. Otherwise, a (cache_file_abs, fingerprint, hours)
+    tuple is returned, where hours lists the hour of each of the
+    fingerprint's hourly files.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param date: The date to get the cache file and fingerprint for.
+    :param output_projectviews: If True, consider projectviews hourly files
+        instead of projectcounts hourly files.
+    """
+    if persistent_cache_dir_abs is None or persistent_cache_mode == 'bypass':
+        return None
+
+    if _stat_source_file(get_rollup_file_abs(
+            source_dir_abs, date, output_projectviews)) is not None:
+        # Rollup files are cheap enough to read, so there is no need to
+        # cache them persistently.
+        return None
+
+    cache_file_abs = persistent_cache.get_persistent_cache_file_abs(
+        persistent_cache_dir_abs, source_dir_abs, date, output_projectviews)
+
+    fingerprint = []
+    hours = []
+    for (hour, hourly_file_abs) in _get_hourly_files(
+            source_dir_abs, date, True, output_projectviews):
+        hourly_file_stat = _stat_source_file(hourly_file_abs)
+        fingerprint.append([
+            os.path.relpath(hourly_file_abs, source_dir_abs),
+            hourly_file_stat.st_size,
+            hourly_file_stat.st_mtime])
+        hours.append(hour)
+
+    return (cache_file_abs, fingerprint, hours)
+
+
+def _read_persistent_cache(persistent_cache_entry, allow_bad_data,
+                           abbreviations, recheck=False):
+    """Reads a day's counts from the persistent cache.
+
+    If the persistent cache has no usable counts for the day, None is
+    returned. Counts for days with missing hours are only usable, if bad data
+    is allowed.
+
+    Once a process got the day's lock, it has to check again, as another
+    process may have written the day between the first read and locking.
+
+    :param persistent_cache_entry: The day's entry, as returned by
+        _get_persistent_cache_entry.
+    :param allow_bad_data: If True, accept counts for days with missing
+        hours.
+    :param abbreviations: Set of abbreviations the counts have to cover. If
+        None, the counts have to cover all abbreviations.
+    :param recheck: If True, a miss for the day has been counted already. A
+        hit then replaces that miss, and a miss is not counted again.
+        (Default: False)
+    """
+    if persistent_cache_entry is None or persistent_cache_mode != 'use':
+        return None
+
+    (cache_file_abs, fingerprint, hours) = persistent_cache_entry
+    if len(hours) != 24 and not allow_bad_data:
+        return None
+
+    cached = persistent_cache.read_persistently_cached_daily_data(
+        cache_file_abs, fingerprint)
+    if cached is not None:
+        (cached_abbreviations, date_data) = cached
+        if _abbreviations_cover(cached_abbreviations, abbreviations):
+            logging.debug("Using persistent cache file %s" % (
+                cache_file_abs))
+            statistics.add('persistent_cache_hits')
+            if recheck:
+                statistics.add('persistent_cache_misses', -1)
+            return date_data
+    if not recheck:
+        statistics.add('persistent_cache_misses')
+    return None
+
+
+def _write_persistent_cache(persistent_cache_entry, abbreviations,
+                            date_data):
+    """Writes a day's counts to the persistent cache.
+
+    :param persistent_cache_entry: The day's entry, as returned by
+        _get_persistent_cache_entry before the day's hourly files got read.
+    :param abbreviations: Set of abbreviations the counts got filtered to, or
+        None if the counts have not been filtered.
+    :param date_data: The count dictionary to write.
+    """
+    if persistent_cache_entry is not None:
+        (cache_file_abs, fingerprint, hours) = persistent_cache_entry
+        persistent_cache.write_persistently_cached_daily_data(
+            cache_file_abs, fingerprint, abbreviations, date_data, hours)
+
+
+def _aggregates_by_hour(persistent_cache_entry, allow_bad_data):
+    """Checks whether a day should be aggregated hour by hour.
+
+    Days that may lack hours, and days that have per-hour counts in the
+    persistent cache are aggregated through _aggregate_by_hour.
+
+    :param persistent_cache_entry: The day's entry, as returned by
+        _get_persistent_cache_entry.
+    :param allow_bad_data: If True, the day may lack hours.
+    """
+    if persistent_cache_entry is None:
+        return False
+    if allow_bad_data:
+        return True
+    (cache_file_abs, fingerprint, hours) = persistent_cache_entry
+    return os.path.isfile(
+        persistent_cache.get_persistent_cache_hourly_file_abs(cache_file_abs))
+
+
+def _aggregate_by_hour(source_dir_abs, date, allow_bad_data,
+                       output_projectviews, jobs, abbreviations,
+                       persistent_cache_entry):
+    """Aggregates a day, reusing persistently cached per-hour counts.
+
+    Only hourly files that are not in the day's per-hour cache file (as they
+    had been missing, or have changed since) get read. The day's counts are
+    written to the persistent cache.
+
+    If the day lacks hours, the per-hour counts are written to the per-hour
+    cache file, so once the missing hours arrive, only those need to get
+    read. Once the day is complete, the per-hour cache file gets removed.
+
+    :param persistent_cache_entry: The day's entry, as returned by
+        _get_persistent_cache_entry before the day's hourly files got read.
+
+    See aggregate_for_date for the other parameters.
+    """
+    start_time = time.time()
+    (cache_file_abs, fingerprint, hours) = persistent_cache_entry
+    if len(hours) != 24 and not allow_bad_data:
+        # Raises the RuntimeError for the first missing hourly file
+        _get_hourly_files(source_dir_abs, date, False, output_projectviews)
+
+    cached_hourly_datas = {}
+    if persistent_cache_mode == 'use':
+        cached = persistent_cache.read_persistently_cached_hourly_data(
+            cache_file_abs)
+        if cached is not None and _abbreviations_cover(cached[0],
+                                                       abbreviations):
+            cached_hourly_datas = cached[1]
+
+    hourly_datas = [cached_hourly_datas.get(tuple(fingerprint_item))
+                    for fingerprint_item in fingerprint]
+    unread_indices = [index for (index, hourly_data)
+                      in enumerate(hourly_datas) if hourly_data is None]
+    logging.debug("Reusing %d and reading %d hourly files for date '%s'" % (
+        len(hourly_datas) - len(unread_indices), len(unread_indices), date))
+    read_hourly_datas = _aggregate_hourly_files(
+        [os.path.join(source_dir_abs, fingerprint[index][0])
+         for index in unread_indices], jobs, abbreviations)
+    for (index, hourly_data) in zip(unread_indices, read_hourly_datas):
+        hourly_datas[index] = hourly_data
+
+    date_data = {}
+    for hourly_data in hourly_datas:
+        _merge_counts(date_data, hourly_data)
+    if abbreviations is not None:
+        # Reused per-hour counts may cover more abbreviations than requested.
+        date_data = dict((abbreviation, count)
+                         for (abbreviation, count) in date_data.iteritems()
+                         if abbreviation in abbreviations)
+
+    _write_persistent_cache(persistent_cache_entry, abbreviations, date_data)
+    if len(hours) == 24:
+        persistent_cache.remove_persistently_cached_hourly_data(
+            cache_file_abs)
+    else:
+        logging.info("Date '%s' lacks hours %s" % (
+            date, sorted(set(range(24)) - set(hours))))
+        persistent_cache.write_persistently_cached_hourly_data(
+            cache_file_abs, fingerprint, abbreviations, hourly_datas)
+    statistics.add_date_seconds(date, time.time() - start_time)
+    return date_data
+
+
+def _load_daily_data(source_dir_abs, date, allow_bad_data,
+                     output_projectviews, jobs, abbreviations):
+    """Loads a day's counts from the persistent cache or the hourly files.
+
+    If the persistent cache has no usable counts for the day, the day gets
+    aggregated through aggregate_for_date (or through _aggregate_by_hour, if
+    the day may lack hours), and the result is written to the persistent
+    cache.
+
+    See aggregate_for_date for the parameters.
+    """
+    persistent_cache_entry = _get_persistent_cache_entry(
+        source_dir_abs, date, output_projectviews)
+    date_data = _read_persistent_cache(
+        persistent_cache_entry, allow_bad_data, abbreviations)
+    if date_data is None:
+        date_data = _load_uncached_daily_data(
+            source_dir_abs, date, allow_bad_data, output_projectviews, jobs,
+            abbreviations, persistent_cache_entry)
+    return date_data
+
+
+def _load_uncached_daily_data(source_dir_abs, date, allow_bad_data,
+                              output_projectviews, jobs, abbreviations,
+                              persistent_cache_entry):
+    """Loads a day's counts that the persistent cache has no usable counts for.
+
+    If the persistent cache is used for the day, the day is locked against
+    other processes sharing the persistent cache while it gets aggregated.
+    If another process is already aggregating the day, its result is waited
+    for, and reused if possible.
+
+    :param persistent_cache_entry: The day's entry, as returned by
+        _get_persistent_cache_entry.
+
+    See aggregate_for_date for the other parameters.
+    """
+    lock = None
+    try:
+        if persistent_cache_entry is not None:
+            cache_file_abs = persistent_cache_entry[0]
+            lock = persistent_cache.lock_persistently_cached_day(
+                cache_file_abs, False)
+            if lock is None:
+                logging.debug("Waiting for another process to aggregate "
+                              "date '%s'" % (date))
+                lock = persistent_cache.lock_persistently_cached_day(
+                    cache_file_abs)
+            date_data = _read_persistent_cache(
+                persistent_cache_entry, allow_bad_data, abbreviations, True)
+            if date_data is not None:
+                return date_data
+
+        if _aggregates_by_hour(persistent_cache_entry, allow_bad_data):
+            return _aggregate_by_hour(
+                source_dir_abs, date, allow_bad_data, output_projectviews,
+                jobs, abbreviations, persistent_cache_entry)
+
+        date_data = aggregate_for_date(
+            source_dir_abs, date, allow_bad_data, output_projectviews, jobs,
+            abbreviations)
+        _write_persistent_cache(
+            persistent_cache_entry, abbreviations, date_data)
+        return date_data
+    finally:
+        if lock is not None:
+            persistent_cache.unlock_persistently_cached_day(lock)
+
+
+def _aggregate_dates(source_dir_abs, dates, bad_dates, output_projectviews,
+                     jobs, abbreviations, prefetch_dates,
+                     persistent_cache_entries):
+    """Aggregates days in a single streaming pass.
+
+    The generated (date, count dictionary) pairs are written to the
+    persistent cache, but not to the in-memory cache.
+
+    Days that use the persistent cache get locked against other processes
+    sharing the persistent cache. Days that another process is aggregating
+    already are not read in the streaming pass. Instead, the other process'
+    result is waited for afterwards.
+
+    :param dates: List of the dates to aggregate.
+    :param persistent_cache_entries: Dictionary mapping each of the dates to
+        its entry, as returned by _get_persistent_cache_entry.
+
+    See update_per_project_csvs_for_dates for the other parameters.
+    """
+    locks = []
+    contended_dates = []
+    try:
+        claimed_dates = []
+        for date in dates:
+            persistent_cache_entry = persistent_cache_entries[date]
+            if persistent_cache_entry is not None:
+                lock = persistent_cache.lock_persistently_cached_day(
+                    persistent_cache_entry[0], False)
+                if lock is None:
+                    contended_dates.append(date)
+                    continue
+                locks.append(lock)
+                date_data = _read_persistent_cache(
+                    persistent_cache_entry, date in bad_dates, abbreviations,
+                    True)
+                if date_data is not None:
+                    yield (date, date_data)
+                    continue
+            claimed_dates.append(date)
+
+        dates_data = _aggregate_for_date_list(
+            source_dir_abs, claimed_dates, bad_dates, output_projectviews,
+            jobs, abbreviations)
+        if prefetch_dates > 0:
+            dates_data = util.prefetch(dates_data, prefetch_dates)
+        for (date, date_data) in dates_data:
+            _write_persistent_cache(
+                persistent_cache_entries[date], abbreviations, date_data)
+            yield (date, date_data)
+    finally:
+        for lock in locks:
+            persistent_cache.unlock_persistently_cached_day(lock)
+
+    for date in contended_dates:
+        yield (date, _load_uncached_daily_data(
+            source_dir_abs, date, date in bad_dates, output_projectviews,
+            jobs, abbreviations, persistent_cache_entries[date]))
+
+
+def get_cached_hours(source_dir_abs, date, output_projectviews=False):
+    """Gets the hours that made up a day's persistently cached counts.
+
+    The returned list holds the hours (0-23) whose hourly files went into
+    the day's counts in the persistent cache, in increasing order. Hours
+    missing from the list had no hourly file when the day got aggregated.
+
+    If no persistent cache is configured, or it holds no counts for the
+    day, None is returned.
+
+    :param source_dir_abs: Absolute directory the hourly projectcounts files
+        get read from.
+    :param date: The date to get the hours for.
+    :param output_projectviews: If True, get the hours for projectviews
+        instead of projectcounts. (Default: False)
+    """
+    if persistent_cache_dir_abs is None:
+        return None
+    return persistent_cache.read_persistently_cached_hours(
+        persistent_cache.get_persistent_cache_file_abs(
+            persistent_cache_dir_abs, source_dir_abs, date,
+            output_projectviews))
+
+
 def get_daily_count(source_dir_abs, webstatscollector_abbreviation, date,
-                    allow_bad_data=False, output_projectviews=False):
+                    allow_bad_data=False, output_projectviews=False, jobs=1,
+                    abbreviations=None):
     """Obtains the daily count for a webstatscollector abbreviation.
 
-    Data gets cached upon read. For a day, the data is <50KB, so having many
-    dates in cache is not resource intensive.
+    Data gets cached upon read, separately for projectcounts and
+    projectviews. Data for days that lack hours is only used from the cache
+    if allow_bad_data is True. With pagecounts-all-sites, a day's data is
+    considerably bigger than 50KB, so for long ranges of dates, the cache
+    should be bounded through set_cache_budget. If a persistent cache is
+    configured (see set_persistent_cache), it is consulted before reading
+    hourly files.
+
+    If abbreviations is given, and a day needs to get read, only the counts
+    for those abbreviations are read and cached. Later requests for
+    abbreviations that are not covered by the cached data cause the day to be
+    read again.
 
     :param source_dir_abs: Absolute directory to read the hourly projectcounts
         files from.
@@ -135,25 +1231,45 @@ def get_daily_count(source_dir_abs, webstatscollector_abbreviation, date,
         bad or missing. (Default: False)
     :param output_projectviews: If True, name the output files projectviews
         instead of projectcounts. (Default: False)
+    :param jobs: Number of hourly files to read concurrently upon cache
+        misses. (Default: 1)
+    :param abbreviations: Set of lowercase webstatscollector abbreviations to
+        read upon cache misses. It should contain
+        webstatscollector_abbreviation. If None, all abbreviations are read.
+        (Default: None)
     """
-    global cache
-    try:
-        source_dir_cache = cache[source_dir_abs]
-    except KeyError:
-        source_dir_cache = {}
-        cache[source_dir_abs] = source_dir_cache
-
-    try:
-        date_data = source_dir_cache[date]
-    except KeyError:
-        date_data = aggregate_for_date(
-            source_dir_abs, date, allow_bad_data, output_projectviews
+    date_data = _get_cached_daily_data(
+        source_dir_abs, date, output_projectviews, allow_bad_data,
+        frozenset([webstatscollector_abbreviation]))
+    if date_data is None:
+        if abbreviations is not None and \
+                webstatscollector_abbreviation not in abbreviations:
+            abbreviations = None
+        date_data = _load_daily_data(
+            source_dir_abs, date, allow_bad_data, output_projectviews, jobs,
+            abbreviations
         )
-        source_dir_cache[date] = date_data
+        _set_cached_daily_data(source_dir_abs, date, output_projectviews,
+                               allow_bad_data, abbreviations, date_data)
 
     return date_data.get(webstatscollector_abbreviation, 0)
 
 
+def _create_csv_dir(csv_dir_abs):
+    """Creates a directory for CSVs, if it does not exist yet.
+
+    Worker processes (see update_per_project_csvs_for_dates) may create the
+    directory concurrently, so it is fine if it shows up in the meantime.
+
+    :param csv_dir_abs: Absolute name of the directory to create.
+    """
+    try:
+        os.mkdir(csv_dir_abs)
+    except OSError:
+        if not os.path.isdir(csv_dir_abs):
+            raise
+
+
 def update_daily_csv(target_dir_abs, dbname, csv_data_input, first_date,
                      last_date, bad_dates=[], force_recomputation=False):
     """Updates daily per project CSVs from a csv data dictionary.
@@ -179,11 +1295,11 @@ def update_daily_csv(target_dir_abs, dbname, csv_data_input, first_date,
         even if it is already in the CSV. (Default: False)
     """
     csv_dir_abs = os.path.join(target_dir_abs, 'daily')
-    if not os.path.exists(csv_dir_abs):
-        os.mkdir(csv_dir_abs)
+    _create_csv_dir(csv_dir_abs)
     csv_file_abs = os.path.join(csv_dir_abs, dbname + '.csv')
 
     csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    existing_csv_data = dict(csv_data)
 
     for date in util.generate_dates(first_date, last_date):
         date_str = date.isoformat()
@@ -202,7 +1318,8 @@ def update_daily_csv(target_dir_abs, dbname, csv_data_input, first_date,
     util.write_dict_values_sorted_to_csv(
         csv_file_abs,
         csv_data,
-        header=CSV_HEADER)
+        header=CSV_HEADER,
+        existing_csv_data=existing_csv_data)
 
 
 def rescale_counts(csv_data, dates, bad_dates, rescale_to):
@@ -237,13 +1354,13 @@ def rescale_counts(csv_data, dates, bad_dates, rescale_to):
             continue
         date_str = date.isoformat()
         try:
-            csv_line_items = csv_data[date_str].split(',')
+            # The row's columns come without the date column. No need to
+            # aggregate date columns.
+            csv_line_items = list(
+                util.as_csv_row(csv_data[date_str]).columns)
         except KeyError:
             raise RuntimeError("No data for '%s'" % (date_str))
 
-        # Getting rid if date column. No need to aggregate date columns.
-        del csv_line_items[0]
-
         # Getting rid of the "total sum" column.
         # We always want the "total sum" column to be the sum of the
         # other columns in the row. Hence, we cannot simply rescale
@@ -267,7 +1384,9 @@ def rescale_counts(csv_data, dates, bad_dates, rescale_to):
 
         for i in range(columns):
             try:
-                ret[i] += int(csv_line_items[i].strip())
+                item = csv_line_items[i]
+                ret[i] += item if type(item) is int \
+                    else util.csv_column_to_int(item)
                 aggregations[i] += 1
             except IndexError:
                 # csv_line_times is shorter than ret.
@@ -312,11 +1431,11 @@ def update_weekly_csv(target_dir_abs, dbname, csv_data_input, first_date,
         even if it is already in the CSV. (Default: False)
     """
     csv_dir_abs = os.path.join(target_dir_abs, 'weekly_rescaled')
-    if not os.path.exists(csv_dir_abs):
-        os.mkdir(csv_dir_abs)
+    _create_csv_dir(csv_dir_abs)
     csv_file_abs = os.path.join(csv_dir_abs, dbname + '.csv')
 
     csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    existing_csv_data = dict(csv_data)
 
     for date in util.generate_dates(first_date, last_date):
         if date.weekday() == 6:  # Sunday. End of ISO week
@@ -347,7 +1466,8 @@ def update_weekly_csv(target_dir_abs, dbname, csv_data_input, first_date,
     util.write_dict_values_sorted_to_csv(
         csv_file_abs,
         csv_data,
-        header=CSV_HEADER)
+        header=CSV_HEADER,
+        existing_csv_data=existing_csv_data)
 
 
 def update_monthly_csv(target_dir_abs, dbname, csv_data_input, first_date,
@@ -375,11 +1495,11 @@ def update_monthly_csv(target_dir_abs, dbname, csv_data_input, first_date,
         even if it is already in the CSV. (Default: False)
     """
     csv_dir_abs = os.path.join(target_dir_abs, 'monthly_rescaled')
-    if not os.path.exists(csv_dir_abs):
-        os.mkdir(csv_dir_abs)
+    _create_csv_dir(csv_dir_abs)
     csv_file_abs = os.path.join(csv_dir_abs, dbname + '.csv')
 
     csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    existing_csv_data = dict(csv_data)
 
     for date in util.generate_dates(first_date, last_date):
         if (date + datetime.timedelta(days=1)).day == 1:
@@ -413,7 +1533,8 @@ def update_monthly_csv(target_dir_abs, dbname, csv_data_input, first_date,
     util.write_dict_values_sorted_to_csv(
         csv_file_abs,
         csv_data,
-        header=CSV_HEADER)
+        header=CSV_HEADER,
+        existing_csv_data=existing_csv_data)
 
 
 def update_yearly_csv(target_dir_abs, dbname, csv_data_input, first_date,
@@ -441,11 +1562,11 @@ def update_yearly_csv(target_dir_abs, dbname, csv_data_input, first_date,
         even if it is already in the CSV. (Default: False)
     """
     csv_dir_abs = os.path.join(target_dir_abs, 'yearly_rescaled')
-    if not os.path.exists(csv_dir_abs):
-        os.mkdir(csv_dir_abs)
+    _create_csv_dir(csv_dir_abs)
     csv_file_abs = os.path.join(csv_dir_abs, dbname + '.csv')
 
     csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    existing_csv_data = dict(csv_data)
 
     for date in util.generate_dates(first_date, last_date):
         if date.month == 12 and date.day == 31:
@@ -478,13 +1599,448 @@ def update_yearly_csv(target_dir_abs, dbname, csv_data_input, first_date,
     util.write_dict_values_sorted_to_csv(
         csv_file_abs,
         csv_data,
-        header=CSV_HEADER)
+        header=CSV_HEADER,
+        existing_csv_data=existing_csv_data)
+
+
+def get_untracked_dbnames(source_dir_abs, target_dir_abs, date,
+                          allow_bad_data=False, output_projectviews=False,
+                          jobs=1):
+    """Gets the databases that have counts for a day, but no per project CSV.
+
+    The returned tuple holds
+      * the sorted list of database names whose abbreviations have counts in
+        the day's hourly files, but that have no CSV in the daily_raw
+        subdirectory of target_dir_abs,
+      * a dictionary for the abbreviations that are ambiguous, as several
+        database names map to them. It maps those abbreviations to the
+        sorted list of their candidate database names, and
+      * the sorted list of the abbreviations that no database name maps to
+        (E.g.: junk in the hourly files).
+
+    An abbreviation with several candidates (see
+    util.webstatscollector_abbreviation_to_dbnames) counts as resolved, if
+    one of the candidates has a CSV, or is among the returned database
+    names.
+
+    :param source_dir_abs: Absolute directory to read the hourly projectcounts
+        files from.
+    :param target_dir_abs: Absolute directory of the per project CSVs.
+    :param date: The date to get the counts for.
+    :param allow_bad_data: If True, do not bail out, if some data is
+        bad or missing. (Default: False)
+    :param output_projectviews: If True, read projectviews instead of
+        projectcounts. (Default: False)
+    :param jobs: Number of hourly files to read concurrently. (Default: 1)
+    """
+    tracked_dbnames = set(
+        os.path.basename(csv_file_abs).rsplit('.csv', 1)[0]
+        for csv_file_abs in glob.glob(os.path.join(
+            target_dir_abs, 'daily_raw', '*.csv')))
+
+    date_data = _load_daily_data(source_dir_abs, date, allow_bad_data,
+                                 output_projectviews, jobs, None)
+    _set_cached_daily_data(source_dir_abs, date, output_projectviews,
+                           allow_bad_data, None, date_data)
+
+    dbnames = set()
+    ambiguous = {}
+    unknown = []
+    for abbreviation in date_data:
+        candidates = sorted(set(
+            dbname for (dbname, site)
+            in util.webstatscollector_abbreviation_to_dbnames(abbreviation)))
+        if not candidates:
+            unknown.append(abbreviation)
+        elif tracked_dbnames.intersection(candidates):
+            continue
+        elif len(candidates) == 1:
+            dbnames.add(candidates[0])
+        else:
+            ambiguous[abbreviation] = candidates
+
+    for (abbreviation, candidates) in ambiguous.items():
+        if dbnames.intersection(candidates):
+            del ambiguous[abbreviation]
+    return (sorted(dbnames), ambiguous, sorted(unknown))
+
+
+def create_per_project_csvs(target_dir_abs, dbnames):
+    """Creates empty per project CSVs.
+
+    The returned list holds the absolute names of the created CSVs. CSVs that
+    exist already are left untouched.
+
+    :param target_dir_abs: Absolute directory of the per project CSVs.
+    :param dbnames: List of the database names to create CSVs for.
+    """
+    daily_raw_dir_abs = os.path.join(target_dir_abs, 'daily_raw')
+    if not os.path.isdir(daily_raw_dir_abs):
+        os.makedirs(daily_raw_dir_abs)
+
+    csv_files_abs = []
+    for dbname in dbnames:
+        csv_file_abs = os.path.join(daily_raw_dir_abs, dbname + '.csv')
+        if not os.path.exists(csv_file_abs):
+            logging.info("Creating csv '%s'" % (csv_file_abs))
+            open(csv_file_abs, 'w').close()
+            csv_files_abs.append(csv_file_abs)
+    return csv_files_abs
+
+
+def _get_missing_dates(csv_file_abs, dates):
+    """Gets the dates that are missing in a CSV.
+
+    Only the tail of the CSV that holds the dates gets read, unless the CSV
+    is not sorted by date. Then it is parsed as a whole.
+
+    :param csv_file_abs: Absolute name of the CSV to check.
+    :param dates: Sorted list of the dates to check for.
+    """
+    if not dates:
+        return []
+
+    csv_dates = util.parse_csv_tail_to_first_columns(
+        csv_file_abs, dates[0].isoformat())
+    if csv_dates is None:
+        csv_dates = util.parse_csv_to_first_column_dict(csv_file_abs)
+    return [date for date in dates if date.isoformat() not in csv_dates]
+
+
+def _get_per_project_csvs(target_dir_abs, first_date, last_date,
+                          force_recomputation, filter_abbreviations):
+    """Gets the per project CSVs of a target, and what they need.
+
+    The returned tuple holds the sorted list of absolute names of the CSVs
+    in the daily_raw subdirectory of target_dir_abs, the list of their
+    database names, the set of abbreviations to read (None, if all
+    abbreviations are to be read), the dates that need to get read, and the
+    set of database names whose CSVs already have all dates.
+
+    See update_per_project_csvs_for_dates for the parameters.
+    """
+    csv_files_abs = sorted(glob.glob(os.path.join(
+        target_dir_abs, 'daily_raw', '*.csv')))
+    dbnames = [os.path.basename(csv_file_abs).rsplit('.csv', 1)[0]
+               for csv_file_abs in csv_files_abs]
+
+    abbreviations = None
+    if filter_abbreviations:
+        abbreviations = util.dbnames_to_webstatscollector_abbreviations(
+            dbname for dbname in dbnames if dbname != 'all')
+
+    dates = list(util.generate_dates(first_date, last_date))
+    complete_dbnames = set()
+    if force_recomputation:
+        dates_to_read = dates
+    else:
+        missing_dates = set()
+        for (csv_file_abs, dbname) in zip(csv_files_abs, dbnames):
+            if dbname != 'all':
+                csv_missing_dates = _get_missing_dates(csv_file_abs, dates)
+                if csv_missing_dates:
+                    missing_dates.update(csv_missing_dates)
+                else:
+                    complete_dbnames.add(dbname)
+        dates_to_read = sorted(missing_dates)
+    return (csv_files_abs, dbnames, abbreviations, dates_to_read,
+            complete_dbnames)
+
+
+def _generate_uncached_daily_data(source_dir_abs, dates, bad_dates,
+                                  output_projectviews, jobs, abbreviations,
+                                  prefetch_dates):
+    """Generates the counts of days that are not in the in-memory cache.
+
+    Days are taken from the persistent cache if possible. The other days get
+    aggregated in a single streaming pass over the source directory. The
+    generated (date, count dictionary) pairs are not added to the in-memory
+    cache, and need not be in date order.
+
+    :param dates: List of the dates to generate the counts for.
+
+    See update_per_project_csvs_for_dates for the other parameters.
+    """
+    persistent_cache_entries = {}
+    dates_to_aggregate = []
+    for date in dates:
+        persistent_cache_entry = _get_persistent_cache_entry(
+            source_dir_abs, date, output_projectviews)
+        date_data = _read_persistent_cache(
+            persistent_cache_entry, date in bad_dates, abbreviations)
+        if date_data is None and _aggregates_by_hour(
+                persistent_cache_entry, date in bad_dates):
+            date_data = _load_uncached_daily_data(
+                source_dir_abs, date, date in bad_dates, output_projectviews,
+                jobs, abbreviations, persistent_cache_entry)
+        if date_data is None:
+            persistent_cache_entries[date] = persistent_cache_entry
+            dates_to_aggregate.append(date)
+        else:
+            yield (date, date_data)
+
+    for batch_start in range(0, len(dates_to_aggregate), LOCKED_DATES_BATCH):
+        for date_and_data in _aggregate_dates(
+                source_dir_abs,
+                dates_to_aggregate[batch_start:
+                                   batch_start + LOCKED_DATES_BATCH],
+                bad_dates, output_projectviews, jobs, abbreviations,
+                prefetch_dates, persistent_cache_entries):
+            yield date_and_data
+
+
+def _preload_dates(source_dir_abs, dates, bad_dates, output_projectviews,
+                   jobs, abbreviations, prefetch_dates):
+    """Reads days into the caches.
+
+    Days that are neither in the in-memory, nor in the persistent cache get
+    aggregated in a single streaming pass over the source directory.
+
+    :param dates: List of the dates to read.
+
+    See update_per_project_csvs_for_dates for the other parameters.
+    """
+    start_time = time.time()
+    uncached_dates = [date for date in dates if _get_cached_daily_data(
+        source_dir_abs, date, output_projectviews, date in bad_dates,
+        abbreviations) is None]
+    for (date, date_data) in _generate_uncached_daily_data(
+            source_dir_abs, uncached_dates, bad_dates, output_projectviews,
+            jobs, abbreviations, prefetch_dates):
+        _set_cached_daily_data(
+            source_dir_abs, date, output_projectviews, date in bad_dates,
+            abbreviations, date_data)
+    statistics.add('preload_seconds', time.time() - start_time)
+
+
+def warm_cache(source_dir_abs, target_dir_abs, first_date, last_date,
+               bad_dates=[], force_recomputation=False,
+               output_projectviews=False, jobs=1, filter_abbreviations=False,
+               prefetch_dates=0):
+    """Reads the days that per project CSVs need into the caches.
+
+    The same days as update_per_project_csvs_for_dates would read for the
+    given parameters are read, but no CSV is written. Together with a
+    persistent cache (see set_persistent_cache), this allows to read days
+    ahead of time in a separate run, so the run updating the CSVs finds them
+    in the persistent cache.
+
+    See update_per_project_csvs_for_dates for the parameters.
+    """
+    (csv_files_abs, dbnames, abbreviations, dates_to_read,
+     complete_dbnames) = _get_per_project_csvs(
+        target_dir_abs, first_date, last_date, force_recomputation,
+        filter_abbreviations)
+    logging.info("Warming cache for %d dates" % (len(dates_to_read)))
+    _preload_dates(source_dir_abs, dates_to_read, bad_dates,
+                   output_projectviews, jobs, abbreviations, prefetch_dates)
+
+
+def _set_csv_data_counts(csv_data, date, count_desktop, count_mobile,
+                         count_zero):
+    """Sets a day's counts in a per project CSV data dictionary.
+
+    Mobile and zero site counts are only used from DATE_MOBILE_ADDED on.
+
+    :param csv_data: The CSV data dictionary to set the counts in.
+    :param date: The date to set the counts for.
+    :param count_desktop: The day's count for the desktop site.
+    :param count_mobile: The day's count for the mobile site.
+    :param count_zero: The day's count for the zero site.
+    """
+    count_total = count_desktop
+    if date >= DATE_MOBILE_ADDED:
+        count_total += count_mobile + count_zero
+
+    # injecting obtained data
+    util.update_csv_data_dict(
+        csv_data,
+        date.isoformat(),
+        count_total,
+        count_desktop,
+        count_mobile if date >= DATE_MOBILE_ADDED else None,
+        count_zero if date >= DATE_MOBILE_ADDED else None)
+
+
+def _update_per_project_csvs_date_major(
+        source_dir_abs, target_dir_abs, dbnames, site_abbreviations,
+        dates, first_date, last_date, bad_dates, additional_aggregators,
+        force_recomputation, output_projectviews, jobs, abbreviations,
+        prefetch_dates, all_projects_data):
+    """Updates per project CSVs day by day.
+
+    All CSVs are parsed up front. Then each day is read once, its counts
+    are set in the CSV data of every project that needs them, and the day
+    is dropped again. So days do not pile up in the in-memory cache. The
+    CSVs get written once all days are set.
+
+    :param dbnames: List of the database names of the CSVs to update.
+    :param site_abbreviations: Dictionary mapping each database name to the
+        tuple of its desktop, mobile, and zero site abbreviations.
+    :param dates: List of the dates that at least one CSV needs.
+    :param all_projects_data: If not None, the dictionary to merge the
+        projects' CSV data into.
+
+    See update_per_project_csvs_for_dates for the other parameters.
+    """
+    csv_datas = []
+    existing_csv_datas = []
+    for dbname in dbnames:
+        csv_file_abs = os.path.join(
+            target_dir_abs, 'daily_raw', dbname + '.csv')
+        csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+        csv_datas.append(csv_data)
+        existing_csv_datas.append(dict(csv_data))
+
+    def set_date_counts(date, date_data):
+        logging.debug("Updating csvs for date '%s'" % (date))
+        date_str = date.isoformat()
+        for (dbname, csv_data) in zip(dbnames, csv_datas):
+            if date_str not in csv_data or force_recomputation:
+                (count_desktop, count_mobile, count_zero) = [
+                    date_data.get(abbreviation, 0)
+                    for abbreviation in site_abbreviations[dbname]]
+                _set_csv_data_counts(csv_data, date, count_desktop,
+                                     count_mobile, count_zero)
+
+    # Days that happen to be in the in-memory cache are used from there.
+    uncached_dates = []
+    for date in dates:
+        date_data = _get_cached_daily_data(
+            source_dir_abs, date, output_projectviews, date in bad_dates,
+            abbreviations)
+        if date_data is None:
+            uncached_dates.append(date)
+        else:
+            set_date_counts(date, date_data)
+
+    for (date, date_data) in _generate_uncached_daily_data(
+            source_dir_abs, uncached_dates, bad_dates, output_projectviews,
+            jobs, abbreviations, prefetch_dates):
+        set_date_counts(date, date_data)
+
+    for (dbname, csv_data, existing_csv_data) in zip(
+            dbnames, csv_datas, existing_csv_datas):
+        logging.info("Writing csv '%s'" % (dbname))
+        _write_raw_and_aggregated_csv_data(
+            target_dir_abs,
+            dbname,
+            csv_data,
+            first_date,
+            last_date,
+            additional_aggregators,
+            bad_dates,
+            force_recomputation,
+            existing_csv_data)
+
+        # Aggregates values across all projects
+        if all_projects_data is not None:
+            util.merge_sum_csv_data_dict(all_projects_data, csv_data)
+
+
+def _update_per_project_csv(
+        source_dir_abs, target_dir_abs, dbname, site_abbreviations,
+        first_date, last_date, bad_dates, additional_aggregators,
+        force_recomputation, output_projectviews, jobs, abbreviations,
+        return_csv_data):
+    """Updates a single per project CSV from hourly projectcounts files.
+
+    If return_csv_data is True, the project's CSV data dictionary is
+    returned. Otherwise, None is returned.
+
+    :param dbname: The database name of the wiki to update the CSV for.
+    :param site_abbreviations: Tuple of the wiki's desktop, mobile, and zero
+        site abbreviations.
+    :param abbreviations: Set of abbreviations to read upon cache misses, or
+        None to read all abbreviations.
+    :param return_csv_data: If True, return the CSV data dictionary.
+
+    See update_per_project_csvs_for_dates for the other parameters.
+    """
+    csv_file_abs = os.path.join(target_dir_abs, 'daily_raw', dbname + '.csv')
+
+    logging.info("Updating csv '%s'" % (csv_file_abs))
+
+    csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    existing_csv_data = dict(csv_data)
+
+    (abbreviation_desktop, abbreviation_mobile, abbreviation_zero) = \
+        site_abbreviations
+
+    for date in util.generate_dates(first_date, last_date):
+        date_str = date.isoformat()
+        logging.debug("Updating csv '%s' for date '%s'" % (
+            dbname, str(date)))
+        if date_str not in csv_data or force_recomputation:
+            # Check if to allow bad data for this day
+            allow_bad_data = date in bad_dates
+
+            # desktop site
+            count_desktop = get_daily_count(
+                source_dir_abs, abbreviation_desktop, date,
+                allow_bad_data, output_projectviews, jobs, abbreviations,
+            )
+
+            # mobile site
+            count_mobile = get_daily_count(
+                source_dir_abs, abbreviation_mobile, date,
+                allow_bad_data, output_projectviews, jobs, abbreviations,
+            )
+
+            # zero site
+            count_zero = get_daily_count(
+                source_dir_abs, abbreviation_zero, date,
+                allow_bad_data, output_projectviews, jobs, abbreviations,
+            )
+
+            _set_csv_data_counts(csv_data, date, count_desktop, count_mobile,
+                                 count_zero)
+
+    _write_raw_and_aggregated_csv_data(
+        target_dir_abs,
+        dbname,
+        csv_data,
+        first_date,
+        last_date,
+        additional_aggregators,
+        bad_dates,
+        force_recomputation,
+        existing_csv_data)
+
+    return csv_data if return_csv_data else None
+
+
+def _update_per_project_csv_in_worker(index):
+    """Updates a per project CSV of per_project_csv_updates in a worker.
+
+    The returned tuple holds the result of _update_per_project_csv, a
+    snapshot of the statistics (see get_statistics) for updating the CSV,
+    and the CSV writes (see util.csv_write_batch), so the parent process can
+    add them to its own batch.
+
+    If updating the CSV fails, the CSV writes so far get synced right away,
+    as the parent process does not get them.
+
+    :param index: The index of the CSV's arguments in
+        per_project_csv_updates.
+    """
+    statistics.reset()
+    # The batch got forked from the parent, which syncs its writes itself.
+    util.pop_csv_write_batch()
+    try:
+        csv_data = _update_per_project_csv(*per_project_csv_updates[index])
+    except Exception:
+        util.sync_csv_writes(util.pop_csv_write_batch())
+        raise
+    return (csv_data, statistics.snapshot(), util.pop_csv_write_batch())
 
 
 def update_per_project_csvs_for_dates(
         source_dir_abs, target_dir_abs, first_date, last_date,
         bad_dates=[], additional_aggregators=[], force_recomputation=False,
-        compute_all_projects=False, output_projectviews=False):
+        compute_all_projects=False, output_projectviews=False, jobs=1,
+        filter_abbreviations=False, prefetch_dates=0, processes=1,
+        date_major=False, skip_complete_csvs=False):
     """Updates per project CSVs from hourly projectcounts files.
 
     The existing per project CSV files in the daily_raw subdirectory of
@@ -494,10 +2050,42 @@ def update_per_project_csvs_for_dates(
     If the CSVs already has data for a given day, it is not recomputed, unless
     force_recomputation is True.
 
-    Upon any error, the function raises an exception without cleaning or
-    syncing up the CSVs. So if the first CSV could get updated, but there are
+    Before any CSV is updated, the days that at least one CSV needs are read
+    in order in a single pass over the source directory (see
+    aggregate_for_dates), and cached.
+
+    If date_major is True, the CSVs are instead all parsed up front, and
+    updated day by day, so each day only needs to be kept in memory until
+    its counts got set for all CSVs. The CSVs get written at the end. This
+    keeps memory for the hourly data at about one day (plus prefetch_dates
+    days), regardless of the number of dates. As days are not kept in
+    memory, set_cache_budget has no effect on them.
+
+    Whether a CSV has data for the given days is decided by reading only the
+    CSV's tail. If skip_complete_csvs is True, CSVs that already have data
+    for all the given days are not updated at all. Neither they, nor the
+    additional aggregators' files for them get written, and unless
+    compute_all_projects is True, they do not even get parsed as a whole.
+    So files of additional aggregators that are missing days (e.g.: as an
+    earlier run failed after writing the daily_raw CSV) do not get fixed up
+    for those CSVs. CSVs are not skipped if one of the given days is in
+    bad_dates, so additional aggregators can drop those days.
+
+    If processes is bigger than 1, the CSVs are shared out to that many
+    worker processes. The workers get forked after the days got read, so
+    they share the cached days. The additional aggregators run in the
+    workers. The written files are the same as with a single process.
+
+    Each CSV is replaced atomically, so readers never see a partially
+    written CSV. The CSVs are written as a batch (see
+    util.start_csv_write_batch). Only at the end, the written CSVs get
+    synced, and replace the old ones, even upon errors.
+
+    Upon any error, the function raises an exception without cleaning up, or
+    aligning the CSVs. So if the first CSV could get updated, but there are
     issues with the second, the data written to the first CSV survives. Hence,
-    the CSVs need not end with the same date upon error.
+    the CSVs need not end with the same date upon error. With several
+    processes, CSVs after the failing one may have been updated as well.
 
     :param source_dir_abs: Absolute directory to read the hourly projectcounts
         files from.
@@ -519,101 +2107,148 @@ def update_per_project_csvs_for_dates(
         into a file named 'all.csv'.
     :param output_projectviews: If True, name the output files projectviews
         instead of projectcounts. (Default: False)
+    :param jobs: Number of hourly files to read concurrently. (Default: 1)
+    :param filter_abbreviations: If True, only read the counts for the
+        webstatscollector abbreviations of the projects that have a CSV in
+        the daily_raw subdirectory of target_dir_abs. Counts for other
+        abbreviations are neither parsed nor cached. (Default: False)
+    :param prefetch_dates: Number of days a background thread aggregates
+        ahead, while the current day is getting processed. As days are read
+        before any CSV work, unless date_major is True, this only hides
+        reading time for date_major updates (where the current day's counts
+        get set in all CSVs meanwhile), or with a persistent cache (where the
+        current day gets written to it meanwhile). If 0, days are only
+        aggregated once they are requested. (Default: 0)
+    :param processes: Number of processes to update CSVs in. It has to be 1
+        for date_major updates. (Default: 1)
+    :param date_major: If True, update the CSVs day by day instead of CSV by
+        CSV. (Default: False)
+    :param skip_complete_csvs: If True, skip CSVs that already have data for
+        all the given days. (Default: False)
     """
-    # Contains the aggregation of all data across projects indexed by date.
-    all_projects_data = {}
-
-    for csv_file_abs in sorted(glob.glob(os.path.join(
-            target_dir_abs, 'daily_raw', '*.csv'))):
-        dbname = os.path.basename(csv_file_abs)
-        dbname = dbname.rsplit('.csv', 1)[0]
+    global per_project_csv_updates
 
-        if dbname == 'all':
-            # 'all.csv' is an aggregation across all projects
-            # and should not be processed.
-            continue
+    if date_major and processes > 1:
+        raise ValueError("Date major updates cannot use several processes")
 
-        logging.info("Updating csv '%s'" % (csv_file_abs))
-
-        csv_data = util.parse_csv_to_first_column_dict(csv_file_abs)
+    # Contains the aggregation of all data across projects indexed by date.
+    all_projects_data = util.CsvSeries()
+
+    (csv_files_abs, dbnames, abbreviations, dates_to_read,
+     complete_dbnames) = _get_per_project_csvs(
+        target_dir_abs, first_date, last_date, force_recomputation,
+        filter_abbreviations)
+
+    skipped_dbnames = set()
+    if skip_complete_csvs and not any(
+            date in bad_dates
+            for date in util.generate_dates(first_date, last_date)):
+        skipped_dbnames = complete_dbnames
+    for dbname in sorted(skipped_dbnames):
+        logging.debug("Skipping complete csv for '%s'" % (dbname))
+    statistics.add('csvs_skipped', len(skipped_dbnames))
+
+    # Read all days that some CSV needs in a single streaming pass over the
+    # source tree, instead of reading them one cache miss at a time.
+    if not date_major:
+        _preload_dates(source_dir_abs, dates_to_read, bad_dates,
+                       output_projectviews, jobs, abbreviations,
+                       prefetch_dates)
+
+    start_time = time.time()
+    abbreviation_table = util.dbnames_to_webstatscollector_abbreviation_table(
+        dbnames)
+    # 'all.csv' is an aggregation across all projects and should not be
+    # processed.
+    updated_dbnames = [dbname for dbname in dbnames
+                       if dbname != 'all' and dbname not in skipped_dbnames]
+    updates = [(source_dir_abs, target_dir_abs, dbname,
+                abbreviation_table[dbname], first_date, last_date, bad_dates,
+                additional_aggregators, force_recomputation,
+                output_projectviews, jobs, abbreviations,
+                compute_all_projects)
+               for dbname in updated_dbnames]
 
-        for date in util.generate_dates(first_date, last_date):
-            date_str = date.isoformat()
-            logging.debug("Updating csv '%s' for date '%s'" % (
-                dbname, str(date)))
-            if date_str not in csv_data or force_recomputation:
-                # Check if to allow bad data for this day
-                allow_bad_data = date in bad_dates
-
-                # desktop site
-                abbreviation = util.dbname_to_webstatscollector_abbreviation(
-                    dbname, 'desktop')
-                count_desktop = get_daily_count(
-                    source_dir_abs, abbreviation, date,
-                    allow_bad_data, output_projectviews,
-                )
-
-                # mobile site
-                abbreviation = util.dbname_to_webstatscollector_abbreviation(
-                    dbname, 'mobile')
-                count_mobile = get_daily_count(
-                    source_dir_abs, abbreviation, date,
-                    allow_bad_data, output_projectviews,
-                )
-
-                # zero site
-                abbreviation = util.dbname_to_webstatscollector_abbreviation(
-                    dbname, 'zero')
-                count_zero = get_daily_count(
-                    source_dir_abs, abbreviation, date,
-                    allow_bad_data, output_projectviews,
-                )
-
-                count_total = count_desktop
-                if date >= DATE_MOBILE_ADDED:
-                    count_total += count_mobile + count_zero
-
-                # injecting obtained data
-                util.update_csv_data_dict(
-                    csv_data,
-                    date_str,
-                    count_total,
-                    count_desktop,
-                    count_mobile if date >= DATE_MOBILE_ADDED else None,
-                    count_zero if date >= DATE_MOBILE_ADDED else None)
+    if compute_all_projects:
+        # Skipped CSVs are not written, but still count towards all.csv
+        for dbname in sorted(skipped_dbnames):
+            util.merge_sum_csv_data_dict(
+                all_projects_data, util.parse_csv_to_first_column_dict(
+                    os.path.join(target_dir_abs, 'daily_raw',
+                                 dbname + '.csv')))
+
+    util.start_csv_write_batch()
+    try:
+        if date_major:
+            _update_per_project_csvs_date_major(
+                source_dir_abs, target_dir_abs, updated_dbnames,
+                abbreviation_table, dates_to_read, first_date, last_date,
+                bad_dates, additional_aggregators, force_recomputation,
+                output_projectviews, jobs, abbreviations, prefetch_dates,
+                all_projects_data if compute_all_projects else None)
+        elif processes > 1 and len(updates) > 1:
+            per_project_csv_updates = updates
+            pool = multiprocessing.Pool(min(processes, len(updates)))
+            try:
+                results = pool.imap(_update_per_project_csv_in_worker,
+                                    range(len(updates)))
+                # All results get collected even after a failing CSV, so the
+                # CSVs that the workers wrote meanwhile get synced.
+                exc_info = None
+                for index in range(len(updates)):
+                    try:
+                        (csv_data, worker_statistics, writes) = next(results)
+                    except Exception:
+                        if exc_info is None:
+                            exc_info = sys.exc_info()
+                        continue
+                    statistics.merge(worker_statistics)
+                    util.csv_write_batch.extend(writes)
+
+                    # Aggregates values across all projects
+                    if compute_all_projects:
+                        util.merge_sum_csv_data_dict(all_projects_data,
+                                                     csv_data)
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                pool.terminate()
+                pool.join()
+                per_project_csv_updates = None
+        else:
+            for update in updates:
+                csv_data = _update_per_project_csv(*update)
 
-        _write_raw_and_aggregated_csv_data(
-            target_dir_abs,
-            dbname,
-            csv_data,
-            first_date,
-            last_date,
-            additional_aggregators,
-            bad_dates,
-            force_recomputation)
+                # Aggregates values across all projects
+                if compute_all_projects:
+                    util.merge_sum_csv_data_dict(all_projects_data, csv_data)
 
-        # Aggregates values across all projects
+        # Writes aggregations across all projects
         if compute_all_projects:
-            util.merge_sum_csv_data_dict(all_projects_data, csv_data)
-
-    # Writes aggregations across all projects
-    if compute_all_projects:
-        oldest_date = util.parse_string_to_date(min(all_projects_data.keys()))
-        newest_date = util.parse_string_to_date(max(all_projects_data.keys()))
-        _write_raw_and_aggregated_csv_data(
-            target_dir_abs,
-            'all',
-            all_projects_data,
-            oldest_date,
-            newest_date,
-            additional_aggregators,
-            bad_dates,
-            force_recomputation)
+            oldest_date = util.parse_string_to_date(
+                min(all_projects_data.keys()))
+            newest_date = util.parse_string_to_date(
+                max(all_projects_data.keys()))
+            _write_raw_and_aggregated_csv_data(
+                target_dir_abs,
+                'all',
+                all_projects_data,
+                oldest_date,
+                newest_date,
+                additional_aggregators,
+                bad_dates,
+                force_recomputation)
+    finally:
+        # Syncing all CSVs together, and each directory only once keeps
+        # writing thousands of CSVs fast.
+        util.finish_csv_write_batch()
+    statistics.add('csv_seconds', time.time() - start_time)
 
 
 def _write_raw_and_aggregated_csv_data(
         target_dir_abs, dbname, csv_data, first_date, last_date,
-        additional_aggregators, bad_dates, force_recomputation):
+        additional_aggregators, bad_dates, force_recomputation,
+        existing_csv_data=None):
     """
     Writes the data passed in the csv_data dict to various destinations:
 
@@ -632,13 +2267,17 @@ def _write_raw_and_aggregated_csv_data(
     :param additional_aggregators: See update_per_project_csvs_for_dates.
     :param bad_dates: List of dates considered having bad data.
     :param force_recomputation: If True, recompute data for the given days.
+    :param existing_csv_data: The data that the raw CSV held before
+        updating, if new days may get appended to it (see
+        util.write_dict_values_sorted_to_csv). (Default: None)
     """
     csv_file_abs = os.path.join(target_dir_abs, 'daily_raw', dbname + '.csv')
 
     util.write_dict_values_sorted_to_csv(
         csv_file_abs,
         csv_data,
-        header=CSV_HEADER)
+        header=CSV_HEADER,
+        existing_csv_data=existing_csv_data)
 
     for additional_aggregator in additional_aggregators:
         additional_aggregator(
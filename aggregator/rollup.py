@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    aggregator.rollup
+    ~~~~~~~~~~~~~~~~~
+
+    This module contains functions to read and write daily rollup files.
+
+    A daily rollup file holds the counts of a day's 24 hourly files in a
+    compact binary format. All integers are little-endian:
+
+      * header: magic 'AGGRDAY1', flags (unsigned char, bit 0 set if
+        per-hour columns are present), bitmask of the hours that went into
+        the file (unsigned int, bit i for hour i), and number of
+        abbreviations n (unsigned int).
+      * vocabulary: length (unsigned int) followed by the newline separated,
+        sorted abbreviations. All columns share this vocabulary.
+      * daily column: n signed 64-bit counts, in vocabulary order.
+      * per-hour columns (optional): For each hour of the bitmask in
+        increasing order, n signed 64-bit counts, in vocabulary order.
+
+    Reading the daily counts only requires reading the header, the
+    vocabulary, and the daily column.
+"""
+
+import struct
+import util
+
+ROLLUP_MAGIC = 'AGGRDAY1'
+ROLLUP_HEADER_FORMAT = '<8sBII'
+ROLLUP_FLAG_HOURLY_COLUMNS = 1
+
+
+def _pack_counts(vocabulary, data):
+    """Packs a count dictionary into a column of counts.
+
+    :param vocabulary: The list of abbreviations defining the column order.
+    :param data: The count dictionary to pack.
+    """
+    return struct.pack('<%dq' % (len(vocabulary)),
+                       *[data.get(abbreviation, 0)
+                         for abbreviation in vocabulary])
+
+
+def _unpack_counts(vocabulary, content, offset, skip_zeros):
+    """Unpacks a column of counts into a count dictionary.
+
+    :param vocabulary: The list of abbreviations defining the column order.
+    :param content: The string to unpack the column from.
+    :param offset: The offset of the column in content.
+    :param skip_zeros: If True, abbreviations with a count of 0 are not added
+        to the dictionary.
+    """
+    counts = struct.unpack_from('<%dq' % (len(vocabulary)), content, offset)
+    if skip_zeros:
+        return dict((abbreviation, count)
+                    for (abbreviation, count) in zip(vocabulary, counts)
+                    if count)
+    return dict(zip(vocabulary, counts))
+
+
+def write_daily_rollup(rollup_file_abs, hours, daily_data, hourly_datas=None):
+    """Writes a daily rollup file.
+
+    The file is written atomically.
+
+    :param rollup_file_abs: Absolute name of the rollup file to write.
+    :param hours: List of the hours (0-23) whose hourly files went into
+        daily_data.
+    :param daily_data: The count dictionary of the whole day.
+    :param hourly_datas: If not None, a list holding the count dictionary for
+        each of the hours, in the same order as hours. Those get written as
+        per-hour columns. (Default: None)
+    """
+    vocabulary = sorted(daily_data)
+
+    hours_mask = 0
+    for hour in hours:
+        hours_mask |= 1 << hour
+
+    flags = 0
+    if hourly_datas is not None:
+        flags |= ROLLUP_FLAG_HOURLY_COLUMNS
+
+    vocabulary_content = '\n'.join(vocabulary)
+    parts = [
+        struct.pack(ROLLUP_HEADER_FORMAT, ROLLUP_MAGIC, flags, hours_mask,
+                    len(vocabulary)),
+        struct.pack('<I', len(vocabulary_content)),
+        vocabulary_content,
+        _pack_counts(vocabulary, daily_data),
+        ]
+    if hourly_datas is not None:
+        for (hour, hourly_data) in sorted(zip(hours, hourly_datas)):
+            parts.append(_pack_counts(vocabulary, hourly_data))
+
+    util.write_file_atomically(rollup_file_abs, ''.join(parts))
+
+
+def _read_header(rollup_file, rollup_file_abs):
+    """Reads and checks the header of a rollup file.
+
+    The returned tuple holds the flags, the list of hours that went into the
+    file, the number of abbreviations, and the size of the vocabulary.
+
+    :param rollup_file: The rollup file object, positioned at the start.
+    :param rollup_file_abs: Absolute name of the rollup file, for error
+        messages.
+    """
+    header_size = struct.calcsize(ROLLUP_HEADER_FORMAT)
+    header = rollup_file.read(header_size + 4)
+    if len(header) != header_size + 4:
+        raise RuntimeError("'%s' is truncated" % (rollup_file_abs))
+    (magic, flags, hours_mask, vocabulary_size) = struct.unpack_from(
+        ROLLUP_HEADER_FORMAT, header)
+    if magic != ROLLUP_MAGIC:
+        raise RuntimeError("'%s' is not a rollup file" % (
+            rollup_file_abs))
+    (vocabulary_content_size, ) = struct.unpack_from(
+        '<I', header, header_size)
+
+    hours = [hour for hour in range(24) if hours_mask & (1 << hour)]
+    return (flags, hours, vocabulary_size, vocabulary_content_size)
+
+
+def read_daily_rollup_hours(rollup_file_abs):
+    """Reads the list of hours that went into a daily rollup file.
+
+    Only the file's header gets read. If the file is not a rollup file, a
+    RuntimeError is raised.
+
+    :param rollup_file_abs: Absolute name of the rollup file to read.
+    """
+    with open(rollup_file_abs, 'rb') as rollup_file:
+        return _read_header(rollup_file, rollup_file_abs)[1]
+
+
+def read_daily_rollup(rollup_file_abs, hourly_columns=False):
+    """Reads a daily rollup file.
+
+    The returned tuple holds the list of hours that went into the file, the
+    count dictionary for the whole day, and (if hourly_columns is True) a
+    dictionary mapping each of the hours to its count dictionary. The
+    per-hour count dictionaries do not contain abbreviations with a count of
+    0.
+
+    If the file is not a rollup file, or it lacks per-hour columns although
+    they are requested, a RuntimeError is raised.
+
+    :param rollup_file_abs: Absolute name of the rollup file to read.
+    :param hourly_columns: If True, also read the per-hour columns.
+        (Default: False)
+    """
+    with open(rollup_file_abs, 'rb') as rollup_file:
+        (flags, hours, vocabulary_size, vocabulary_content_size) = \
+            _read_header(rollup_file, rollup_file_abs)
+
+        column_size = 8 * vocabulary_size
+        content_size = vocabulary_content_size + column_size
+        if hourly_columns:
+            if not flags & ROLLUP_FLAG_HOURLY_COLUMNS:
+                raise RuntimeError("'%s' has no per-hour columns" % (
+                    rollup_file_abs))
+            content_size += len(hours) * column_size
+
+        content = rollup_file.read(content_size)
+        if len(content) != content_size:
+            raise RuntimeError("'%s' is truncated" % (rollup_file_abs))
+
+    if vocabulary_size:
+        vocabulary = content[:vocabulary_content_size].split('\n')
+    else:
+        vocabulary = []
+
+    offset = vocabulary_content_size
+    daily_data = _unpack_counts(vocabulary, content, offset, False)
+    if not hourly_columns:
+        return (hours, daily_data)
+
+    hourly_datas = {}
+    for hour in hours:
+        offset += column_size
+        # The vocabulary is the day's vocabulary, so hours lacking an
+        # abbreviation have a 0 count for it. We drop those again.
+        hourly_datas[hour] = _unpack_counts(vocabulary, content, offset, True)
+    return (hours, daily_data, hourly_datas)
@@ -19,8 +19,15 @@
     This module contains general utility functions.
 """
 
+import bisect
 import datetime
+import errno
 import os
+import Queue
+import stat
+import sys
+import tempfile
+import threading
 from operator import add
 
 WEBSTATSCOLLECTOR_WHITELISTED_WIKIMEDIA_WIKIS = [
@@ -52,8 +59,50 @@ WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS = [
     ('wiki', ''),
 ]
 
+# WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS precomputed for matching. Maps each
+# dbname ending to its (position in the list, dbname ending, new ending), so
+# the first match in the list is the minimal one.
+_WEBSTATSCOLLECTOR_SUFFIXES = dict(
+    (dbname_ending, (position, dbname_ending, new_ending))
+    for (position, (dbname_ending, new_ending))
+    in enumerate(WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS))
+
+# The distinct lengths of the dbname endings.
+_WEBSTATSCOLLECTOR_SUFFIX_LENGTHS = sorted(set(
+    len(dbname_ending) for dbname_ending in _WEBSTATSCOLLECTOR_SUFFIXES))
+
+# Inverse of WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS. Maps each new ending to
+# the dbname endings that get replaced by it.
+_WEBSTATSCOLLECTOR_NEW_ENDINGS = {}
+for (dbname_ending, new_ending) in WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS:
+    _WEBSTATSCOLLECTOR_NEW_ENDINGS.setdefault(new_ending, []).append(
+        dbname_ending)
+
+WEBSTATSCOLLECTOR_SITES = ['desktop', 'mobile', 'zero']
+
+# The modifiers that get injected into abbreviations for non-desktop sites.
+_WEBSTATSCOLLECTOR_SITE_MODIFIERS = {
+    'mobile': 'm',
+    'zero': 'zero',
+}
+
 CSV_LINE_ENDING = '\r\n'
 
+# Number of bytes to read at a time, when reading CSVs from their end.
+CSV_TAIL_BLOCK_SIZE = 4096
+
+# While a batch of CSV writes is open (see start_csv_write_batch), the list
+# of (csv_file_abs, tmp_file_abs) pairs for the CSVs that got written, but
+# not synced yet. tmp_file_abs is the temporary file that is to get renamed
+# over csv_file_abs, or None, if data got appended to csv_file_abs in place.
+# None, if no batch is open.
+csv_write_batch = None
+
+# The process' umask. Reading it requires setting it, which is not safe once
+# further threads run. So it is read once upon import.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 def parse_string_to_date(date_str):
     """Parse a string into a datetime.date.
@@ -100,6 +149,67 @@ def generate_dates(first_date, last_date):
         date += datetime.timedelta(days=1)
 
 
+def prefetch(iterable, depth):
+    """Iterates over an iterable while a background thread reads ahead.
+
+    A background thread advances the iterable, and keeps up to depth
+    items in a queue until they get consumed. So producing the next items
+    overlaps with whatever the consumer does with the current one.
+
+    Exceptions raised by the iterable are re-raised to the consumer once it
+    reaches them, so all previously produced items get consumed first.
+
+    If the consumer stops early, the background thread stops advancing the
+    iterable, and closes it, if it is a generator.
+
+    :param iterable: The iterable to read ahead.
+    :param depth: The maximum number of items to read ahead. Has to be at
+        least 1.
+    """
+    items = Queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(item):
+        # Waits for space in the queue, but gives up once the consumer has
+        # stopped.
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((True, item)):
+                    break
+            else:
+                put((False, None))
+        except Exception:
+            put((False, sys.exc_info()))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            (is_item, value) = items.get()
+            if not is_item:
+                if value is not None:
+                    raise value[0], value[1], value[2]
+                break
+            yield value
+    finally:
+        stopped.set()
+        producer.join()
+
+
 def dbname_to_webstatscollector_abbreviation(dbname, site='desktop'):
     """
     Gets the webstatscollector abbreviation for a site's database name
@@ -110,62 +220,598 @@ def dbname_to_webstatscollector_abbreviation(dbname, site='desktop'):
     :param site: The site to get the abbreviation for. Either 'desktop',
         'mobile', or 'zero'. (Default: 'desktop')
     """
-    for (dbname_ending, new_ending) in WEBSTATSCOLLECTOR_SUFFIX_ABBREVIATIONS:
-        if dbname.endswith(dbname_ending):
-            # replacing last occurrence of dbname's ending with new_ending
-            abbreviation = dbname.rsplit(dbname_ending, 1)[0] + new_ending
+    matches = [_WEBSTATSCOLLECTOR_SUFFIXES[dbname[-length:]]
+               for length in _WEBSTATSCOLLECTOR_SUFFIX_LENGTHS
+               if dbname[-length:] in _WEBSTATSCOLLECTOR_SUFFIXES]
+    if not matches:
+        return None
+    (position, dbname_ending, new_ending) = min(matches)
+
+    # replacing last occurrence of dbname's ending with new_ending
+    abbreviation = dbname[:-len(dbname_ending)] + new_ending
+
+    # dbnames use “_” where webstatscollector uses “-”.
+    abbreviation = abbreviation.replace('_', '-')
+
+    # prepend www if it is just the root project to catch things like
+    # wikidatawiki being served at www.wikidata.org
+    if abbreviation.startswith('.'):
+        abbreviation = "www" + abbreviation
+
+    # Fix-up for wikimedia.org wikis
+    if abbreviation in WEBSTATSCOLLECTOR_WHITELISTED_WIKIMEDIA_WIKIS:
+        abbreviation += ".m"
+
+    # Inject site modifier
+    if site != 'desktop':  # desktop has no modifier -> short-circuit
+        abbreviation_split = abbreviation.split('.')
+        if site == 'mobile':
+            abbreviation_split.insert(1, 'm')
+        elif site == 'zero':
+            abbreviation_split.insert(1, 'zero')
+
+        # fix-up mobile site where desktop site is www, like
+        # www.m.wd to m.wd
+        if abbreviation_split[0] == 'www':
+            del abbreviation_split[0]
+
+        abbreviation = '.'.join(abbreviation_split)
+
+    return abbreviation
+
+
+def dbnames_to_webstatscollector_abbreviation_table(dbnames):
+    """
+    Gets the webstatscollector abbreviations of each site for databases
+
+    The returned dictionary maps each of the given database names to a tuple
+    holding the database's abbreviation for each site in
+    WEBSTATSCOLLECTOR_SITES (in that order). Sites without webstatscollector
+    abbreviation have None in the tuple.
+
+    :param dbnames: Iterable of data base names (e.g.: ['enwiki', 'dewiki'])
+    """
+    return dict(
+        (dbname, tuple(dbname_to_webstatscollector_abbreviation(dbname, site)
+                       for site in WEBSTATSCOLLECTOR_SITES))
+        for dbname in dbnames)
+
+
+def _desktop_abbreviation_to_dbnames(abbreviation):
+    """
+    Gets candidate database names for a desktop webstatscollector abbreviation
+
+    The candidates are found by undoing the steps of
+    dbname_to_webstatscollector_abbreviation. Not all of them need to map
+    back to the abbreviation.
+
+    :param abbreviation: The desktop abbreviation (e.g.: 'en', 'www.wd')
+    """
+    abbreviations = [abbreviation]
+    # Undo fix-up for wikimedia.org wikis
+    if abbreviation.endswith('.m') and \
+            abbreviation[:-2] in WEBSTATSCOLLECTOR_WHITELISTED_WIKIMEDIA_WIKIS:
+        abbreviations.append(abbreviation[:-2])
+
+    dbnames = []
+    for abbreviation in abbreviations:
+        (prefix, dot, rest) = abbreviation.partition('.')
+        # Undo prepending www. No database name starts in 'www'.
+        if prefix == 'www':
+            prefix = ''
+        for dbname_ending in _WEBSTATSCOLLECTOR_NEW_ENDINGS.get(
+                dot + rest, []):
+            dbnames.append(prefix.replace('-', '_') + dbname_ending)
+    return dbnames
+
+
+def webstatscollector_abbreviation_to_dbnames(abbreviation):
+    """
+    Gets the database names and sites for a webstatscollector abbreviation
+
+    The returned list holds the sorted (dbname, site) pairs that
+    dbname_to_webstatscollector_abbreviation maps to the abbreviation. As
+    that mapping is not injective, an abbreviation may belong to several
+    databases (e.g.: 'uk.m' is both the mobile site of 'ukwiki', and the
+    desktop site of 'ukwikimedia'). If no database maps to the abbreviation,
+    the list is empty.
+
+    :param abbreviation: The webstatscollector abbreviation (e.g.: 'en.m')
+    """
+    parts = abbreviation.split('.')
+    pairs = set()
+    for site in WEBSTATSCOLLECTOR_SITES:
+        if site == 'desktop':
+            desktop_abbreviations = [abbreviation]
+        else:
+            # Undo injecting the site modifier
+            modifier = _WEBSTATSCOLLECTOR_SITE_MODIFIERS[site]
+            desktop_abbreviations = []
+            if len(parts) > 1 and parts[1] == modifier:
+                desktop_abbreviations.append('.'.join(parts[:1] + parts[2:]))
+            if len(parts) > 1 and parts[0] == modifier:
+                desktop_abbreviations.append('.'.join(['www'] + parts[1:]))
+
+        for desktop_abbreviation in desktop_abbreviations:
+            for dbname in _desktop_abbreviation_to_dbnames(
+                    desktop_abbreviation):
+                if dbname_to_webstatscollector_abbreviation(
+                        dbname, site) == abbreviation:
+                    pairs.add((dbname, site))
+    return sorted(pairs)
+
+
+def dbnames_to_webstatscollector_abbreviations(dbnames):
+    """
+    Gets the webstatscollector abbreviations for all sites of databases
+
+    The returned frozenset holds the abbreviations of all sites in
+    WEBSTATSCOLLECTOR_SITES for each of the given database names. Database
+    names without webstatscollector abbreviation are skipped.
+
+    :param dbnames: Iterable of data base names (e.g.: ['enwiki', 'dewiki'])
+    """
+    abbreviations = set()
+    for site_abbreviations in dbnames_to_webstatscollector_abbreviation_table(
+            dbnames).itervalues():
+        abbreviations.update(site_abbreviations)
+    abbreviations.discard(None)
+    return frozenset(abbreviations)
 
-            # dbnames use “_” where webstatscollector uses “-”.
-            abbreviation = abbreviation.replace('_', '-')
 
-            # prepend www if it is just the root project to catch things like
-            # wikidatawiki being served at www.wikidata.org
-            if abbreviation.startswith('.'):
-                abbreviation = "www" + abbreviation
+def _get_new_file_mode(file_abs):
+    """
+    Gets the permission bits to use for a file that gets (re)written.
+
+    Existing files keep their permission bits. New files get the permission
+    bits that open would give them (i.e.: 0666 with the umask applied).
+
+    :param file_abs: Absolute name of the file that gets written.
+    """
+    try:
+        return stat.S_IMODE(os.stat(file_abs).st_mode)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    return 0666 & ~UMASK
+
+
+def _write_temp_file(file_abs, content):
+    """
+    Writes content to a temporary file next to a file.
+
+    The returned name of the temporary file is meant for renaming the
+    temporary file over file_abs. The temporary file already has the
+    permission bits for file_abs (see _get_new_file_mode). The target
+    directory is created if it does not exist yet.
 
-            # Fix-up for wikimedia.org wikis
-            if abbreviation in WEBSTATSCOLLECTOR_WHITELISTED_WIKIMEDIA_WIKIS:
-                abbreviation += ".m"
+    :param file_abs: Absolute name of the file to write the content for.
+    :param content: The (byte) string to write.
+    """
+    dir_abs = os.path.dirname(file_abs)
+    if not os.path.isdir(dir_abs):
+        try:
+            os.makedirs(dir_abs)
+        except OSError:
+            # Another process might have created the directory in the
+            # meantime.
+            if not os.path.isdir(dir_abs):
+                raise
 
-            # Inject site modifier
-            if site != 'desktop':  # desktop has no modifier -> short-circuit
-                abbreviation_split = abbreviation.split('.')
-                if site == 'mobile':
-                    abbreviation_split.insert(1, 'm')
-                elif site == 'zero':
-                    abbreviation_split.insert(1, 'zero')
+    (tmp_file_fd, tmp_file_abs) = tempfile.mkstemp(dir=dir_abs, prefix='.tmp-')
+    try:
+        with os.fdopen(tmp_file_fd, 'wb') as tmp_file:
+            tmp_file.write(content)
+        # mkstemp creates files that only the owner can read.
+        os.chmod(tmp_file_abs, _get_new_file_mode(file_abs))
+    except Exception:
+        os.unlink(tmp_file_abs)
+        raise
+    return tmp_file_abs
+
+
+def _sync_file(file_abs):
+    """
+    Syncs a file's data to disk.
 
-                # fix-up mobile site where desktop site is www, like
-                # www.m.wd to m.wd
-                if abbreviation_split[0] == 'www':
-                    del abbreviation_split[0]
+    :param file_abs: Absolute name of the file to sync.
+    """
+    file_fd = os.open(file_abs, os.O_RDONLY)
+    try:
+        os.fsync(file_fd)
+    finally:
+        os.close(file_fd)
+
+
+def write_file_atomically(file_abs, content):
+    """
+    Writes content to a file, such that readers never see partial content.
+
+    The content is written to a temporary file in the target directory
+    first, which gets synced to disk, and is then renamed over file_abs. So
+    once the directory got synced as well (see sync_dirs), the file holds
+    either the old or the new content, even if the host crashes, regardless
+    of the file system's flushing heuristics. The target directory is
+    created if it does not exist yet.
+
+    The written file keeps the permission bits of the file it replaces. If
+    there is no such file, the umask applies, as for files created by open.
+
+    :param file_abs: Absolute name of the file to write.
+    :param content: The (byte) string to write.
+    """
+    tmp_file_abs = _write_temp_file(file_abs, content)
+    try:
+        _sync_file(tmp_file_abs)
+        os.rename(tmp_file_abs, file_abs)
+    except Exception:
+        os.unlink(tmp_file_abs)
+        raise
+
+
+def start_csv_write_batch():
+    """
+    Opens a batch of CSV writes.
 
-                abbreviation = '.'.join(abbreviation_split)
+    Until finish_csv_write_batch gets called, write_dict_values_sorted_to_csv
+    only writes temporary files for the CSVs that it rewrites, and does not
+    sync the CSVs that it appends to. So a run writing thousands of CSVs
+    needs not sync each of them on its own.
+    """
+    global csv_write_batch
+    csv_write_batch = []
+
+
+def pop_csv_write_batch():
+    """
+    Gets the CSV writes of the open batch, and empties the batch.
+
+    The batch stays open. The returned list can get added to the batch of
+    another process (by extending its csv_write_batch), or synced by
+    sync_csv_writes.
+    """
+    global csv_write_batch
+    writes = csv_write_batch
+    csv_write_batch = []
+    return writes
+
+
+def finish_csv_write_batch():
+    """
+    Closes the batch of CSV writes, and syncs its writes (see
+    sync_csv_writes).
+    """
+    global csv_write_batch
+    writes = csv_write_batch
+    csv_write_batch = None
+    sync_csv_writes(writes)
+
+
+def sync_csv_writes(writes):
+    """
+    Syncs CSV writes to disk, and renames their temporary files in place.
+
+    First, the data of all temporary files, and of all CSVs that got
+    appended to gets synced. Only then, the temporary files are renamed over
+    their CSVs, and each of the CSVs' directories gets synced once. So after
+    a crash of the host, each CSV holds either its old or its new content,
+    regardless of the file system's flushing heuristics.
+
+    Syncing the files' data right before the renames, instead of whenever a
+    CSV gets written, lets the file system write all of them out together.
+
+    If syncing fails, no CSV gets replaced, and the temporary files are
+    removed.
+
+    :param writes: List of (csv_file_abs, tmp_file_abs) pairs, as in
+        csv_write_batch.
+    """
+    try:
+        for (csv_file_abs, tmp_file_abs) in writes:
+            _sync_file(csv_file_abs if tmp_file_abs is None else tmp_file_abs)
+        for (csv_file_abs, tmp_file_abs) in writes:
+            if tmp_file_abs is not None:
+                os.rename(tmp_file_abs, csv_file_abs)
+    finally:
+        for (csv_file_abs, tmp_file_abs) in writes:
+            if tmp_file_abs is not None and os.path.exists(tmp_file_abs):
+                os.unlink(tmp_file_abs)
+    sync_dirs(set(os.path.dirname(csv_file_abs)
+                  for (csv_file_abs, tmp_file_abs) in writes
+                  if tmp_file_abs is not None))
+
+
+def sync_dirs(dirs_abs):
+    """
+    Syncs directories to disk, so files renamed into them survive a crash.
+
+    Only the directories themselves get synced. The files' data has to get
+    synced before (as write_file_atomically, and sync_csv_writes do).
+
+    Directories that no longer exist are skipped.
+
+    :param dirs_abs: Iterable of absolute names of directories to sync.
+    """
+    for dir_abs in sorted(dirs_abs):
+        try:
+            dir_fd = os.open(dir_abs, os.O_RDONLY)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
-            return abbreviation
-    return None
 
+def _parse_csv_column(column):
+    """Parses a CSV column to an int, None, or the column itself.
 
-def parse_csv_to_first_column_dict(csv_file_abs):
+    Empty columns are parsed to None, and columns that hold an integer in
+    canonical form are parsed to int. All other columns are kept as they
+    are, so formatting them again gives back the same column.
+
+    :param column: The column to parse.
+    """
+    if not column:
+        return None
+    try:
+        value = int(column)
+    except ValueError:
+        return column
+    return value if str(value) == column else column
+
+
+def csv_column_to_int(column):
+    """Gets the integer value of a column of a CsvRow.
+
+    If the column does not hold an integer, a ValueError is raised.
+
+    :param column: The column to get the integer value for.
+    """
+    if isinstance(column, (int, long)):
+        return column
+    if column is None:
+        raise ValueError("Empty column has no integer value")
+    return int(column.strip())
+
+
+class CsvRow(object):
+    """A row of a csv data dictionary.
+
+    A row has a first column, and a tuple of further columns. In those
+    further columns, integers are ints, empty columns are None, and all
+    other columns are strings.
+
+    Rows that got parsed from a line keep that line, and only parse their
+    further columns upon first access. Formatting such a row gives back the
+    line. Other rows are formatted upon writing.
+
+    Rows compare equal to rows with the same columns, and to their line.
+    """
+    __slots__ = ('first_column', '_columns', '_line')
+
+    def __init__(self, first_column, columns=None, line=None):
+        """Creates a row either from its columns, or from its line.
+
+        :param first_column: The row's first column.
+        :param columns: Iterable of the row's further columns. Ints, and
+            None are kept, all others are parsed like the columns of a
+            line. (Default: None)
+        :param line: The line of the row, if it got parsed from one. Its
+            first column has to be first_column. (Default: None)
+        """
+        self.first_column = first_column
+        self._line = line
+        if columns is None:
+            self._columns = None
+        else:
+            self._columns = tuple([
+                column if column is None or type(column) in (int, long)
+                else _parse_csv_column(str(column)) for column in columns])
+
+    @property
+    def columns(self):
+        """The tuple of the row's columns after the first column."""
+        if self._columns is None:
+            # Plain non-negative integers are by far the most common
+            # columns, so they are parsed right away.
+            self._columns = tuple([
+                int(column)
+                if column.isdigit() and (column[0] != '0' or column == '0')
+                else _parse_csv_column(column)
+                for column in self._line.split(',')[1:]])
+        return self._columns
+
+    def __str__(self):
+        if self._line is not None:
+            return self._line
+        return ','.join([self.first_column] + [
+            '' if column is None else str(column)
+            for column in self._columns])
+
+    def __repr__(self):
+        return 'CsvRow(%r)' % (str(self))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, CsvRow):
+            return self.first_column == other.first_column and \
+                self.columns == other.columns
+        if isinstance(other, basestring):
+            return str(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+
+def as_csv_row(value):
+    """Gets a value of a csv data dictionary as CsvRow.
+
+    Values that are lines (E.g.: '2014-11-01,1,2') get parsed to a CsvRow.
+    CsvRows are returned as they are.
+
+    :param value: The value to get as CsvRow.
+    """
+    if isinstance(value, CsvRow):
+        return value
+    return CsvRow(value.split(',', 1)[0], line=value)
+
+
+class CsvSeries(dict):
+    """A csv data dictionary that keeps its keys sorted.
+
+    The keys are periods (E.g.: '2014-11-01', '2014W44', '2014-11', or
+    '2014'), so their sorted order is the order of time. Adding a key that
+    sorts after all other keys takes amortized constant time, other keys are
+    found by bisection. Hence, iterating in order never needs a sort.
+
+    Reading works as for any dict, and the usual dict methods keep the
+    order up to date.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CsvSeries, self).__init__()
+        self._keys = []
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            keys = self._keys
+            if not keys or keys[-1] < key:
+                keys.append(key)
+            else:
+                bisect.insort(keys, key)
+        super(CsvSeries, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(CsvSeries, self).__delitem__(key)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def __reduce__(self):
+        return (self.__class__, (list(self.iteritems_sorted()),))
+
+    def clear(self):
+        super(CsvSeries, self).clear()
+        self._keys = []
+
+    def copy(self):
+        return self.__class__(self.iteritems_sorted())
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        if not self._keys:
+            raise KeyError('popitem(): dictionary is empty')
+        key = self._keys[-1]
+        return (key, self.pop(key))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        if len(args) > 1:
+            raise TypeError('update expected at most 1 arguments, got %d' % (
+                len(args)))
+        for other in args + (kwargs,):
+            if isinstance(other, CsvSeries):
+                items = other.iteritems_sorted()
+            elif hasattr(other, 'iteritems'):
+                items = other.iteritems()
+            else:
+                items = other
+            for (key, value) in items:
+                self[key] = value
+
+    def iterkeys_sorted(self):
+        """Iterates over the keys in sorted order."""
+        return iter(self._keys)
+
+    def itervalues_sorted(self):
+        """Iterates over the values in the sorted order of their keys."""
+        return (self[key] for key in self._keys)
+
+    def iteritems_sorted(self):
+        """Iterates over the items in the sorted order of their keys."""
+        return ((key, self[key]) for key in self._keys)
+
+
+def _is_complete_row(line, column_count):
+    """Checks whether a row that lacks its line ending is complete.
+
+    Appending to a CSV may get cut short by a crash. The row is considered
+    complete, if it has column_count columns, and all columns after the
+    first one are empty or integers.
+
+    :param line: The row to check, without line ending.
+    :param column_count: The number of columns of the row before, or None,
+        if there is no row before.
+    """
+    columns = line.split(',')
+    if column_count is not None and len(columns) != column_count:
+        return False
+    for column in columns[1:]:
+        if column:
+            try:
+                int(column)
+            except ValueError:
+                return False
+    return True
+
+
+def parse_csv_to_first_column_dict(csv_file_abs,
+                                   validate_unterminated_last_line=True):
     """Parses a csv to a dictionary indexed by the first column
 
-    The returned dictionary is indexed by a row's first column. And the
-    corresponding value is the /whole/ line.
+    The returned CsvSeries is indexed by a row's first column. And the
+    corresponding value is the CsvRow for the /whole/ line. The further
+    columns only get parsed, once they are needed.
 
     If the file does not exist, the empty dictionary is returned.
 
     Rows starting in 'Date' are ignored.
 
+    A last row that lacks its line ending may have been cut short by a crash
+    while appending to the file. Unless validate_unterminated_last_line is
+    False, such a row is ignored, if it does not have the same number of
+    columns as the row before, or if its counts are not integers. Its date
+    then gets computed again.
+
     In case two different rows have the same first column, a RuntimeError gets
     raised.
 
     :param csv_file_abs: Absolute file name of the CSV that should get parsed.
+    :param validate_unterminated_last_line: If False, parse a last row that
+        lacks its line ending without checking it. Use this for hand edited
+        files, that this module does not append to. (Default: True)
     """
-    csv_data = {}
+    csv_data = CsvSeries()
 
     if os.path.isfile(csv_file_abs):
         with open(csv_file_abs, 'r') as csv_file:
+            column_count = None
             for line in csv_file:
+                if not line.endswith('\n') and \
+                        validate_unterminated_last_line and \
+                        not _is_complete_row(line.strip(), column_count):
+                    # Only the last line can lack the line ending.
+                    break
+                column_count = line.count(',') + 1
+
                 first_column = line.split(',')[0]
                 if first_column in csv_data:
                     raise RuntimeError(
@@ -174,23 +820,196 @@ def parse_csv_to_first_column_dict(csv_file_abs):
 
                 if first_column != 'Date':
                     # No header line
-                    csv_data[first_column] = line.strip()
+                    csv_data[first_column] = CsvRow(first_column,
+                                                    line=line.strip())
     return csv_data
 
 
-def write_dict_values_sorted_to_csv(csv_file_abs, csv_data, header=None):
+def parse_csv_tail_to_first_columns(csv_file_abs, min_first_column):
+    """Parses the first columns of a sorted csv's last rows
+
+    The csv is read backwards from its end, until a row's first column is
+    smaller than min_first_column. So only the tail of the file needs to
+    get read. The returned set holds the first columns that are not smaller
+    than min_first_column.
+
+    If the file does not exist, the empty set is returned.
+
+    Rows starting in 'Date' are ignored.
+
+    If the rows are not strictly sorted by their first column (as
+    write_dict_values_sorted_to_csv writes them), or the last row lacks its
+    line ending (see parse_csv_to_first_column_dict), None is returned, and
+    the csv has to be parsed as a whole.
+
+    :param csv_file_abs: Absolute file name of the CSV that should get parsed.
+    :param min_first_column: The smallest first column to parse.
+    """
+    first_columns = set()
+
+    if not os.path.isfile(csv_file_abs):
+        return first_columns
+
+    with open(csv_file_abs, 'rb') as csv_file:
+        csv_file.seek(0, os.SEEK_END)
+        position = csv_file.tell()
+        partial_line = ''
+        is_after_last_line_ending = True
+        previous_first_column = None
+        while position > 0:
+            block_size = min(CSV_TAIL_BLOCK_SIZE, position)
+            position -= block_size
+            csv_file.seek(position)
+            lines = (csv_file.read(block_size) + partial_line).split('\n')
+            if position > 0:
+                # The block's first line may continue in the previous block.
+                partial_line = lines.pop(0)
+
+            for line in reversed(lines):
+                if is_after_last_line_ending:
+                    is_after_last_line_ending = False
+                    if line:
+                        # The last row lacks its line ending.
+                        return None
+                    continue
+
+                first_column = line.strip().split(',')[0]
+                if not first_column or first_column == 'Date':
+                    continue
+
+                if previous_first_column is not None and \
+                        first_column >= previous_first_column:
+                    return None
+                previous_first_column = first_column
+
+                if first_column < min_first_column:
+                    return first_columns
+                first_columns.add(first_column)
+    return first_columns
+
+
+def _iter_sorted_items(csv_data):
+    """
+    Iterates over a csv data dictionary's items in the order of their lines.
+
+    For a CsvSeries, the items are taken in the order of its keys, which is
+    the order of the lines, as each line starts in its key followed by a
+    comma. Other dictionaries get sorted.
+
+    :param csv_data: The csv data dictionary to iterate over.
+    """
+    if isinstance(csv_data, CsvSeries):
+        return csv_data.iteritems_sorted()
+    return iter(sorted(csv_data.iteritems(), key=lambda item: str(item[1])))
+
+
+def _get_lines_to_append(csv_file_abs, csv_data, existing_csv_data, header):
+    """
+    Gets the sorted lines to append to a csv to get it to hold csv_data.
+
+    If csv_data does not only add lines that sort after existing_csv_data's
+    lines, or the file does not look as written by
+    write_dict_values_sorted_to_csv for existing_csv_data, None is
+    returned.
+
+    See write_dict_values_sorted_to_csv for the parameters.
+    """
+    if not existing_csv_data:
+        return None
+
+    for (first_column, row) in existing_csv_data.iteritems():
+        if first_column not in csv_data or csv_data[first_column] != row:
+            return None
+
+    existing_lines = [str(row) for row in existing_csv_data.itervalues()]
+    last_line = max(existing_lines)
+    lines = [str(row) for (first_column, row) in _iter_sorted_items(csv_data)
+             if first_column not in existing_csv_data]
+    if lines and lines[0] <= last_line:
+        return None
+
+    expected_head = '%s%s' % (header, CSV_LINE_ENDING) if header else ''
+    expected_tail = last_line + CSV_LINE_ENDING
+    expected_size = len(expected_head) + sum(
+        len(line) + len(CSV_LINE_ENDING) for line in existing_lines)
+    try:
+        if os.path.getsize(csv_file_abs) != expected_size:
+            return None
+        with open(csv_file_abs, 'rb') as csv_file:
+            if csv_file.read(len(expected_head)) != expected_head:
+                return None
+            csv_file.seek(-len(expected_tail), os.SEEK_END)
+            if csv_file.read() != expected_tail:
+                return None
+    except (IOError, OSError):
+        return None
+    return lines
+
+
+def write_dict_values_sorted_to_csv(csv_file_abs, csv_data, header=None,
+                                    existing_csv_data=None):
     """
     Writes a dictionary's values sorted to a file.
 
+    The values of a CsvSeries are written in the order of its keys, so they
+    need not get sorted.
+
+    The file is replaced atomically, so readers either see the old, or the
+    new file, but never a partial one. If a batch of CSV writes is open (see
+    start_csv_write_batch), the new file is only written to a temporary
+    file, which gets renamed over csv_file_abs when the batch is finished.
+    Otherwise, the file is written and synced right away (see
+    sync_csv_writes).
+
+    If existing_csv_data is given, and csv_data differs from it only by
+    lines that sort after all of existing_csv_data's lines, only those lines
+    get appended to the file in a single write, instead of rewriting it.
+    The appended data gets synced like a rewritten file's. If a crash cuts
+    the append short, the file's last line lacks its line ending, and is
+    incomplete. The parsers ignore such a line (see
+    parse_csv_to_first_column_dict), so its date gets computed again, and as
+    the file then does not look as written by this function, it gets
+    rewritten.
+
+    The file is rewritten, if it does not look as written by this function
+    for existing_csv_data (E.g.: it lacks the header).
+
     :param csv_file_abs: Absolute file name of where to wrie the csv data to.
     :param csv_file_abs: The csv data to write. Needs to be a dictionary.
     :param header: If given, gets used as header for the file.
+    :param existing_csv_data: The csv data that the file holds, as parsed by
+        parse_csv_to_first_column_dict. (Default: None)
+    """
+    if existing_csv_data is not None:
+        lines = _get_lines_to_append(
+            csv_file_abs, csv_data, existing_csv_data, header)
+        if lines is not None:
+            if lines:
+                with open(csv_file_abs, 'ab') as csv_file:
+                    csv_file.write(''.join(line + CSV_LINE_ENDING
+                                           for line in lines))
+                _add_csv_write(csv_file_abs, None)
+            return
+
+    lines = [str(row) for (first_column, row) in _iter_sorted_items(csv_data)]
+    if header:
+        lines.insert(0, header)
+    _add_csv_write(csv_file_abs, _write_temp_file(
+        csv_file_abs, ''.join(line + CSV_LINE_ENDING for line in lines)))
+
+
+def _add_csv_write(csv_file_abs, tmp_file_abs):
+    """
+    Adds a CSV write to the open batch, or syncs it, if no batch is open.
+
+    :param csv_file_abs: Absolute name of the CSV that got written.
+    :param tmp_file_abs: Absolute name of the temporary file to rename over
+        csv_file_abs, or None, if data got appended to csv_file_abs.
     """
-    with open(csv_file_abs, 'w') as csv_file:
-        if header:
-            csv_file.write('%s%s' % (header, CSV_LINE_ENDING))
-        csv_file.writelines([line + CSV_LINE_ENDING
-                             for line in sorted(csv_data.itervalues())])
+    if csv_write_batch is None:
+        sync_csv_writes([(csv_file_abs, tmp_file_abs)])
+    else:
+        csv_write_batch.append((csv_file_abs, tmp_file_abs))
 
 
 def update_csv_data_dict(csv_data, first_column, *other_columns):
@@ -201,20 +1020,36 @@ def update_csv_data_dict(csv_data, first_column, *other_columns):
     :param first_column: The first column of the row to add.
     :param *other_columns: The further columns of the row to add.
     """
-    line = first_column
-    for column in other_columns:
-        line += ',%s' % ('' if column is None else column)
-    csv_data[first_column] = line
+    csv_data[first_column] = CsvRow(first_column, other_columns)
     return csv_data
 
 
+def _get_summable_columns(value):
+    """Gets the integer columns of a csv data dictionary value for summing.
+
+    The total column is left out, so the returned list holds the three
+    columns after it. If there are not three such integer columns, a
+    ValueError is raised.
+
+    :param value: The CsvRow, or line to get the columns for.
+    """
+    columns = list(as_csv_row(value).columns[1:4])
+    if len(columns) != 3:
+        raise ValueError('Cannot parse CSV data dict value.')
+    for column in columns:
+        if type(column) is not int:
+            return [csv_column_to_int(column) for column in columns]
+    return columns
+
+
 def merge_sum_csv_data_dict(csv_data_1, csv_data_2):
     """
     Merge csv_data_2 into csv_data_1, accumulating values by date.
 
-    The two dicts have to be of the form dict<key: str, value: str>
-    and their value format should be 'date,int,int,int,int'.
-    If any of those is incorrect, a ValueError is raised.
+    The two dicts have to be of the form dict<key: str, value: CsvRow>
+    (or value: str) and their value format should be
+    'date,int,int,int,int'. If any of those is incorrect, a ValueError is
+    raised.
 
     The merged values will be the cross sum of all integer operators,
     with the exception of the first integer column, that will hold
@@ -226,15 +1061,16 @@ def merge_sum_csv_data_dict(csv_data_1, csv_data_2):
     :param csv_data_1: The data dict to be merged on.
     :param csv_data_2: The data dict to be added from.
     """
-    parse = lambda vs: [int(v.strip()) for v in vs.split(',')[2:5]]
-    build = lambda d, vs: ','.join([d, str(sum(vs))] + [str(v) for v in vs])
-
-    for date in csv_data_2:
-
-        value_1 = parse(csv_data_1[date]) if date in csv_data_1 else [0, 0, 0]
-        value_2 = parse(csv_data_2[date])
-        if len(value_1) != 3 or len(value_2) != 3:
-            raise ValueError('Cannot parse CSV data dict value.')
-
-        summed_value = map(add, value_1, value_2)
-        csv_data_1[date] = build(date, summed_value)
+    # Going through a CsvSeries in order allows csv_data_1 to append dates
+    # that are new to it.
+    if isinstance(csv_data_2, CsvSeries):
+        items_2 = csv_data_2.iteritems_sorted()
+    else:
+        items_2 = csv_data_2.iteritems()
+    for (date, row_2) in items_2:
+        summed_value = _get_summable_columns(row_2)
+        row_1 = csv_data_1.get(date)
+        if row_1 is not None:
+            summed_value = map(add, _get_summable_columns(row_1),
+                               summed_value)
+        csv_data_1[date] = CsvRow(date, [sum(summed_value)] + summed_value)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+  Unit tests for the in-memory daily cache
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  This module contains tests for aggregator.daily_cache, and its use in
+  aggregator.projectcounts.
+
+"""
+
+import aggregator
+import testcases
+import datetime
+import os
+import threading
+
+
+class DailyCacheTestCase(testcases.ProjectcountsTestCase):
+    """TestCase for the in-memory daily cache"""
+    def test_get_missing(self):
+        cache = aggregator.DailyCache()
+
+        self.assertIsNone(cache.get('foo'))
+
+    def test_set_get(self):
+        cache = aggregator.DailyCache()
+
+        cache.set('foo', (None, {'en': 1}))
+
+        self.assertEquals(cache.get('foo'), (None, {'en': 1}))
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = aggregator.DailyCache(max_entries=2)
+        cache.set('foo', (None, {'en': 1}))
+        cache.set('bar', (None, {'en': 2}))
+        cache.get('foo')
+
+        cache.set('baz', (None, {'en': 3}))
+
+        self.assertEquals(len(cache), 2)
+        self.assertIn('foo', cache)
+        self.assertNotIn('bar', cache)
+        self.assertIn('baz', cache)
+
+    def test_max_bytes(self):
+        data = dict(('wiki%d' % (i), i) for i in range(100))
+        size = aggregator.estimate_count_dictionary_size(data)
+        cache = aggregator.DailyCache(max_bytes=2 * size)
+
+        for key in ['foo', 'bar', 'baz']:
+            cache.set(key, (None, data))
+
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.bytes, 2 * size)
+        self.assertNotIn('foo', cache)
+
+    def test_max_bytes_keeps_most_recent_entry(self):
+        cache = aggregator.DailyCache(max_bytes=1)
+
+        cache.set('foo', (None, {'en': 1}))
+        cache.set('bar', (None, {'en': 2}))
+
+        self.assertEquals(len(cache), 1)
+        self.assertEquals(cache.get('bar'), (None, {'en': 2}))
+
+    def test_set_replaces_entry(self):
+        cache = aggregator.DailyCache()
+        cache.set('foo', (None, {'en': 1, 'de': 2}))
+
+        cache.set('foo', (None, {'en': 1}))
+
+        self.assertEquals(len(cache), 1)
+        self.assertEquals(cache.bytes,
+                          aggregator.estimate_count_dictionary_size(
+                              {'en': 1}))
+
+    def test_set_budget_evicts(self):
+        cache = aggregator.DailyCache()
+        for key in ['foo', 'bar', 'baz']:
+            cache.set(key, (None, {'en': 1}))
+
+        cache.set_budget(max_entries=1)
+
+        self.assertEquals(len(cache), 1)
+        self.assertIn('baz', cache)
+
+    def test_clear(self):
+        cache = aggregator.DailyCache()
+        cache.set('foo', (None, {'en': 1}))
+
+        cache.clear()
+
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.bytes, 0)
+
+    def test_concurrent_use(self):
+        cache = aggregator.DailyCache(max_entries=10)
+
+        def use_cache(thread_nr):
+            for i in range(1000):
+                key = (thread_nr, i % 20)
+                if cache.get(key) is None:
+                    cache.set(key, (None, {'en': i}))
+
+        threads = [threading.Thread(target=use_cache, args=(thread_nr,))
+                   for thread_nr in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(len(cache), 10)
+
+    def test_vocabulary_intern(self):
+        vocabulary = aggregator.Vocabulary()
+
+        self.assertEquals(vocabulary.intern('en'), 0)
+        self.assertEquals(vocabulary.intern('de'), 1)
+        self.assertEquals(vocabulary.intern('en'), 0)
+        self.assertEquals(vocabulary.find('de'), 1)
+        self.assertIsNone(vocabulary.find('fr'))
+        self.assertEquals(len(vocabulary), 2)
+
+    def test_daily_counts_get(self):
+        vocabulary = aggregator.Vocabulary()
+        vocabulary.intern('fr')
+
+        counts = aggregator.DailyCounts(vocabulary, {'en': 1, 'de': 26})
+
+        self.assertEquals(counts.get('en'), 1)
+        self.assertEquals(counts.get('de'), 26)
+        # In the vocabulary, but without count for the day
+        self.assertEquals(counts.get('fr'), 0)
+        # Not in the vocabulary
+        self.assertEquals(counts.get('foo'), 0)
+        self.assertIsNone(counts.get('foo', None))
+
+    def test_daily_counts_get_later_interned(self):
+        vocabulary = aggregator.Vocabulary()
+        counts = aggregator.DailyCounts(vocabulary, {'en': 1})
+        aggregator.DailyCounts(vocabulary, {'de': 26})
+
+        self.assertEquals(counts.get('de'), 0)
+
+    def test_daily_counts_smaller_than_dictionary(self):
+        data = dict(('wiki%d' % (i), i * 1000) for i in range(2000))
+
+        counts = aggregator.DailyCounts(aggregator.Vocabulary(), data)
+
+        self.assertLess(counts.estimate_size() * 10,
+                        aggregator.estimate_count_dictionary_size(data))
+
+    def test_get_daily_count_cached_compactly(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.get_daily_count(fixture, 'en', date)
+        actual_de = aggregator.get_daily_count(fixture, 'de', date)
+        actual_foo = aggregator.get_daily_count(fixture, 'foo', date)
+
+        self.assertEquals(actual_de, 26)
+        self.assertEquals(actual_foo, 0)
+        (abbreviations, counts, complete) = aggregator.cache.get(
+            (fixture, False, date))
+        self.assertIsInstance(counts, aggregator.DailyCounts)
+        self.assertEquals(aggregator.get_statistics()['cache_hits'], 2)
+
+    def test_get_daily_count_with_budget(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        aggregator.set_cache_budget(max_days=1)
+        first_date = datetime.date(2014, 11, 1)
+        second_date = datetime.date(2014, 11, 2)
+
+        aggregator.get_daily_count(source_dir_abs, 'en', first_date)
+        aggregator.get_daily_count(source_dir_abs, 'en', second_date)
+        # Changing the first day's files is only seen, if the first day got
+        # evicted.
+        self.create_file(os.path.join(
+            source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-010000'), ['en - 2000 4'])
+        actual = aggregator.get_daily_count(source_dir_abs, 'en', first_date)
+
+        self.assertEquals(actual, 25276)
+        self.assertEquals(len(aggregator.cache), 1)
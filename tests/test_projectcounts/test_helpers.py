@@ -22,8 +22,12 @@
 
 import aggregator
 import testcases
+import bz2
 import datetime
+import glob
+import gzip
 import nose
+import os
 
 
 class BasicTestCase(testcases.ProjectcountsTestCase):
@@ -52,6 +56,44 @@ class BasicTestCase(testcases.ProjectcountsTestCase):
         nose.tools.assert_raises(RuntimeError,
                                  aggregator.aggregate_for_date, fixture, date)
 
+    def test_aggregate_for_date_missing_month_directory(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 12, 1)
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.aggregate_for_date, fixture, date)
+
+    def test_aggregate_for_date_missing_month_directory_allow_bad_data(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 12, 1)
+
+        actual = aggregator.aggregate_for_date(fixture, date,
+                                               allow_bad_data=True)
+
+        self.assertEquals(actual, {})
+
+    def test_aggregate_for_date_source_inventory_kept_for_run(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-missing-hours')
+        date = datetime.date(2014, 11, 1)
+        aggregator.aggregate_for_date(source_dir_abs, date,
+                                      allow_bad_data=True)
+        self.create_file(os.path.join(
+            source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141102-000000'), ['en - 1000 4'])
+
+        # The source directory has already been listed, so the new hourly
+        # file is only seen once the cache gets cleared.
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.aggregate_for_date,
+                                 source_dir_abs, date)
+        aggregator.clear_cache()
+        actual = aggregator.aggregate_for_date(source_dir_abs, date)
+
+        self.assertEquals(actual['en'], 3553)
+
     def test_aggregate_for_date_missing_hours_2014_11_01_no_bad_data(self):
         fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
 
@@ -191,6 +233,226 @@ class BasicTestCase(testcases.ProjectcountsTestCase):
 
         self.assertEquals(actual, expected)
 
+    def test_aggregate_for_date_different_wiki_jobs(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(fixture, date, jobs=4)
+
+        expected = {'en': 1, 'de': 26, 'fr': 8}
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_date_missing_hours_2014_11_02_jobs(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.aggregate_for_date,
+                                 fixture, date, jobs=4)
+
+    def test_aggregate_for_date_missing_hours_2014_11_02_allow_bad_data_jobs(
+            self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        actual = aggregator.aggregate_for_date(fixture, date,
+                                               allow_bad_data=True, jobs=4)
+
+        # Same as for the serial read, the 12th hour is missing.
+        expected = {'en': 4864}
+
+        self.assertEquals(actual, expected)
+
+    def compress_file(self, file_abs, suffix, remove_uncompressed=True):
+        opener = {'.gz': gzip.open, '.bz2': bz2.BZ2File}[suffix]
+        with open(file_abs, 'r') as uncompressed_file:
+            compressed_file = opener(file_abs + suffix, 'w')
+            try:
+                compressed_file.write(uncompressed_file.read())
+            finally:
+                compressed_file.close()
+        if remove_uncompressed:
+            os.unlink(file_abs)
+
+    def test_aggregate_for_date_compressed(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        hourly_files_abs = sorted(glob.glob(os.path.join(
+            source_dir_abs, '2014', '2014-11', 'projectcounts-20141101-*')))
+        for hourly_file_abs in hourly_files_abs[0::2]:
+            self.compress_file(hourly_file_abs, '.gz')
+        for hourly_file_abs in hourly_files_abs[1::4]:
+            self.compress_file(hourly_file_abs, '.bz2')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(source_dir_abs, date)
+
+        # Same as for the uncompressed files
+        expected = {'en': 24276}
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_date_compressed_prefer_smaller(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        hourly_file_abs = os.path.join(
+            source_dir_abs, '2014', '2014-11', 'projectcounts-20141101-010000')
+        self.create_file(hourly_file_abs, ['en - 1 4'] * 1000)
+        self.compress_file(hourly_file_abs, '.gz', remove_uncompressed=False)
+        with open(hourly_file_abs, 'a') as hourly_file:
+            # The uncompressed file is bigger than the gzipped one, so this
+            # line should not be seen.
+            hourly_file.write('en - 100000 4\n')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(source_dir_abs, date)
+
+        # The gzipped first hour sums up to 1000, just as the original one
+        expected = {'en': 24276}
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_date_mixed_case_duplicates(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        hourly_file_abs = os.path.join(
+            source_dir_abs, '2014', '2014-11', 'projectcounts-20141101-010000')
+        self.create_file(hourly_file_abs, [
+            'EN - 600 4',
+            'de - 1 4',
+            'en - 400 4',
+            ])
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(source_dir_abs, date)
+
+        # 'EN' and 'en' of the first hour sum up to the 1000 of the original
+        # file
+        expected = {'en': 24276, 'de': 1}
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_date_different_wiki_abbreviations(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(
+            fixture, date, abbreviations=set(['en', 'fr', 'it']))
+
+        expected = {'en': 1, 'fr': 8}
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_date_wrong_lines_abbreviations(self):
+        fixture = self.get_fixture_dir_abs('2014-11-wrong-lines')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.aggregate_for_date(
+            fixture, date, abbreviations=set(['de']))
+
+        self.assertEquals(actual, {})
+
+    def test_aggregate_for_dates_enwiki_different_per_day(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        actual = list(aggregator.aggregate_for_dates(
+            fixture, first_date, last_date))
+
+        expected = [
+            (datetime.date(2014, 11, 1), {'en': 24276}),
+            (datetime.date(2014, 11, 2), {'en': 48276}),
+            (datetime.date(2014, 11, 3), {'en': 72276}),
+            ]
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_dates_enwiki_different_per_day_jobs(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        actual = list(aggregator.aggregate_for_dates(
+            fixture, first_date, last_date, jobs=4))
+
+        expected = [
+            (datetime.date(2014, 11, 1), {'en': 24276}),
+            (datetime.date(2014, 11, 2), {'en': 48276}),
+            (datetime.date(2014, 11, 3), {'en': 72276}),
+            ]
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_dates_missing_hours_bad_dates_jobs(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 4)
+        bad_dates = [
+            datetime.date(2014, 11, 1),
+            datetime.date(2014, 11, 2),
+            ]
+
+        actual = []
+        try:
+            for item in aggregator.aggregate_for_dates(
+                    fixture, first_date, last_date, bad_dates=bad_dates,
+                    jobs=4):
+                actual.append(item)
+            self.fail("No RuntimeError raised for 2014-11-03")
+        except RuntimeError:
+            pass
+
+        # The good days before the missing hours still get yielded
+        expected = [
+            (datetime.date(2014, 11, 1), {'en': 2553}),
+            (datetime.date(2014, 11, 2), {'en': 4864}),
+            ]
+
+        self.assertEquals(actual, expected)
+
+    def test_aggregate_for_dates_missing_hours_bad_dates_prefetch(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 4)
+        bad_dates = [
+            datetime.date(2014, 11, 1),
+            datetime.date(2014, 11, 2),
+            ]
+
+        actual = []
+        try:
+            for item in aggregator.aggregate_for_dates(
+                    fixture, first_date, last_date, bad_dates=bad_dates,
+                    prefetch_dates=2):
+                actual.append(item)
+            self.fail("No RuntimeError raised for 2014-11-03")
+        except RuntimeError:
+            pass
+
+        # The good days before the missing hours still get yielded
+        expected = [
+            (datetime.date(2014, 11, 1), {'en': 2553}),
+            (datetime.date(2014, 11, 2), {'en': 4864}),
+            ]
+
+        self.assertEquals(actual, expected)
+
     def test_get_daily_count_en(self):
         fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
 
@@ -227,6 +489,24 @@ class BasicTestCase(testcases.ProjectcountsTestCase):
 
         self.assertEquals(actual, 0)
 
+    def test_get_daily_count_abbreviations_cached(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        abbreviations = set(['en', 'de'])
+        actual_en = aggregator.get_daily_count(
+            fixture, 'en', date, abbreviations=abbreviations)
+        actual_de = aggregator.get_daily_count(
+            fixture, 'de', date, abbreviations=abbreviations)
+        # 'fr' is not covered by the cached, filtered data, so the day has to
+        # get read again.
+        actual_fr = aggregator.get_daily_count(fixture, 'fr', date)
+
+        self.assertEquals(actual_en, 1)
+        self.assertEquals(actual_de, 26)
+        self.assertEquals(actual_fr, 8)
+
     def test_get_daily_count_missing_hours_2014_11_01(self):
         fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
 
@@ -346,6 +626,58 @@ class BasicTestCase(testcases.ProjectcountsTestCase):
         # No hour files at all, so no count is expected
         self.assertEquals(actual, 0)
 
+    def test_get_daily_count_missing_hours_cached_bad_data_not_reused(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.get_daily_count(fixture, 'en', date,
+                                            allow_bad_data=True)
+        self.assertEquals(actual, 2553)
+
+        # The cached day lacks hours, so it must not get used, if bad data
+        # is not allowed.
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.get_daily_count,
+                                 fixture, 'en', date)
+
+    def test_get_daily_count_complete_day_cached_for_bad_data(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.get_daily_count(fixture, 'en', date)
+        aggregator.reset_statistics()
+        actual = aggregator.get_daily_count(fixture, 'en', date,
+                                            allow_bad_data=True)
+
+        self.assertEquals(actual, 1)
+        self.assertEquals(aggregator.get_statistics()['cache_hits'], 1)
+
+    def test_get_daily_count_projectviews_cached_separately(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        # Add a projectviews file next to each projectcounts file
+        for projectcounts_file_abs in glob.glob(os.path.join(
+                source_dir_abs, '2014', '2014-11', 'projectcounts-*')):
+            self.create_file(projectcounts_file_abs.replace(
+                'projectcounts-', 'projectviews-'), ['en - 2 0'])
+
+        actual_counts = aggregator.get_daily_count(
+            source_dir_abs, 'en', date)
+        actual_views = aggregator.get_daily_count(
+            source_dir_abs, 'en', date, output_projectviews=True)
+        actual_counts_again = aggregator.get_daily_count(
+            source_dir_abs, 'en', date)
+
+        self.assertEquals(actual_counts, 1)
+        self.assertEquals(actual_views, 48)
+        self.assertEquals(actual_counts_again, 1)
+        self.assertEquals(len(aggregator.projectcounts.cache), 2)
+
     def test_rescale_counts_single_day(self):
         dates = [datetime.date(2014, 8, 3)]
 
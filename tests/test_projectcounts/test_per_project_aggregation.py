@@ -75,6 +75,28 @@ class ProjectAggregationTestCase(testcases.ProjectcountsDataTestCase):
             '2014-11-01,1,2,3,4',
             ])
 
+    def test_update_per_project_unterminated_last_line_survives(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+
+        enwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'enwiki.csv')
+        with open(enwiki_file_abs, 'w') as file:
+            file.write(aggregator.CSV_HEADER + aggregator.CSV_LINE_ENDING +
+                       '2014-11-05,77,77,,')
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture,
+            self.data_dir_abs,
+            datetime.date(2014, 11, 1),
+            datetime.date(2014, 11, 3))
+
+        self.assert_file_content_equals(enwiki_file_abs, [
+            '2014-11-01,24276,24276,0,0',
+            '2014-11-02,48276,48276,0,0',
+            '2014-11-03,72276,72276,0,0',
+            '2014-11-05,77,77,,',
+            ])
+
     def test_update_per_project_single_csvs_3days_2014_11_01(self):
         fixture = self.get_fixture_dir_abs(
             '2014-11-3days-enwiki-day-times-100-plus-hour')
@@ -456,3 +478,329 @@ class ProjectAggregationTestCase(testcases.ProjectcountsDataTestCase):
             '2014-11-02,321,321,0,0',
             '2014-11-03,310,310,0,0',
             ])
+
+    def test_update_per_project_compute_all_projects_filter_abbreviations(
+            self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        enwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'enwiki.csv')
+        dewiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'dewiki.csv')
+        self.create_empty_file(enwiki_file_abs)
+        self.create_empty_file(dewiki_file_abs)
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture,
+            self.data_dir_abs,
+            first_date,
+            last_date,
+            compute_all_projects=True,
+            filter_abbreviations=True)
+
+        self.assert_file_content_equals(enwiki_file_abs, [
+            '2014-11-01,103,103,0,0',
+            '2014-11-02,108,108,0,0',
+            '2014-11-03,109,109,0,0',
+            ])
+
+        all_file_abs = os.path.join(self.daily_raw_dir_abs, 'all.csv')
+        self.assert_file_content_equals(all_file_abs, [
+            '2014-11-01,224,224,0,0',
+            '2014-11-02,207,207,0,0',
+            '2014-11-03,214,214,0,0',
+            ])
+
+    def test_update_per_project_skip_complete_csvs(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        enwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'enwiki.csv')
+        dewiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'dewiki.csv')
+        frwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'frwiki.csv')
+        all_file_abs = os.path.join(self.daily_raw_dir_abs, 'all.csv')
+        self.create_empty_file(enwiki_file_abs)
+        self.create_empty_file(dewiki_file_abs)
+        self.create_empty_file(frwiki_file_abs)
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, self.data_dir_abs, first_date, last_date,
+            compute_all_projects=True)
+
+        # Dropping enwiki's header allows to tell whether it got rewritten.
+        with open(enwiki_file_abs, 'r') as file:
+            enwiki_lines = file.readlines()[1:]
+        with open(enwiki_file_abs, 'w') as file:
+            file.writelines(enwiki_lines)
+        with open(dewiki_file_abs, 'r') as file:
+            dewiki_lines = file.readlines()
+        with open(dewiki_file_abs, 'w') as file:
+            file.writelines(dewiki_lines[:-1])
+
+        aggregator.reset_statistics()
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, self.data_dir_abs, first_date, last_date,
+            compute_all_projects=True, skip_complete_csvs=True)
+
+        with open(enwiki_file_abs, 'r') as file:
+            self.assertEquals(file.readlines(), enwiki_lines)
+        with open(dewiki_file_abs, 'r') as file:
+            self.assertEquals(file.readlines(), dewiki_lines)
+        self.assert_file_content_equals(all_file_abs, [
+            '2014-11-01,323,323,0,0',
+            '2014-11-02,321,321,0,0',
+            '2014-11-03,310,310,0,0',
+            ])
+        self.assertEquals(aggregator.get_statistics()['csvs_skipped'], 2)
+
+    def test_update_per_project_skip_complete_csvs_bad_dates(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+
+        date = datetime.date(2014, 11, 2)
+
+        enwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'enwiki.csv')
+        self.create_file(enwiki_file_abs, [
+            '2014-11-02,1,2,3,4',
+            ])
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, self.data_dir_abs, date, date, bad_dates=[date],
+            skip_complete_csvs=True)
+
+        # The CSV has a bad date, so it got rewritten with a header.
+        self.assert_file_content_equals(enwiki_file_abs, [
+            '2014-11-02,1,2,3,4',
+            ])
+        self.assertEquals(aggregator.get_statistics()['csvs_skipped'], 0)
+
+    def test_get_untracked_dbnames(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        self.create_empty_file(os.path.join(self.daily_raw_dir_abs,
+                                            'enwiki.csv'))
+
+        actual = aggregator.get_untracked_dbnames(
+            fixture, self.data_dir_abs, date)
+
+        self.assertEquals(actual, (['dewiki', 'frwiki'], {}, []))
+
+    def test_get_untracked_dbnames_ambiguous_and_unknown(self):
+        source_dir_abs = os.path.join(self.create_tmp_dir_abs(), '2014',
+                                      '2014-11')
+        os.makedirs(source_dir_abs)
+        self.create_file(os.path.join(
+            source_dir_abs, 'projectcounts-20141101-010000'), [
+            'de - 1 0',
+            'de.m - 1 0',
+            'uk.m - 1 0',
+            'foo.bar - 1 0',
+            ])
+
+        date = datetime.date(2014, 11, 1)
+
+        actual = aggregator.get_untracked_dbnames(
+            os.path.dirname(os.path.dirname(source_dir_abs)),
+            self.data_dir_abs, date, allow_bad_data=True)
+
+        # 'de.m' is resolved through 'de'
+        self.assertEquals(actual, (['dewiki'], {
+            'uk.m': ['ukwiki', 'ukwikimedia'],
+            }, ['foo.bar']))
+
+    def test_create_per_project_csvs(self):
+        enwiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'enwiki.csv')
+        dewiki_file_abs = os.path.join(self.daily_raw_dir_abs, 'dewiki.csv')
+        self.create_file(enwiki_file_abs, [
+            aggregator.CSV_HEADER,
+            '2014-11-01,1,1,0,0',
+            ])
+
+        actual = aggregator.create_per_project_csvs(
+            self.data_dir_abs, ['dewiki', 'enwiki'])
+
+        self.assertEquals(actual, [dewiki_file_abs])
+        self.assertEquals(os.path.getsize(dewiki_file_abs), 0)
+        self.assert_file_content_equals(enwiki_file_abs, [
+            '2014-11-01,1,1,0,0',
+            ])
+
+    def test_update_per_project_processes_same_as_serial(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        additional_aggregators = [aggregator.update_daily_csv]
+
+        serial_dir_abs = self.data_dir_abs
+        parallel_dir_abs = os.path.join(self.create_tmp_dir_abs(), 'data')
+        os.makedirs(os.path.join(parallel_dir_abs, 'daily_raw'))
+        for data_dir_abs in [serial_dir_abs, parallel_dir_abs]:
+            for dbname in ['dewiki', 'enwiki', 'frwiki']:
+                self.create_empty_file(os.path.join(
+                    data_dir_abs, 'daily_raw', dbname + '.csv'))
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, serial_dir_abs, first_date, last_date,
+            additional_aggregators=additional_aggregators,
+            compute_all_projects=True)
+        aggregator.reset_statistics()
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, parallel_dir_abs, first_date, last_date,
+            additional_aggregators=additional_aggregators,
+            compute_all_projects=True, processes=2)
+
+        serial_files = sorted(
+            os.path.relpath(os.path.join(dir_abs, file_name), serial_dir_abs)
+            for (dir_abs, dir_names, file_names) in os.walk(serial_dir_abs)
+            for file_name in file_names)
+        parallel_files = sorted(
+            os.path.relpath(os.path.join(dir_abs, file_name),
+                            parallel_dir_abs)
+            for (dir_abs, dir_names, file_names) in os.walk(parallel_dir_abs)
+            for file_name in file_names)
+        self.assertEquals(parallel_files, serial_files)
+        self.assertIn(os.path.join('daily_raw', 'all.csv'), serial_files)
+        for file_rel in serial_files:
+            with open(os.path.join(serial_dir_abs, file_rel)) as file:
+                expected = file.read()
+            with open(os.path.join(parallel_dir_abs, file_rel)) as file:
+                self.assertEquals(file.read(), expected)
+
+        # The days got cached by the first run. Reading them up front hits
+        # the cache 3 times, and the workers' 27 cache hits got passed back.
+        self.assertEquals(aggregator.get_statistics()['cache_hits'], 30)
+
+        # The workers' CSV writes got synced by the parent, which left no
+        # temporary files (see the comparison of the files above).
+        self.assertIsNone(aggregator.util.csv_write_batch)
+
+    def test_update_per_project_processes_failing_csv(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        date = datetime.date(2014, 11, 1)
+
+        for dbname in ['dewiki', 'enwiki', 'frwiki']:
+            self.create_empty_file(os.path.join(
+                self.daily_raw_dir_abs, dbname + '.csv'))
+
+        def failing_aggregator(target_dir_abs, dbname, *args, **kwargs):
+            if dbname == 'enwiki':
+                raise RuntimeError("foo")
+
+        nose.tools.assert_raises(
+            RuntimeError,
+            aggregator.update_per_project_csvs_for_dates,
+            fixture, self.data_dir_abs, date, date,
+            additional_aggregators=[failing_aggregator], processes=2)
+
+        # All CSVs got written, even the failing one's daily_raw CSV, and no
+        # temporary file is left over.
+        self.assertEquals(sorted(os.listdir(self.daily_raw_dir_abs)),
+                          ['dewiki.csv', 'enwiki.csv', 'frwiki.csv'])
+        for dbname in ['dewiki', 'enwiki', 'frwiki']:
+            self.assertNotEquals(os.path.getsize(os.path.join(
+                self.daily_raw_dir_abs, dbname + '.csv')), 0)
+        self.assertIsNone(aggregator.util.csv_write_batch)
+
+    def test_update_per_project_processes_statistics(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 2)
+
+        # With only one cached day, each CSV has to read both days again, so
+        # the workers read hourly files as well.
+        aggregator.set_cache_budget(max_days=1)
+
+        serial_dir_abs = self.data_dir_abs
+        parallel_dir_abs = os.path.join(self.create_tmp_dir_abs(), 'data')
+        os.makedirs(os.path.join(parallel_dir_abs, 'daily_raw'))
+        for data_dir_abs in [serial_dir_abs, parallel_dir_abs]:
+            for dbname in ['dewiki', 'enwiki', 'frwiki']:
+                self.create_empty_file(os.path.join(
+                    data_dir_abs, 'daily_raw', dbname + '.csv'))
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, serial_dir_abs, first_date, last_date)
+        serial_statistics = aggregator.get_statistics()
+        aggregator.clear_cache()
+        aggregator.reset_statistics()
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, parallel_dir_abs, first_date, last_date, processes=2)
+        parallel_statistics = aggregator.get_statistics()
+
+        # Both days get read up front, and again for each of the 3 CSVs.
+        self.assertEquals(parallel_statistics['hourly_files_read'],
+                          (1 + 3) * 2 * 24)
+        for name in ['hourly_files_read', 'bytes_read', 'lines_parsed',
+                     'cache_hits', 'cache_misses']:
+            self.assertEquals(parallel_statistics[name],
+                              serial_statistics[name])
+        self.assertEquals(sorted(parallel_statistics['date_seconds']),
+                          [first_date, last_date])
+
+    def test_update_per_project_date_major_same_as_serial(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3projects-for-aggregation')
+
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        additional_aggregators = [aggregator.update_daily_csv]
+
+        serial_dir_abs = self.data_dir_abs
+        date_major_dir_abs = os.path.join(self.create_tmp_dir_abs(), 'data')
+        os.makedirs(os.path.join(date_major_dir_abs, 'daily_raw'))
+        for data_dir_abs in [serial_dir_abs, date_major_dir_abs]:
+            for dbname in ['dewiki', 'enwiki', 'frwiki']:
+                self.create_empty_file(os.path.join(
+                    data_dir_abs, 'daily_raw', dbname + '.csv'))
+
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, serial_dir_abs, first_date, last_date,
+            additional_aggregators=additional_aggregators,
+            compute_all_projects=True)
+        aggregator.clear_cache()
+        aggregator.update_per_project_csvs_for_dates(
+            fixture, date_major_dir_abs, first_date, last_date,
+            additional_aggregators=additional_aggregators,
+            compute_all_projects=True, date_major=True)
+
+        # Date major updates do not keep days in memory.
+        self.assertEquals(len(aggregator.cache), 0)
+
+        serial_files = sorted(
+            os.path.relpath(os.path.join(dir_abs, file_name), serial_dir_abs)
+            for (dir_abs, dir_names, file_names) in os.walk(serial_dir_abs)
+            for file_name in file_names)
+        date_major_files = sorted(
+            os.path.relpath(os.path.join(dir_abs, file_name),
+                            date_major_dir_abs)
+            for (dir_abs, dir_names, file_names)
+            in os.walk(date_major_dir_abs)
+            for file_name in file_names)
+        self.assertEquals(date_major_files, serial_files)
+        for file_rel in serial_files:
+            with open(os.path.join(serial_dir_abs, file_rel)) as file:
+                expected = file.read()
+            with open(os.path.join(date_major_dir_abs, file_rel)) as file:
+                self.assertEquals(file.read(), expected)
+
+    def test_update_per_project_date_major_processes(self):
+        self.assertRaises(
+            ValueError, aggregator.update_per_project_csvs_for_dates,
+            self.get_fixture_dir_abs('2014-11-3projects-for-aggregation'),
+            self.data_dir_abs, datetime.date(2014, 11, 1),
+            datetime.date(2014, 11, 3), date_major=True, processes=2)
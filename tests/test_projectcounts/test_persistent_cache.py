@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+  Unit tests for the persistent cache
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  This module contains tests for the persistent daily aggregate cache of
+  aggregator.projectcounts.
+
+"""
+
+import aggregator
+import testcases
+import datetime
+import json
+import nose
+import os
+import threading
+
+
+class PersistentCacheTestCase(testcases.ProjectcountsTestCase):
+    """TestCase for the persistent daily aggregate cache"""
+    def setUp(self):
+        super(PersistentCacheTestCase, self).setUp()
+        self.cache_dir_abs = self.create_tmp_dir_abs()
+        self.source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        self.date = datetime.date(2014, 11, 1)
+        self.cache_file_abs = aggregator.get_persistent_cache_file_abs(
+            self.cache_dir_abs, self.source_dir_abs, self.date, False)
+
+    def tamper_cache_file(self, count):
+        # Changes the cached count for 'en' without changing the fingerprint,
+        # so we can tell whether the cache file got used.
+        with open(self.cache_file_abs, 'r') as cache_file:
+            entry = json.load(cache_file)
+        entry['data']['en'] = count
+        with open(self.cache_file_abs, 'w') as cache_file:
+            json.dump(entry, cache_file)
+
+    def tamper_hourly_cache_file(self, file_name, count):
+        # Changes the cached count for 'en' of a single hour without changing
+        # its fingerprint, so we can tell whether the hour got reused.
+        hourly_cache_file_abs = \
+            aggregator.get_persistent_cache_hourly_file_abs(
+                self.cache_file_abs)
+        with open(hourly_cache_file_abs, 'r') as hourly_cache_file:
+            entry = json.load(hourly_cache_file)
+        for (fingerprint_item, hourly_data) in entry['hours']:
+            if os.path.basename(fingerprint_item[0]) == file_name:
+                hourly_data['en'] = count
+        with open(hourly_cache_file_abs, 'w') as hourly_cache_file:
+            json.dump(entry, hourly_cache_file)
+
+    def remove_first_hour(self):
+        hourly_file_abs = os.path.join(
+            self.source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-010000')
+        os.unlink(hourly_file_abs)
+        return hourly_file_abs
+
+    def test_get_daily_count_writes_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+
+        self.assertEquals(actual, 24276)
+        self.assertTrue(os.path.isfile(self.cache_file_abs))
+
+    def test_get_daily_count_reads_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        self.tamper_cache_file(42)
+        aggregator.clear_cache()
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+
+        self.assertEquals(actual, 42)
+
+    def test_get_daily_count_stale_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        self.tamper_cache_file(42)
+        aggregator.clear_cache()
+        hourly_file_abs = os.path.join(
+            self.source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-010000')
+        self.create_file(hourly_file_abs, ['en - 2000 4'])
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+
+        # The first hour's file changed from 1000 to 2000
+        self.assertEquals(actual, 25276)
+
+    def test_get_daily_count_rebuild_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        self.tamper_cache_file(42)
+        aggregator.clear_cache()
+        aggregator.set_persistent_cache(self.cache_dir_abs, 'rebuild')
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+
+        self.assertEquals(actual, 24276)
+
+        # The rebuilt cache file holds the correct count again
+        aggregator.clear_cache()
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+        self.assertEquals(actual, 24276)
+
+    def test_get_daily_count_bypass_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs, 'bypass')
+
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+
+        self.assertFalse(os.path.exists(self.cache_file_abs))
+
+    def test_get_daily_count_incomplete_day_not_used_for_good_day(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        os.unlink(os.path.join(self.source_dir_abs, '2014', '2014-11',
+                               'projectcounts-20141101-010000'))
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date, allow_bad_data=True)
+        self.assertEquals(actual, 23276)
+        aggregator.clear_cache()
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.get_daily_count,
+                                 self.source_dir_abs, 'en', self.date)
+
+    def test_get_daily_count_incomplete_day_caches_hours(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        self.remove_first_hour()
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date, allow_bad_data=True)
+
+        self.assertEquals(actual, 23276)
+        self.assertEquals(
+            aggregator.get_cached_hours(self.source_dir_abs, self.date),
+            range(1, 24))
+        self.assertTrue(os.path.isfile(
+            aggregator.get_persistent_cache_hourly_file_abs(
+                self.cache_file_abs)))
+
+    def test_get_daily_count_incomplete_day_reads_only_new_hours(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        hourly_file_abs = self.remove_first_hour()
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date,
+                                   allow_bad_data=True)
+        aggregator.clear_cache()
+        self.tamper_hourly_cache_file('projectcounts-20141101-020000', 0)
+        self.create_file(hourly_file_abs, ['en - 1000 4'])
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date)
+
+        # The second hour's 1001 is taken from the tampered per-hour cache
+        # file. All other hours are reused as well, except for the newly
+        # arrived first hour.
+        self.assertEquals(actual, 23275)
+        self.assertEquals(
+            aggregator.get_cached_hours(self.source_dir_abs, self.date),
+            range(24))
+        # Complete days do not keep per-hour counts
+        self.assertFalse(os.path.exists(
+            aggregator.get_persistent_cache_hourly_file_abs(
+                self.cache_file_abs)))
+
+    def test_get_daily_count_incomplete_day_rereads_changed_hours(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        self.remove_first_hour()
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date,
+                                   allow_bad_data=True)
+        aggregator.clear_cache()
+        self.tamper_hourly_cache_file('projectcounts-20141101-020000', 0)
+        self.create_file(os.path.join(
+            self.source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-020000'), ['en - 2001 4'])
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, 'en',
+                                            self.date, allow_bad_data=True)
+
+        self.assertEquals(actual, 24276)
+
+    def test_get_daily_count_non_utf8_abbreviation(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        hourly_file_abs = os.path.join(
+            self.source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-010000')
+        self.create_file(hourly_file_abs, ['en - 1000 4', '\xff\xfe - 3 10'])
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, '\xff\xfe',
+                                            self.date)
+
+        self.assertEquals(actual, 3)
+
+        aggregator.clear_cache()
+        aggregator.reset_statistics()
+        actual = aggregator.get_daily_count(self.source_dir_abs, '\xff\xfe',
+                                            self.date)
+        self.assertEquals(actual, 3)
+        self.assertEquals(
+            aggregator.get_statistics()['persistent_cache_hits'], 1)
+
+    def test_get_daily_count_non_utf8_abbreviation_incomplete_day(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        hourly_file_abs = self.remove_first_hour()
+        self.create_file(os.path.join(
+            self.source_dir_abs, '2014', '2014-11',
+            'projectcounts-20141101-020000'), ['\xff\xfe - 3 10'])
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date,
+                                   allow_bad_data=True)
+        aggregator.clear_cache()
+        self.create_file(hourly_file_abs, ['en - 1000 4'])
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, '\xff\xfe',
+                                            self.date)
+
+        # The second hour's count is taken from the per-hour cache file.
+        self.assertEquals(actual, 3)
+
+    def test_read_persistent_cache_written_with_utf8(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        # Cache files without encoding have been written with UTF-8.
+        with open(self.cache_file_abs, 'r') as cache_file:
+            entry = json.load(cache_file)
+        del entry['encoding']
+        entry['data'][u'\xe4'] = 5
+        with open(self.cache_file_abs, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        aggregator.clear_cache()
+
+        actual = aggregator.get_daily_count(self.source_dir_abs, '\xc3\xa4',
+                                            self.date)
+
+        self.assertEquals(actual, 5)
+
+    def test_get_cached_hours_without_persistent_cache(self):
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+
+        self.assertIsNone(
+            aggregator.get_cached_hours(self.source_dir_abs, self.date))
+
+    def test_lock_persistently_cached_day(self):
+        lock = aggregator.lock_persistently_cached_day(self.cache_file_abs)
+
+        self.assertIsNone(aggregator.lock_persistently_cached_day(
+            self.cache_file_abs, False))
+
+        aggregator.unlock_persistently_cached_day(lock)
+        lock = aggregator.lock_persistently_cached_day(self.cache_file_abs,
+                                                       False)
+        self.assertIsNotNone(lock)
+        aggregator.unlock_persistently_cached_day(lock)
+
+    def test_get_daily_count_waits_for_other_aggregator(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        aggregator.clear_cache()
+        with open(self.cache_file_abs, 'r') as cache_file:
+            entry = json.load(cache_file)
+        os.unlink(self.cache_file_abs)
+
+        # While another aggregator holds the day's lock, we have to wait for
+        # its result instead of reading the hourly files ourselves.
+        lock = aggregator.lock_persistently_cached_day(self.cache_file_abs)
+        actual = []
+        thread = threading.Thread(
+            target=lambda: actual.append(aggregator.get_daily_count(
+                self.source_dir_abs, 'en', self.date)))
+        thread.start()
+        entry['data']['en'] = 42
+        with open(self.cache_file_abs, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        aggregator.unlock_persistently_cached_day(lock)
+        thread.join()
+
+        self.assertEquals(actual, [42])
+
+    def test_update_per_project_csvs_waits_for_other_aggregator(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        aggregator.get_daily_count(self.source_dir_abs, 'en', self.date)
+        aggregator.clear_cache()
+        with open(self.cache_file_abs, 'r') as cache_file:
+            entry = json.load(cache_file)
+        os.unlink(self.cache_file_abs)
+        target_dir_abs = self.create_tmp_dir_abs()
+        os.mkdir(os.path.join(target_dir_abs, 'daily_raw'))
+        csv_file_abs = os.path.join(target_dir_abs, 'daily_raw',
+                                    'enwiki.csv')
+        self.create_empty_file(csv_file_abs)
+
+        lock = aggregator.lock_persistently_cached_day(self.cache_file_abs)
+        thread = threading.Thread(
+            target=aggregator.update_per_project_csvs_for_dates,
+            args=(self.source_dir_abs, target_dir_abs, self.date,
+                  self.date))
+        thread.start()
+        entry['data']['en'] = 42
+        with open(self.cache_file_abs, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        aggregator.unlock_persistently_cached_day(lock)
+        thread.join()
+
+        self.assert_file_content_equals(csv_file_abs, [
+            '2014-11-01,42,42,0,0',
+            ])
+
+    def test_warm_cache_does_not_touch_csvs(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        target_dir_abs = self.create_tmp_dir_abs()
+        os.mkdir(os.path.join(target_dir_abs, 'daily_raw'))
+        csv_file_abs = os.path.join(target_dir_abs, 'daily_raw',
+                                    'enwiki.csv')
+        self.create_file(csv_file_abs, ['2014-11-02,1,1,0,0'])
+
+        aggregator.warm_cache(self.source_dir_abs, target_dir_abs,
+                              self.date, datetime.date(2014, 11, 2))
+
+        self.assertTrue(os.path.exists(self.cache_file_abs))
+        # The CSV has 2014-11-02 already, so that day does not get read.
+        self.assertFalse(os.path.exists(
+            aggregator.get_persistent_cache_file_abs(
+                self.cache_dir_abs, self.source_dir_abs,
+                datetime.date(2014, 11, 2), False)))
+        with open(csv_file_abs, 'r') as csv_file:
+            self.assertEquals(csv_file.read(), '2014-11-02,1,1,0,0' +
+                              aggregator.CSV_LINE_ENDING)
+
+    def test_update_per_project_csvs_after_warm_cache(self):
+        aggregator.set_persistent_cache(self.cache_dir_abs)
+        target_dir_abs = self.create_tmp_dir_abs()
+        os.mkdir(os.path.join(target_dir_abs, 'daily_raw'))
+        csv_file_abs = os.path.join(target_dir_abs, 'daily_raw',
+                                    'enwiki.csv')
+        self.create_empty_file(csv_file_abs)
+
+        aggregator.warm_cache(self.source_dir_abs, target_dir_abs,
+                              self.date, self.date)
+        aggregator.clear_cache()
+        aggregator.reset_statistics()
+        aggregator.update_per_project_csvs_for_dates(
+            self.source_dir_abs, target_dir_abs, self.date, self.date)
+
+        self.assert_file_content_equals(csv_file_abs, [
+            '2014-11-01,24276,24276,0,0',
+            ])
+        actual = aggregator.get_statistics()
+        self.assertEquals(actual['persistent_cache_hits'], 1)
+        self.assertEquals(actual['hourly_files_read'], 0)
+
+    def test_set_persistent_cache_unknown_mode(self):
+        nose.tools.assert_raises(ValueError,
+                                 aggregator.set_persistent_cache,
+                                 self.cache_dir_abs, 'foo')
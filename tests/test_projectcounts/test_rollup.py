@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+  Unit tests for daily rollup files
+  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  This module contains tests for daily rollup files of aggregator.rollup and
+  aggregator.projectcounts.
+
+"""
+
+import aggregator
+import testcases
+import datetime
+import nose
+import os
+
+
+class RollupTestCase(testcases.ProjectcountsTestCase):
+    """TestCase for daily rollup files"""
+    def setUp(self):
+        super(RollupTestCase, self).setUp()
+        self.rollup_dir_abs = self.create_tmp_dir_abs()
+
+    def test_rollup_for_date_different_wiki(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date)
+
+        actual = aggregator.aggregate_for_date(self.rollup_dir_abs, date)
+
+        expected = {'en': 1, 'de': 26, 'fr': 8}
+
+        self.assertEquals(actual, expected)
+
+    def test_rollup_for_date_abbreviations(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date)
+
+        actual = aggregator.aggregate_for_date(
+            self.rollup_dir_abs, date, abbreviations=set(['de']))
+
+        self.assertEquals(actual, {'de': 26})
+
+    def test_rollup_for_date_preferred_over_hourly_files(self):
+        source_dir_abs = self.copy_fixture_to_tmp_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.rollup_for_date(source_dir_abs, source_dir_abs, date)
+        os.unlink(os.path.join(source_dir_abs, '2014', '2014-11',
+                               'projectcounts-20141101-010000'))
+
+        actual = aggregator.aggregate_for_dates(source_dir_abs, date, date,
+                                                jobs=4)
+
+        self.assertEquals(list(actual), [(date, {'en': 24276})])
+
+    def test_rollup_for_date_hourly_columns(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date,
+                                   allow_bad_data=True, hourly_columns=True)
+
+        rollup_file_abs = aggregator.get_rollup_file_abs(
+            self.rollup_dir_abs, date, False)
+        (hours, daily_data, hourly_datas) = aggregator.read_daily_rollup(
+            rollup_file_abs, hourly_columns=True)
+
+        self.assertEquals(hours, [hour for hour in range(24) if hour != 12])
+        self.assertEquals(daily_data, {'en': 4864})
+        self.assertEquals(hourly_datas[0], {'en': 200})
+        self.assertEquals(hourly_datas[23], {'en': 223})
+
+    def test_rollup_for_date_missing_hours(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.rollup_for_date,
+                                 fixture, self.rollup_dir_abs, date)
+
+    def test_rollup_for_date_missing_hours_allow_bad_data(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date,
+                                   allow_bad_data=True)
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.aggregate_for_date,
+                                 self.rollup_dir_abs, date)
+
+        actual = aggregator.aggregate_for_date(self.rollup_dir_abs, date,
+                                               allow_bad_data=True)
+
+        self.assertEquals(actual, {'en': 4864})
+
+    def test_read_daily_rollup_hours(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date,
+                                   allow_bad_data=True)
+
+        actual = aggregator.read_daily_rollup_hours(
+            aggregator.get_rollup_file_abs(self.rollup_dir_abs, date, False))
+
+        self.assertEquals(actual, range(12) + range(13, 24))
+
+    def test_get_daily_count_missing_hours_rollup_not_reused(self):
+        fixture = self.get_fixture_dir_abs('2014-11-missing-hours')
+
+        date = datetime.date(2014, 11, 2)
+
+        aggregator.rollup_for_date(fixture, self.rollup_dir_abs, date,
+                                   allow_bad_data=True)
+
+        actual = aggregator.get_daily_count(self.rollup_dir_abs, 'en', date,
+                                            allow_bad_data=True)
+        self.assertEquals(actual, 4864)
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.get_daily_count,
+                                 self.rollup_dir_abs, 'en', date)
+
+    def test_read_daily_rollup_no_rollup_file(self):
+        file_abs = os.path.join(self.rollup_dir_abs, 'foo')
+        self.create_file(file_abs, ['en - 1 0'])
+
+        nose.tools.assert_raises(RuntimeError,
+                                 aggregator.read_daily_rollup, file_abs)
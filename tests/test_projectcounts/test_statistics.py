@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+  Unit tests for statistics
+  ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+  This module contains tests for the counters and timers of
+  aggregator.projectcounts.
+
+"""
+
+import aggregator
+import testcases
+import datetime
+import pickle
+
+
+class StatisticsTestCase(testcases.ProjectcountsTestCase):
+    """TestCase for counters and timers"""
+    def test_get_statistics_initial(self):
+        actual = aggregator.get_statistics()
+
+        self.assertEquals(actual['cache_hits'], 0)
+        self.assertEquals(actual['hourly_files_read'], 0)
+        self.assertEquals(actual['date_seconds'], {})
+
+    def test_get_statistics_aggregate_for_date(self):
+        fixture = self.get_fixture_dir_abs('2014-11-wrong-lines')
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.aggregate_for_date(fixture, date)
+
+        actual = aggregator.get_statistics()
+        self.assertEquals(actual['hourly_files_read'], 24)
+        self.assertEquals(actual['bytes_read'], 270)
+        self.assertEquals(actual['lines_parsed'], 25)
+        self.assertEquals(actual['malformed_lines'], 1)
+        self.assertEquals(actual['date_seconds'].keys(), [date])
+
+    def test_get_statistics_aggregate_for_dates_jobs(self):
+        fixture = self.get_fixture_dir_abs(
+            '2014-11-3days-enwiki-day-times-100-plus-hour')
+        first_date = datetime.date(2014, 11, 1)
+        last_date = datetime.date(2014, 11, 3)
+
+        list(aggregator.aggregate_for_dates(fixture, first_date, last_date,
+                                            jobs=4))
+
+        actual = aggregator.get_statistics()
+        self.assertEquals(actual['hourly_files_read'], 72)
+        self.assertEquals(sorted(actual['date_seconds']),
+                          list(aggregator.generate_dates(first_date,
+                                                         last_date)))
+
+    def test_get_statistics_cache_hits_and_misses(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+        date = datetime.date(2014, 11, 1)
+
+        aggregator.get_daily_count(fixture, 'en', date)
+        aggregator.get_daily_count(fixture, 'de', date)
+        aggregator.get_daily_count(fixture, 'en', date)
+
+        actual = aggregator.get_statistics()
+        self.assertEquals(actual['cache_hits'], 2)
+        self.assertEquals(actual['cache_misses'], 1)
+
+    def test_reset_statistics(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+        date = datetime.date(2014, 11, 1)
+        aggregator.get_daily_count(fixture, 'en', date)
+
+        aggregator.reset_statistics()
+
+        actual = aggregator.get_statistics()
+        self.assertEquals(actual['cache_misses'], 0)
+        self.assertEquals(actual['hourly_files_read'], 0)
+        self.assertEquals(actual['date_seconds'], {})
+
+    def test_get_statistics_summary(self):
+        fixture = self.get_fixture_dir_abs('2014-11-different-wikis')
+        date = datetime.date(2014, 11, 1)
+        aggregator.get_daily_count(fixture, 'en', date)
+        aggregator.get_daily_count(fixture, 'en', date)
+
+        actual = aggregator.get_statistics_summary()
+
+        self.assertEquals(actual[0],
+                          "Daily cache: 1 hits, 1 misses (50.0% hit rate)")
+        self.assertTrue(actual[2].startswith(
+            "Read 24 hourly files and 0 rollup files"))
+
+    def test_statistics_merge_pickled_snapshot(self):
+        date_1 = datetime.date(2014, 11, 1)
+        date_2 = datetime.date(2014, 11, 2)
+        statistics = aggregator.Statistics()
+        statistics.add('hourly_files_read', 24)
+        statistics.add_date_seconds(date_1, 2.0)
+        other = aggregator.Statistics()
+        other.add('hourly_files_read', 48)
+        other.add('bytes_read', 100)
+        other.add_date_seconds(date_1, 1.0)
+        other.add_date_seconds(date_2, 3.0)
+
+        statistics.merge(pickle.loads(pickle.dumps(other.snapshot())))
+
+        self.assertEquals(statistics.get_counters(), {
+            'hourly_files_read': 72,
+            'bytes_read': 100,
+            })
+        self.assertEquals(statistics.get_date_seconds(), {
+            date_1: 3.0,
+            date_2: 3.0,
+            })
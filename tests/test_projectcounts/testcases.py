@@ -49,6 +49,11 @@ class ProjectcountsTestCase(unittest.TestCase):
 
         return tmp_dir_abs
 
+    def copy_fixture_to_tmp_dir_abs(self, fixture_name):
+        tmp_dir_abs = os.path.join(self.create_tmp_dir_abs(), 'source')
+        shutil.copytree(self.get_fixture_dir_abs(fixture_name), tmp_dir_abs)
+        return tmp_dir_abs
+
     def create_empty_file(self, file_abs):
         open(os.path.join(file_abs), 'w').close()
 
@@ -78,6 +83,9 @@ class ProjectcountsTestCase(unittest.TestCase):
     def setUp(self):
         super(ProjectcountsTestCase, self).setUp()
         aggregator.clear_cache()
+        aggregator.set_persistent_cache(None)
+        aggregator.set_cache_budget()
+        aggregator.reset_statistics()
 
     def tearDown(self):
         try:
@@ -25,6 +25,8 @@ import unittest
 import nose
 import datetime
 import os
+import pickle
+import stat
 import tempfile
 
 FIXTURES_DIR_ABS = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -233,6 +235,81 @@ class UtilTestCase(unittest.TestCase):
             'foo')
         self.assertEqual(actual, None)
 
+    def test_dbnames_to_webstatscollector_abbreviations(self):
+        actual = aggregator.dbnames_to_webstatscollector_abbreviations([
+            'enwiki', 'wikidatawiki', 'foo'])
+        self.assertEqual(actual, frozenset([
+            'en', 'en.m', 'en.zero', 'www.wd', 'm.wd', 'zero.wd']))
+
+    def test_dbname_to_webstatscollector_abbreviation_first_match_wins(self):
+        # 'wikidatawiki' also ends in 'wiki', but is listed first.
+        actual = aggregator.dbname_to_webstatscollector_abbreviation(
+            'wikidatawiki', 'zero')
+        self.assertEqual(actual, 'zero.wd')
+
+    def test_dbnames_to_webstatscollector_abbreviation_table(self):
+        actual = aggregator.dbnames_to_webstatscollector_abbreviation_table([
+            'enwiki', 'de_formalwikibooks', 'foo'])
+        self.assertEqual(actual, {
+            'enwiki': ('en', 'en.m', 'en.zero'),
+            'de_formalwikibooks': ('de-formal.b', 'de-formal.m.b',
+                                   'de-formal.zero.b'),
+            'foo': (None, None, None),
+            })
+
+    def test_webstatscollector_abbreviation_to_dbnames_enwiki(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames('en')
+        self.assertEqual(actual, [('enwiki', 'desktop')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_zero(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames(
+            'en.zero')
+        self.assertEqual(actual, [('enwiki', 'zero')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_wikibooks_mobile(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames(
+            'de-formal.m.b')
+        self.assertEqual(actual, [('de_formalwikibooks', 'mobile')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_wikidata(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames(
+            'www.wd')
+        self.assertEqual(actual, [('wikidatawiki', 'desktop')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_wikidata_mobile(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames('m.wd')
+        self.assertEqual(actual, [('mwikidatawiki', 'desktop'),
+                                  ('wikidatawiki', 'mobile')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_commons(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames(
+            'commons.m')
+        self.assertEqual(actual, [('commonswiki', 'desktop'),
+                                  ('commonswikimedia', 'desktop')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_ambiguous(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames('uk.m')
+        self.assertEqual(actual, [('ukwiki', 'mobile'),
+                                  ('ukwikimedia', 'desktop')])
+
+    def test_webstatscollector_abbreviation_to_dbnames_foo(self):
+        actual = aggregator.webstatscollector_abbreviation_to_dbnames(
+            'foo.bar')
+        self.assertEqual(actual, [])
+
+    def test_webstatscollector_abbreviation_to_dbnames_round_trip(self):
+        for dbname in ['enwiki', 'be_x_oldwiki', 'wikidatawiki',
+                       'mediawikiwiki', 'foundationwiki', 'metawiki',
+                       'ukwikimedia', 'enwikivoyage', 'dewiktionary']:
+            for site in aggregator.WEBSTATSCOLLECTOR_SITES:
+                abbreviation = \
+                    aggregator.dbname_to_webstatscollector_abbreviation(
+                        dbname, site)
+                self.assertIn(
+                    (dbname, site),
+                    aggregator.webstatscollector_abbreviation_to_dbnames(
+                        abbreviation))
+
     def test_update_csv_data_dict_single_column(self):
         csv_data = {}
         actual = aggregator.update_csv_data_dict(csv_data, '2014-06-12')
@@ -255,6 +332,90 @@ class UtilTestCase(unittest.TestCase):
             '2014-06-12': '2014-06-12,47,4711'
             })
 
+    def test_update_csv_data_dict_typed_columns(self):
+        csv_data = {}
+        actual = aggregator.update_csv_data_dict(csv_data, '2014-06-12', 47,
+                                                 None, '4711', 'foo')
+        self.assertEqual(actual['2014-06-12'].columns,
+                         (47, None, 4711, 'foo'))
+        self.assertEqual(str(actual['2014-06-12']), '2014-06-12,47,,4711,foo')
+
+    def test_csv_row_from_line(self):
+        row = aggregator.CsvRow('2014-06-12', line='2014-06-12,47,,047,foo')
+
+        self.assertEqual(row.columns, (47, None, '047', 'foo'))
+        self.assertEqual(str(row), '2014-06-12,47,,047,foo')
+
+    def test_csv_row_equality(self):
+        row = aggregator.CsvRow('2014-06-12', [47, None, 4711])
+
+        self.assertEqual(row, '2014-06-12,47,,4711')
+        self.assertEqual(row, aggregator.CsvRow(
+            '2014-06-12', line='2014-06-12,47,,4711'))
+        self.assertNotEqual(row, aggregator.CsvRow(
+            '2014-06-12', line='2014-06-12,47,0,4711'))
+        self.assertNotEqual(row, '2014-06-12,47,0,4711')
+
+    def test_as_csv_row(self):
+        row = aggregator.CsvRow('2014-06-12', [47])
+        self.assertIs(aggregator.as_csv_row(row), row)
+
+        row = aggregator.as_csv_row('2014-06-12,47')
+        self.assertEqual(row.first_column, '2014-06-12')
+        self.assertEqual(row.columns, (47,))
+
+    def test_csv_column_to_int(self):
+        self.assertEqual(aggregator.csv_column_to_int(47), 47)
+        self.assertEqual(aggregator.csv_column_to_int(' 047 '), 47)
+        nose.tools.assert_raises(
+            ValueError, aggregator.csv_column_to_int, None)
+        nose.tools.assert_raises(
+            ValueError, aggregator.csv_column_to_int, 'foo')
+
+    def test_csv_series_order(self):
+        csv_series = aggregator.CsvSeries()
+        csv_series['2014-06-12'] = 'b'
+        csv_series['2014-06-14'] = 'd'
+        csv_series['2014-06-11'] = 'a'
+        csv_series['2014-06-13'] = 'c'
+        csv_series['2014-06-12'] = 'B'
+        csv_series.setdefault('2014-06-10', 'z')
+
+        self.assertEqual(list(csv_series.iterkeys_sorted()), [
+            '2014-06-10', '2014-06-11', '2014-06-12', '2014-06-13',
+            '2014-06-14'])
+        self.assertEqual(list(csv_series.itervalues_sorted()),
+                         ['z', 'a', 'B', 'c', 'd'])
+
+    def test_csv_series_removal(self):
+        csv_series = aggregator.CsvSeries({
+            '2014-06-11': 'a',
+            '2014-06-12': 'b',
+            '2014-06-13': 'c',
+            '2014-06-14': 'd',
+            })
+
+        del csv_series['2014-06-12']
+        self.assertEqual(csv_series.pop('2014-06-11'), 'a')
+        self.assertEqual(csv_series.pop('2014-06-11', 'x'), 'x')
+        self.assertEqual(csv_series.popitem(), ('2014-06-14', 'd'))
+
+        self.assertEqual(csv_series, {'2014-06-13': 'c'})
+        self.assertEqual(list(csv_series.iterkeys_sorted()), ['2014-06-13'])
+
+        csv_series.clear()
+        self.assertEqual(list(csv_series.iterkeys_sorted()), [])
+
+    def test_csv_series_copy(self):
+        csv_series = aggregator.CsvSeries(
+            [('2014W02', 'b'), ('2014W01', 'a')])
+
+        for copy in [csv_series.copy(),
+                     pickle.loads(pickle.dumps(csv_series, 2))]:
+            self.assertIsInstance(copy, aggregator.CsvSeries)
+            self.assertEqual(list(copy.iteritems_sorted()), [
+                ('2014W01', 'a'), ('2014W02', 'b')])
+
 
 class FileSystemUtilTestCase(unittest.TestCase):
     def get_fixture_abs(self, fixture_name):
@@ -335,6 +496,137 @@ class FileSystemUtilTestCase(unittest.TestCase):
             '2014-05-15': '2014-05-15,quux',
             })
 
+    def test_csv_parser_unterminated_last_line(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-13,3,4\r\n2014-05-14,5')
+
+        actual = aggregator.parse_csv_to_first_column_dict(self.temp_file_abs)
+
+        self.assertEqual(actual, {
+            '2014-05-12': '2014-05-12,1,2',
+            '2014-05-13': '2014-05-13,3,4',
+            })
+
+    def test_csv_parser_complete_unterminated_last_line(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2,\r\n2014-05-13,3,4,')
+
+        actual = aggregator.parse_csv_to_first_column_dict(self.temp_file_abs)
+
+        self.assertEqual(actual, {
+            '2014-05-12': '2014-05-12,1,2,',
+            '2014-05-13': '2014-05-13,3,4,',
+            })
+
+    def test_csv_parser_unterminated_last_line_not_integer(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-13,3,4x')
+
+        actual = aggregator.parse_csv_to_first_column_dict(self.temp_file_abs)
+
+        self.assertEqual(actual, {
+            '2014-05-12': '2014-05-12,1,2',
+            })
+
+    def test_csv_parser_unterminated_last_line_unvalidated(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-13,foo')
+
+        actual = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs, validate_unterminated_last_line=False)
+
+        self.assertEqual(actual, {
+            '2014-05-12': '2014-05-12,1,2',
+            '2014-05-13': '2014-05-13,foo',
+            })
+
+    def test_csv_tail_parser_non_existing_file(self):
+        temp_dir_abs = tempfile.mkdtemp()
+        try:
+            temp_file_abs = os.path.join(temp_dir_abs, "foo.csv")
+
+            actual = aggregator.parse_csv_tail_to_first_columns(
+                temp_file_abs, '2014-05-12')
+            self.assertEqual(actual, set())
+        finally:
+            os.rmdir(temp_dir_abs)
+
+    def test_csv_tail_parser_empty_file(self):
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            self.temp_file_abs, '2014-05-12')
+        self.assertEqual(actual, set())
+
+    def test_csv_tail_parser_small_with_header(self):
+        csv_file_abs = self.get_fixture_abs('csv_small_with_header.csv')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            csv_file_abs, '2014-05-01')
+
+        self.assertEqual(actual, set(['2014-05-12', '2014-05-13']))
+
+    def test_csv_tail_parser_stops_at_min_first_column(self):
+        csv_file_abs = self.get_fixture_abs(
+            'csv_with_different_line_endings.csv')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            csv_file_abs, '2014-05-13')
+
+        self.assertEqual(actual, set(['2014-05-13', '2014-05-14',
+                                      '2014-05-15']))
+
+    def test_csv_tail_parser_several_blocks(self):
+        lines = ['Date,Count'] + [
+            '2014-%02d-%02d,%d' % (month, day, day)
+            for month in range(1, 13) for day in range(1, 29)]
+        with open(self.temp_file_abs, 'w') as file:
+            file.write(aggregator.CSV_LINE_ENDING.join(lines) +
+                       aggregator.CSV_LINE_ENDING)
+
+        first_columns = set(line.split(',')[0] for line in lines[1:])
+        for min_first_column in ['2014-12-10', '2014-03-05', '2013-01-01']:
+            actual = aggregator.parse_csv_tail_to_first_columns(
+                self.temp_file_abs, min_first_column)
+
+            self.assertEqual(actual, set(
+                first_column for first_column in first_columns
+                if first_column >= min_first_column))
+
+    def test_csv_tail_parser_unterminated_last_line(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-13,3,4')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            self.temp_file_abs, '2014-05-01')
+
+        self.assertIsNone(actual)
+
+    def test_csv_tail_parser_last_line_without_LF(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-13,3,4\r')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            self.temp_file_abs, '2014-05-01')
+
+        self.assertIsNone(actual)
+
+    def test_csv_tail_parser_unsorted(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-13,3,4\r\n2014-05-12,1,2\r\n')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            self.temp_file_abs, '2014-05-01')
+
+        self.assertIsNone(actual)
+
+    def test_csv_tail_parser_duplicate(self):
+        with open(self.temp_file_abs, 'w') as file:
+            file.write('2014-05-12,1,2\r\n2014-05-12,3,4\r\n')
+
+        actual = aggregator.parse_csv_tail_to_first_columns(
+            self.temp_file_abs, '2014-05-01')
+
+        self.assertIsNone(actual)
+
     def test_csv_writer_empty_dict_without_header(self):
         csv_data = {}
 
@@ -409,6 +701,310 @@ class FileSystemUtilTestCase(unittest.TestCase):
             "2014-05-13,3,4",
             ])
 
+    def write_temp_file_lines(self, lines):
+        with open(self.temp_file_abs, 'w') as file:
+            for line in lines:
+                file.write(line + aggregator.CSV_LINE_ENDING)
+
+    def test_csv_writer_append(self):
+        # The existing lines are not fully sorted, so we can tell whether the
+        # file got rewritten.
+        self.write_temp_file_lines([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-11,0,1",
+            "2014-05-13,3,4",
+            ])
+        existing_csv_data = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs)
+        csv_data = dict(existing_csv_data)
+        csv_data["2014-05-15"] = "2014-05-15,7,8"
+        csv_data["2014-05-14"] = "2014-05-14,5,6"
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, csv_data, header="Date,CountA,CountB",
+            existing_csv_data=existing_csv_data)
+
+        self.assert_temp_file_content_equals([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-11,0,1",
+            "2014-05-13,3,4",
+            "2014-05-14,5,6",
+            "2014-05-15,7,8",
+            ])
+
+    def test_csv_writer_append_nothing(self):
+        self.write_temp_file_lines([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-11,0,1",
+            "2014-05-13,3,4",
+            ])
+        existing_csv_data = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs)
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, dict(existing_csv_data),
+            header="Date,CountA,CountB", existing_csv_data=existing_csv_data)
+
+        self.assert_temp_file_content_equals([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-11,0,1",
+            "2014-05-13,3,4",
+            ])
+
+    def test_csv_writer_batch_append(self):
+        self.write_temp_file_lines([
+            "2014-05-12,1,2",
+            ])
+        existing_csv_data = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs)
+        csv_data = dict(existing_csv_data)
+        csv_data["2014-05-13"] = "2014-05-13,3,4"
+
+        aggregator.start_csv_write_batch()
+        try:
+            aggregator.write_dict_values_sorted_to_csv(
+                self.temp_file_abs, csv_data,
+                existing_csv_data=existing_csv_data)
+
+            self.assertEqual(aggregator.util.csv_write_batch,
+                             [(self.temp_file_abs, None)])
+        finally:
+            aggregator.finish_csv_write_batch()
+
+        self.assert_temp_file_content_equals([
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ])
+        self.assertIsNone(aggregator.util.csv_write_batch)
+
+    def test_csv_writer_append_after_cut_short_append(self):
+        # The last line got cut short by a crash while appending.
+        with open(self.temp_file_abs, 'w') as file:
+            file.write("Date,CountA,CountB\r\n2014-05-12,1,2\r\n2014-05-13,3")
+        existing_csv_data = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs)
+        csv_data = dict(existing_csv_data)
+        csv_data["2014-05-13"] = "2014-05-13,3,4"
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, csv_data, header="Date,CountA,CountB",
+            existing_csv_data=existing_csv_data)
+
+        self.assert_temp_file_content_equals([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ])
+
+    def assert_csv_writer_rewrites(self, existing_lines, update):
+        self.write_temp_file_lines(existing_lines)
+        existing_csv_data = aggregator.parse_csv_to_first_column_dict(
+            self.temp_file_abs)
+        csv_data = dict(existing_csv_data)
+        update(csv_data)
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, csv_data, header="Date,CountA,CountB",
+            existing_csv_data=existing_csv_data)
+
+        self.assert_temp_file_content_equals(
+            ["Date,CountA,CountB"] + sorted(
+                str(row) for row in csv_data.values()))
+
+    def test_csv_writer_append_inserted_line(self):
+        def update(csv_data):
+            csv_data["2014-05-11"] = "2014-05-11,5,6"
+        self.assert_csv_writer_rewrites([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ], update)
+
+    def test_csv_writer_append_removed_line(self):
+        def update(csv_data):
+            del csv_data["2014-05-12"]
+            csv_data["2014-05-14"] = "2014-05-14,5,6"
+        self.assert_csv_writer_rewrites([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ], update)
+
+    def test_csv_writer_append_changed_line(self):
+        def update(csv_data):
+            csv_data["2014-05-12"] = "2014-05-12,9,9"
+            csv_data["2014-05-14"] = "2014-05-14,5,6"
+        self.assert_csv_writer_rewrites([
+            "Date,CountA,CountB",
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ], update)
+
+    def test_csv_writer_append_without_header(self):
+        def update(csv_data):
+            csv_data["2014-05-14"] = "2014-05-14,5,6"
+        self.assert_csv_writer_rewrites([
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ], update)
+
+    def test_csv_writer_csv_series(self):
+        csv_series = aggregator.CsvSeries()
+        aggregator.update_csv_data_dict(csv_series, '2014-05-13', 3, 4)
+        aggregator.update_csv_data_dict(csv_series, '2014-05-11', 0, 1)
+        aggregator.update_csv_data_dict(csv_series, '2014-05-12', 1, 2)
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, csv_series, header="Date,CountA,CountB")
+
+        self.assert_temp_file_content_equals([
+            "Date,CountA,CountB",
+            "2014-05-11,0,1",
+            "2014-05-12,1,2",
+            "2014-05-13,3,4",
+            ])
+
+    def test_csv_parser_csv_series(self):
+        self.write_temp_file_lines([
+            "Date,CountA,CountB",
+            "2014-05-13,3,4",
+            "2014-05-11,0,1",
+            ])
+
+        actual = aggregator.parse_csv_to_first_column_dict(self.temp_file_abs)
+
+        self.assertIsInstance(actual, aggregator.CsvSeries)
+        self.assertEqual(list(actual.iterkeys_sorted()),
+                         ['2014-05-11', '2014-05-13'])
+
+    def test_csv_writer_batch(self):
+        self.write_temp_file_lines(["2014-05-12,1,2"])
+
+        aggregator.start_csv_write_batch()
+        try:
+            aggregator.write_dict_values_sorted_to_csv(
+                self.temp_file_abs, {"2014-05-13": "2014-05-13,3,4"})
+
+            # The CSV only gets replaced once the batch is finished.
+            self.assert_temp_file_content_equals(["2014-05-12,1,2"])
+            [(csv_file_abs, tmp_file_abs)] = aggregator.util.csv_write_batch
+            self.assertEqual(csv_file_abs, self.temp_file_abs)
+            self.assertTrue(os.path.isfile(tmp_file_abs))
+        finally:
+            aggregator.finish_csv_write_batch()
+
+        self.assert_temp_file_content_equals(["2014-05-13,3,4"])
+        self.assertFalse(os.path.exists(tmp_file_abs))
+        self.assertIsNone(aggregator.util.csv_write_batch)
+
+    def test_csv_writer_pop_batch(self):
+        self.write_temp_file_lines(["2014-05-12,1,2"])
+
+        aggregator.start_csv_write_batch()
+        try:
+            aggregator.write_dict_values_sorted_to_csv(
+                self.temp_file_abs, {"2014-05-13": "2014-05-13,3,4"})
+            writes = aggregator.pop_csv_write_batch()
+        finally:
+            aggregator.finish_csv_write_batch()
+
+        # Popped writes are left to the caller.
+        self.assert_temp_file_content_equals(["2014-05-12,1,2"])
+
+        aggregator.sync_csv_writes(writes)
+
+        self.assert_temp_file_content_equals(["2014-05-13,3,4"])
+
+    def test_sync_csv_writes_failing_removes_temporary_files(self):
+        temp_dir_abs = tempfile.mkdtemp()
+        try:
+            csv_file_abs = os.path.join(temp_dir_abs, "foo.csv")
+            with open(csv_file_abs, 'w') as file:
+                file.write("2014-05-12,1,2" + aggregator.CSV_LINE_ENDING)
+            aggregator.start_csv_write_batch()
+            try:
+                aggregator.write_dict_values_sorted_to_csv(
+                    csv_file_abs, {"2014-05-13": "2014-05-13,3,4"})
+                writes = aggregator.pop_csv_write_batch()
+            finally:
+                aggregator.finish_csv_write_batch()
+
+            nose.tools.assert_raises(
+                OSError,
+                aggregator.sync_csv_writes,
+                writes + [(os.path.join(temp_dir_abs, "missing.csv"), None)])
+
+            self.assertEqual(os.listdir(temp_dir_abs), ["foo.csv"])
+            with open(csv_file_abs, 'r') as file:
+                self.assertEqual(file.read(),
+                                 "2014-05-12,1,2" + aggregator.CSV_LINE_ENDING)
+        finally:
+            for file_name in os.listdir(temp_dir_abs):
+                os.unlink(os.path.join(temp_dir_abs, file_name))
+            os.rmdir(temp_dir_abs)
+
+    def test_csv_writer_keeps_mode(self):
+        self.write_temp_file_lines(["2014-05-12,1,2"])
+        os.chmod(self.temp_file_abs, 0664)
+
+        aggregator.write_dict_values_sorted_to_csv(
+            self.temp_file_abs, {"2014-05-13": "2014-05-13,3,4"})
+
+        self.assert_temp_file_content_equals(["2014-05-13,3,4"])
+        self.assertEqual(stat.S_IMODE(os.stat(self.temp_file_abs).st_mode),
+                         0664)
+
+    def test_csv_writer_new_file_mode(self):
+        temp_dir_abs = tempfile.mkdtemp()
+        try:
+            csv_file_abs = os.path.join(temp_dir_abs, "foo.csv")
+
+            aggregator.write_dict_values_sorted_to_csv(
+                csv_file_abs, {"2014-05-13": "2014-05-13,3,4"})
+
+            self.assertEqual(stat.S_IMODE(os.stat(csv_file_abs).st_mode),
+                             0666 & ~aggregator.UMASK)
+            os.unlink(csv_file_abs)
+        finally:
+            os.rmdir(temp_dir_abs)
+
+    def test_csv_writer_failing_keeps_file(self):
+        temp_dir_abs = tempfile.mkdtemp()
+        try:
+            csv_file_abs = os.path.join(temp_dir_abs, "foo.csv")
+            with open(csv_file_abs, 'w') as file:
+                file.write("2014-05-12,1,2" + aggregator.CSV_LINE_ENDING)
+
+            class Unformattable(object):
+                def __str__(self):
+                    raise TypeError()
+
+            nose.tools.assert_raises(
+                TypeError,
+                aggregator.write_dict_values_sorted_to_csv,
+                csv_file_abs, {"2014-05-13": Unformattable()})
+
+            self.assertEqual(os.listdir(temp_dir_abs), ["foo.csv"])
+            with open(csv_file_abs, 'r') as file:
+                self.assertEqual(file.read(),
+                                 "2014-05-12,1,2" + aggregator.CSV_LINE_ENDING)
+        finally:
+            for file_name in os.listdir(temp_dir_abs):
+                os.unlink(os.path.join(temp_dir_abs, file_name))
+            os.rmdir(temp_dir_abs)
+
+    def test_sync_dirs(self):
+        temp_dir_abs = tempfile.mkdtemp()
+        try:
+            aggregator.sync_dirs([
+                temp_dir_abs, os.path.join(temp_dir_abs, "missing")])
+        finally:
+            os.rmdir(temp_dir_abs)
+
     def test_merge_sum_csv_data_dict_with_empty_add_dict(self):
         dict_1 = {
             '2014-01-01': '2014-01-01,6,3,2,1',
@@ -465,3 +1061,40 @@ class FileSystemUtilTestCase(unittest.TestCase):
             aggregator.merge_sum_csv_data_dict,
             dict_1,
             dict_2)
+
+    def test_prefetch(self):
+        actual = list(aggregator.prefetch(xrange(10), 2))
+
+        self.assertEqual(actual, range(10))
+
+    def test_prefetch_reraises_after_previous_items(self):
+        def generate():
+            yield 1
+            yield 2
+            raise RuntimeError("foo")
+
+        actual = []
+        try:
+            for item in aggregator.prefetch(generate(), 1):
+                actual.append(item)
+            self.fail("No RuntimeError raised")
+        except RuntimeError:
+            pass
+
+        self.assertEqual(actual, [1, 2])
+
+    def test_prefetch_closes_generator_on_early_stop(self):
+        closed = []
+
+        def generate():
+            try:
+                for item in xrange(100):
+                    yield item
+            finally:
+                closed.append(True)
+
+        prefetched = aggregator.prefetch(generate(), 2)
+        self.assertEqual(next(prefetched), 0)
+        prefetched.close()
+
+        self.assertEqual(closed, [True])